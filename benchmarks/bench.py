@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Performance regression benchmarks for passlib-cli.
+
+Measures startup time of the console scripts, method registry operations,
+and hash/verify latency for each supported method at cheap, fixed params.
+Results are compared to a baseline, and the script exits with an error if
+any benchmark is slower than the baseline allows, or is missing.
+
+Baselines are host specific, and are not shipped - store a baseline on the
+host that runs the comparison first; comparing without a baseline fails
+before any benchmark runs.  Timings are normalized by a calibration
+workload (bare interpreter startup for process benchmarks, a fixed pure
+python loop for in-process benchmarks), to even out changes in host load
+between runs.
+
+Usage:
+
+    python benchmarks/bench.py --update   # store a baseline
+    python benchmarks/bench.py            # compare with baseline
+"""
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+)
+import argparse
+import io
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+import warnings
+
+logger = logging.getLogger('bench')
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'src')
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+DEFAULT_TOLERANCE = 0.3
+
+# Slowdowns smaller than this (normalized, i.e. a fraction of a calibration
+# run) are within timing noise, e.g. for hashes that take a microsecond.
+MIN_SLOWDOWN = 0.001
+
+CONSOLE_SCRIPTS = (
+    ('passlib-auth-server', 'passlib_cli.authserver'),
+    ('passlib-autocomplete', 'passlib_cli.complete'),
+    ('passlib-credstore', 'passlib_cli.credstore'),
+    ('passlib-mkpasswd', 'passlib_cli.mkpasswd'),
+    ('passlib-pwgen', 'passlib_cli.generate'),
+    ('passlib-totp', 'passlib_cli.totp'),
+)
+
+# min time to spend on each in-process benchmark (seconds)
+MIN_TIME = 0.1
+MIN_REPEAT = 5
+SAMPLE_TIME = 0.01
+
+# times to re-run slower benchmarks, before reporting them
+RETRIES = 3
+
+
+#
+# Timing helpers
+#
+# The best (minimal) time of several runs is used, as it is the least
+# affected by other load on the host.
+#
+
+def _get_env():
+    # benchmark the working tree, not some installed version
+    path = os.environ.get('PYTHONPATH')
+    return dict(os.environ,
+                PYTHONPATH=SRC_DIR + (os.pathsep + path if path else ''))
+
+
+def time_subprocess(code, repeat):
+    """ best wall time of running python code in a fresh interpreter. """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True,
+                       stdout=subprocess.DEVNULL, env=_get_env())
+        samples.append(time.perf_counter() - start)
+    return min(samples)
+
+
+def time_reported(code, repeat):
+    """ best time reported by python code in a fresh interpreter. """
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], check=True,
+                                stdout=subprocess.PIPE,
+                                env=_get_env()).stdout
+        samples.append(float(output.decode('ascii').strip().split()[-1]))
+    return min(samples)
+
+
+def time_call(func, min_time=MIN_TIME, min_repeat=MIN_REPEAT):
+    """ best time of calling func, repeated for at least min_time.
+
+    Fast functions are called in loops of at least SAMPLE_TIME seconds, to
+    keep timer overhead out of the results.
+    """
+    import timeit
+    timer = timeit.Timer(func)
+    number = 1
+    elapsed = timer.timeit(number)
+    while elapsed < SAMPLE_TIME:
+        number *= 2
+        elapsed = timer.timeit(number)
+    samples = [elapsed / number]
+    total = elapsed
+    while len(samples) < min_repeat or total < min_time:
+        elapsed = timer.timeit(number)
+        samples.append(elapsed / number)
+        total += elapsed
+    return min(samples)
+
+
+def calibration_loop():
+    total = 0
+    for i in range(200000):
+        total += i * i % 7
+    return total
+
+
+#
+# Benchmarks
+#
+# Each benchmark yields (name, seconds, calibration) tuples, where
+# calibration is the name of the calibration value to normalize by.
+#
+
+def bench_startup(wanted, repeat):
+    # bare interpreter startup is the 'startup' calibration, not a benchmark
+    for script, module in CONSOLE_SCRIPTS:
+        if not wanted('startup.' + script):
+            continue
+        code = ("import sys; sys.argv = [{0!r}, '--version']; "
+                "from {1} import main\n"
+                "try:\n    main()\nexcept SystemExit:\n    pass"
+                ).format(script, module)
+        yield ('startup.' + script, time_subprocess(code, repeat), 'startup')
+
+
+_import_methods = """
+import time
+start = time.perf_counter()
+import passlib_cli.methods
+print(time.perf_counter() - start)
+"""
+
+_iter_supported = """
+import time, warnings
+warnings.simplefilter('ignore')
+from passlib_cli import methods
+start = time.perf_counter()
+list(methods.iter_supported_methods())
+print(time.perf_counter() - start)
+"""
+
+_output_columns = """
+import contextlib, io, time, warnings
+warnings.simplefilter('ignore')
+from passlib_cli import methods, mkpasswd
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    mkpasswd.output_columns(methods.iter_all_methods())
+print(time.perf_counter() - start)
+"""
+
+
+def bench_registry(wanted, repeat):
+    # these are measured in fresh interpreters, as the registry is loaded
+    # once per process
+    for name, code in (
+            ('import.methods', _import_methods),
+            ('registry.iter_supported_methods', _iter_supported),
+            ('registry.output_columns', _output_columns)):
+        if wanted(name):
+            yield name, time_reported(code, repeat), 'startup'
+
+
+def get_cheap_params(method):
+    """ fixed, cheap params for a method. """
+    params = {}
+    min_rounds = getattr(method.method, 'min_rounds', None)
+    if 'rounds' in method.settings and min_rounds is not None:
+        params['rounds'] = max(min_rounds, 1)
+    if method.require_user:
+        params['user'] = 'bench'
+    return params
+
+
+def bench_methods(wanted, repeat):
+    from passlib_cli import methods
+    password = 'hunter2'
+    for method in methods.iter_supported_methods():
+        hash_name = 'hash.' + method.name
+        verify_name = 'verify.' + method.name
+        if not (wanted(hash_name) or wanted(verify_name)):
+            continue
+        params = get_cheap_params(method)
+        verify_params = dict(
+            (k, v) for k, v in params.items() if k == 'user')
+        try:
+            cryptstring = method(password, **params)
+        except Exception as e:
+            logger.info("skipping %s: %s", method.name, e)
+            continue
+        if wanted(hash_name):
+            yield (hash_name,
+                   time_call(lambda: method(password, **params)),
+                   'cpu')
+        if wanted(verify_name):
+            yield (verify_name,
+                   time_call(lambda: method.verify(password, cryptstring,
+                                                   **verify_params)),
+                   'cpu')
+
+
+def calibrate(repeat):
+    return {
+        'startup': time_subprocess('pass', repeat),
+        'cpu': time_call(calibration_loop),
+    }
+
+
+def run_benchmarks(repeat, name_filter=None):
+    def wanted(name):
+        return not name_filter or bool(name_filter.search(name))
+
+    # Calibrate both before and after the benchmarks, and keep the best
+    # times, so that a single noisy calibration doesn't skew all results.
+    calibration = calibrate(repeat)
+    benchmarks = [bench_startup, bench_registry, bench_methods]
+    timings = []
+    for bench in benchmarks:
+        for name, seconds, calibrate_by in bench(wanted, repeat):
+            timings.append((name, seconds, calibrate_by))
+            logger.info("%-45s %10.6fs", name, seconds)
+    for key, seconds in calibrate(repeat).items():
+        calibration[key] = min(calibration[key], seconds)
+
+    results = {}
+    for name, seconds, calibrate_by in timings:
+        results[name] = {
+            'seconds': seconds,
+            'normalized': seconds / calibration[calibrate_by],
+        }
+    return {'calibration': calibration, 'results': results}
+
+
+#
+# Baseline comparison
+#
+
+def compare(baseline, current, tolerance, name_filter=None):
+    """ compare results with a baseline.
+
+    A benchmark is 'SLOWER' if it is more than `tolerance` slower, and by
+    more than `MIN_SLOWDOWN`.  Baseline benchmarks that match the filter,
+    but are missing from the current results, are reported as 'MISSING'.
+
+    :return list: (name, baseline, current, ratio, status) tuples
+    """
+    def get_ratio(cur, base):
+        return cur / base if base else float('inf')
+
+    rows = []
+    base_results = baseline.get('results', {})
+    names = set(current['results']).union(
+        name for name in base_results
+        if not name_filter or name_filter.search(name))
+    for name in sorted(names):
+        if name not in current['results']:
+            rows.append((name, base_results[name]['normalized'], None, None,
+                         'MISSING'))
+            continue
+        cur = current['results'][name]
+        if name not in base_results:
+            rows.append((name, None, cur['normalized'], None, 'new'))
+            continue
+        base = base_results[name]
+        # A real slowdown shows up both in raw and normalized timings, while
+        # a drifting calibration or a slower host only affects one of them.
+        ratio = min(get_ratio(cur['normalized'], base['normalized']),
+                    get_ratio(cur['seconds'], base['seconds']))
+        slowdown = cur['normalized'] - base['normalized']
+        if ratio > 1 + tolerance and slowdown > MIN_SLOWDOWN:
+            status = 'SLOWER'
+        else:
+            status = 'ok'
+        rows.append((name, base['normalized'], cur['normalized'], ratio,
+                     status))
+    return rows
+
+
+def format_rows(rows):
+    lines = ['{0:45}  {1:>10}  {2:>10}  {3:>7}  {4}'.format(
+        'benchmark', 'baseline', 'current', 'ratio', 'status')]
+    for name, base, cur, ratio, status in rows:
+        lines.append('{0:45}  {1:>10}  {2:>10}  {3:>7}  {4}'.format(
+            name,
+            '-' if base is None else '{0:.4f}'.format(base),
+            '-' if cur is None else '{0:.4f}'.format(cur),
+            '-' if ratio is None else '{0:.2f}'.format(ratio),
+            status))
+    return '\n'.join(lines)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Run passlib-cli performance benchmarks",
+    )
+    parser.add_argument(
+        '--baseline',
+        default=DEFAULT_BASELINE,
+        help="baseline file (default: %(default)s)",
+        metavar='FILE',
+    )
+    parser.add_argument(
+        '--update',
+        action='store_true',
+        default=False,
+        help="store results as the new baseline",
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="allowed slowdown, as a fraction (default: %(default)s)",
+        metavar='F',
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=5,
+        help="number of runs for process benchmarks (default: %(default)s)",
+        metavar='N',
+    )
+    parser.add_argument(
+        '--filter',
+        type=re.compile,
+        default=None,
+        help="only run benchmarks matching %(metavar)s",
+        metavar='REGEX',
+    )
+    parser.add_argument(
+        '-v',
+        action='store_true',
+        dest='verbose',
+        help="show progress",
+    )
+    return parser
+
+
+def main(inargs=None):
+    args = make_parser().parse_args(inargs)
+    sys.path.insert(0, SRC_DIR)
+    logging.basicConfig(
+        format="%(message)s",
+        level=logging.INFO if args.verbose else logging.WARNING)
+    warnings.simplefilter('ignore')
+
+    if not args.update and not os.path.exists(args.baseline):
+        # fail before the benchmarks run, not after
+        raise SystemExit(
+            "no baseline in {0} - baselines are host specific, and are not "
+            "part of the repository; store one on this host with\n\n"
+            "    python benchmarks/bench.py --update --baseline {0}\n\n"
+            "and compare against it afterwards".format(args.baseline))
+
+    current = run_benchmarks(args.repeat, name_filter=args.filter)
+
+    if args.update:
+        baseline = {}
+        if args.filter and os.path.exists(args.baseline):
+            # only replace the benchmarks that were run
+            with io.open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.setdefault('results', {}).update(current['results'])
+        baseline['calibration'] = current['calibration']
+        with io.open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print("wrote baseline to {0}".format(args.baseline))
+        return
+
+    with io.open(args.baseline) as f:
+        baseline = json.load(f)
+    rows = compare(baseline, current, args.tolerance, args.filter)
+    for _ in range(RETRIES):
+        slower = [row[0] for row in rows if row[4] == 'SLOWER']
+        if not slower:
+            break
+        # measure again, to rule out noise from other load on the host, and
+        # keep the best raw and normalized times
+        logger.info("re-running %d slower benchmark(s)", len(slower))
+        retry = run_benchmarks(args.repeat, name_filter=re.compile(
+            '^(' + '|'.join(re.escape(name) for name in slower) + ')$'))
+        for name, result in retry['results'].items():
+            best = current['results'][name]
+            for key in ('seconds', 'normalized'):
+                best[key] = min(best[key], result[key])
+        rows = compare(baseline, current, args.tolerance, args.filter)
+    print(format_rows(rows))
+    slower = [row for row in rows if row[4] == 'SLOWER']
+    missing = [row for row in rows if row[4] == 'MISSING']
+    if slower or missing:
+        raise SystemExit(
+            "{0} benchmark(s) exceeded the allowed slowdown ({1:.0%}), "
+            "{2} benchmark(s) missing".format(len(slower), args.tolerance,
+                                              len(missing)))
+
+
+if __name__ == '__main__':
+    main()
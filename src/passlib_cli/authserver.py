@@ -0,0 +1,600 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+HTTP auth request verifier.
+
+A small asyncio HTTP server for e.g. the nginx `auth_request` module.  Each
+request is answered by checking its Basic `Authorization` header against an
+htpasswd or shadow style credential file:
+
+- 200 if the credentials are valid, with the user in an `X-Auth-User` header
+- 401 if not, with a `WWW-Authenticate` challenge
+- 503 if too many verifications are waiting
+
+The credential file is kept in memory, indexed by user, and re-read when it
+changes.  Hashes are verified on a worker pool (see `executors`), so that
+slow KDFs don't block the event loop, and successful verifications are cached
+(see `cache`).
+"""
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+)
+import argparse
+import base64
+import binascii
+import collections
+import logging
+import os
+import textwrap
+import time
+
+from . import cli_utils
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# methods used in htpasswd and shadow files, in the order they are tried -
+# des_crypt matches any 13 character string, and must be last
+SCHEMES = (
+    'bcrypt',
+    'sha512_crypt',
+    'sha256_crypt',
+    'md5_crypt',
+    'apr_md5_crypt',
+    'ldap_salted_sha1',
+    'ldap_sha1',
+    'bsdi_crypt',
+    'des_crypt',
+)
+
+# seconds between checks for a changed credential file
+RELOAD_INTERVAL = 1.0
+
+# max size of a request head
+MAX_HEAD_SIZE = 8192
+
+# seconds to wait for a request on an open connection
+READ_TIMEOUT = 10.0
+
+# max number of connections waiting to be accepted
+BACKLOG = 1024
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    401: 'Unauthorized',
+    413: 'Payload Too Large',
+    503: 'Service Unavailable',
+}
+
+
+def parse_credentials(lines):
+    """ Yield (user, cryptstring) pairs from htpasswd or shadow lines.
+
+    Both formats start with '<user>:<cryptstring>', shadow files have more
+    fields after the cryptstring.
+    """
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line or line.startswith('#'):
+            continue
+        user, sep, rest = line.partition(':')
+        if not sep:
+            continue
+        yield user, rest.split(':', 1)[0]
+
+
+class CredentialIndex(object):
+    """ An in-memory index of a credential file, by user.
+
+    Each user maps to a (cryptstring, method name) tuple.  The method is
+    identified when an entry is added or changed, and is `None` for hashes
+    that no known method matches, e.g. locked accounts.
+
+    :param str filename: htpasswd or shadow style file
+    :param cache.VerifyCache cache: cache to discard replaced hashes from
+    """
+
+    def __init__(self, filename, schemes=SCHEMES, cache=None,
+                 interval=RELOAD_INTERVAL, clock=time.monotonic):
+        from . import methods
+        self.filename = filename
+        self.cache = cache
+        self.interval = interval
+        self.clock = clock
+        self.methods = [methods.get_method(name) for name in schemes
+                        if methods.is_known_method(name) and
+                        methods.get_method(name).supported]
+        self.entries = {}
+        # an entry to verify against for unknown users
+        self.dummy = None
+        self._file_id = None
+        self._checked = None
+
+    def _get_file_id(self):
+        st = os.stat(self.filename)
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def identify(self, cryptstring):
+        """ Get the name of the method of a cryptstring, if known. """
+        for method in self.methods:
+            if method.identify(cryptstring):
+                return method.name
+        return None
+
+    def load(self):
+        """ Read the credential file, and update changed entries.
+
+        :return tuple: an (added, changed, removed) tuple of entry counts
+        """
+        file_id = self._get_file_id()
+        with open(self.filename, errors='surrogateescape') as f:
+            credentials = dict(parse_credentials(f))
+        old = self.entries
+        entries = {}
+        added = changed = 0
+        for user, cryptstring in credentials.items():
+            entry = old.get(user)
+            if entry is not None and entry[0] == cryptstring:
+                entries[user] = entry
+                continue
+            if entry is None:
+                added += 1
+            else:
+                changed += 1
+                if self.cache is not None:
+                    self.cache.discard_hash(entry[0])
+            entries[user] = (cryptstring, self.identify(cryptstring))
+        removed = 0
+        for user, entry in old.items():
+            if user not in entries:
+                removed += 1
+                if self.cache is not None:
+                    self.cache.discard_hash(entry[0])
+
+        # the dummy entry has the cost of the most common method
+        names = collections.Counter(n for _, n in entries.values() if n)
+        dummy = None
+        if names:
+            name = names.most_common(1)[0][0]
+            dummy = next(e for e in entries.values() if e[1] == name)
+
+        # replaced, not modified - requests may be reading the old index
+        self.entries = entries
+        self.dummy = dummy
+        self._file_id = file_id
+        logger.info("loaded %s: %d users (%d added, %d changed, %d removed)",
+                    self.filename, len(entries), added, changed, removed,
+                    extra={'event': 'reload',
+                           'users': len(entries),
+                           'added': added,
+                           'changed': changed,
+                           'removed': removed})
+        return added, changed, removed
+
+    def needs_reload(self):
+        """ Check if the credential file has changed.
+
+        The file is checked at most once per interval.
+        """
+        now = self.clock()
+        if self._checked is not None and now - self._checked < self.interval:
+            return False
+        self._checked = now
+        try:
+            return self._get_file_id() != self._file_id
+        except OSError as e:
+            logger.warning("unable to check %s: %s", self.filename, e)
+            return False
+
+    def get(self, user):
+        return self.entries.get(user)
+
+
+class Overloaded(Exception):
+    """ Too many verifications are waiting. """
+
+
+class AuthServer(object):
+    """ Answer HTTP auth requests.
+
+    :param CredentialIndex index: the credentials to check against
+    :param executors.HashPool pool: a VERIFY_MIXED pool
+    :param cache.VerifyCache verify_cache: an optional verification cache
+    :param int max_pending: max number of waiting verifications
+    :param str executor:
+        The requested executor kind.  With 'auto', a warning is logged if a
+        reload adds methods that would select another kind than the pool's.
+    """
+
+    def __init__(self, index, pool, verify_cache=None, realm='passlib',
+                 max_pending=1000, executor='auto'):
+        self.index = index
+        self.pool = pool
+        self.cache = verify_cache
+        self.realm = realm
+        self.max_pending = max_pending
+        self.executor = executor
+        self._methods = get_method_names(index)
+        self.pending = 0
+        # cache key -> future of verifications in flight - concurrent
+        # requests with the same credentials are only verified once
+        self._inflight = {}
+        self._reload = None
+
+    async def check_reload(self):
+        """ Reload the credential file in a thread, if it has changed.
+
+        Requests wait for a running reload, so that a changed password is
+        never accepted after the change has been seen.
+        """
+        import asyncio
+        reload = self._reload
+        if reload is None:
+            if not self.index.needs_reload():
+                return
+            loop = asyncio.get_running_loop()
+            reload = self._reload = loop.run_in_executor(None, self.reload)
+            reload.add_done_callback(self._reload_done)
+        # doesn't raise - a failed reload keeps the old index
+        await asyncio.wait([reload])
+
+    def reload(self):
+        """ Reload the credential file, and check the executor kind.
+
+        The pool is not replaced, as verifications may be running on it.
+        """
+        self.index.load()
+        names = get_method_names(self.index)
+        if self.executor != 'auto' or names == self._methods:
+            return
+        self._methods = names
+        kind = select_executor(self.index, self.pool.jobs)
+        if kind != self.pool.kind:
+            logger.warning(
+                "methods in %s now suit the %s executor, but the %s executor "
+                "is used until restarted", self.index.filename, kind,
+                self.pool.kind)
+
+    def _reload_done(self, future):
+        self._reload = None
+        if future.exception() is not None:
+            logger.error("unable to reload %s: %s", self.index.filename,
+                         future.exception())
+
+    async def _run(self, password, user, cryptstring, name):
+        import asyncio
+        if self.pending >= self.max_pending:
+            raise Overloaded()
+        self.pending += 1
+        metrics.registry.set('queue_depth', self.pending, operation='auth')
+        try:
+            future = self.pool.submit([(password, user, cryptstring, name)])
+            result, error, duration = (await asyncio.wrap_future(future))[0]
+        finally:
+            self.pending -= 1
+            metrics.registry.set('queue_depth', self.pending,
+                                 operation='auth')
+        metrics.registry.add_record('auth', name, duration,
+                                    error=bool(error))
+        if error:
+            logger.error("unable to verify %s hash: %s", name, error)
+            return False
+        return bool(result)
+
+    async def verify(self, user, password):
+        """ Verify credentials.
+
+        Unknown users and unknown hashes are verified against a dummy entry,
+        so that they take as long as known users.
+
+        :raises Overloaded: if too many verifications are waiting
+        :return bool:
+        """
+        import asyncio
+        entry = self.index.get(user)
+        if entry is None or entry[1] is None:
+            dummy = self.index.dummy
+            if dummy is not None:
+                await self._run(password, user, dummy[0], dummy[1])
+            return False
+        cryptstring, name = entry
+        if self.cache is None:
+            return await self._run(password, user, cryptstring, name)
+
+        key = self.cache.key(cryptstring, password, user)
+        future = self._inflight.get(key)
+        if future is not None:
+            self.cache.count_coalesced()
+            return await asyncio.shield(future)
+        if self.cache.lookup(key):
+            return True
+        future = self._inflight[key] = asyncio.ensure_future(
+            self._run(password, user, cryptstring, name))
+        try:
+            result = await asyncio.shield(future)
+        finally:
+            self._inflight.pop(key, None)
+        if result:
+            self.cache.insert(key, cryptstring)
+        return result
+
+    async def authorize(self, authorization):
+        """ Check an Authorization header value.
+
+        :return tuple: a (status, user) tuple
+        """
+        scheme, _, value = (authorization or '').strip().partition(' ')
+        if scheme.lower() != 'basic':
+            return 401, None
+        try:
+            decoded = base64.b64decode(value.strip(), validate=True)
+            user, sep, password = decoded.decode('utf-8').partition(':')
+        except (binascii.Error, UnicodeDecodeError):
+            return 400, None
+        if not sep:
+            return 400, None
+        await self.check_reload()
+        try:
+            ok = await self.verify(user, password)
+        except Overloaded:
+            return 503, user
+        return (200 if ok else 401), user
+
+    def format_response(self, status, user=None, keep_alive=True):
+        headers = ['HTTP/1.1 {0} {1}'.format(status, REASONS[status])]
+        if status == 200 and _is_header_safe(user):
+            headers.append('X-Auth-User: ' + user)
+        elif status == 401:
+            headers.append('WWW-Authenticate: Basic realm="{0}"'.format(
+                self.realm))
+        elif status == 503:
+            headers.append('Retry-After: 1')
+        headers.append('Content-Length: 0')
+        headers.append('Connection: ' + ('keep-alive' if keep_alive
+                                         else 'close'))
+        return ('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1')
+
+    async def handle(self, reader, writer):
+        """ Handle a client connection. """
+        import asyncio
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b'\r\n\r\n'), READ_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError,
+                        ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    writer.write(self.format_response(413, keep_alive=False))
+                    break
+                try:
+                    version, headers = parse_request(head)
+                    length = int(headers.get('content-length') or 0)
+                except ValueError:
+                    writer.write(self.format_response(400, keep_alive=False))
+                    break
+                if length:
+                    # auth requests have no body
+                    writer.write(self.format_response(413, keep_alive=False))
+                    break
+                keep_alive = (version == 'HTTP/1.1' and
+                              headers.get('connection', '').lower() != 'close')
+                status, user = await self.authorize(
+                    headers.get('authorization'))
+                metrics.registry.inc('results_total', operation='auth',
+                                     result=str(status))
+                logger.debug("auth request: %d", status)
+                writer.write(self.format_response(status, user, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def _is_header_safe(value):
+    # printable ascii only, e.g. no line breaks
+    return all(32 <= ord(c) < 127 for c in value)
+
+
+def parse_request(head):
+    """ Parse a request head.
+
+    :return tuple: a (http version, headers) tuple, with lowercase names
+    """
+    lines = head.decode('latin-1').split('\r\n')
+    parts = lines[0].split(' ')
+    if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+        raise ValueError("invalid request line")
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(':')
+        if not sep:
+            raise ValueError("invalid header")
+        headers[name.strip().lower()] = value.strip()
+    return parts[2], headers
+
+
+def get_method_names(index):
+    """ Get the names of all identified methods in the index. """
+    return frozenset(name for _, name in index.entries.values() if name)
+
+
+def select_executor(index, jobs, kind='auto'):
+    """ Pick an executor that suits all methods in the index.
+
+    Verification must not run in the event loop, so the serial executor is
+    replaced with a single thread.
+    """
+    from . import executors
+    from . import methods
+    kind = executors.select_mixed_executor(
+        ((methods.get_method(name), {})
+         for name in sorted(get_method_names(index))),
+        jobs, kind=kind)
+    if kind == executors.SERIAL:
+        kind = executors.THREAD
+    return kind
+
+
+def listen_type(value):
+    """ Parse a [HOST:]PORT argument. """
+    host, _, port = value.rpartition(':')
+    try:
+        port = int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid port: " + repr(port))
+    return host.strip('[]') or '127.0.0.1', port
+
+
+async def serve(server, host, port):
+    import asyncio
+    tcp_server = await asyncio.start_server(server.handle, host, port,
+                                            limit=MAX_HEAD_SIZE,
+                                            backlog=BACKLOG)
+    for sock in tcp_server.sockets:
+        logger.info("listening on %s:%d", *sock.getsockname()[:2])
+    async with tcp_server:
+        await tcp_server.serve_forever()
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description=textwrap.dedent(
+            """
+            Answer HTTP Basic auth requests (e.g. from nginx auth_request)
+            using an htpasswd or shadow style credential file.
+            """
+        ).strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        'credentials',
+        help="htpasswd or shadow style file, reloaded when changed",
+        metavar='FILE',
+    )
+    parser.add_argument(
+        '-l', '--listen',
+        dest='listen',
+        type=listen_type,
+        default=('127.0.0.1', 8080),
+        help="address to listen on (default: 127.0.0.1:8080)",
+        metavar='[HOST:]PORT',
+    )
+    parser.add_argument(
+        '--realm',
+        dest='realm',
+        default='passlib',
+        help="realm for auth challenges (default: %(default)s)",
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        dest='jobs',
+        type=cli_utils.positive_int,
+        default=os.cpu_count() or 1,
+        help="number of parallel workers (default: %(default)s)",
+        metavar='N',
+    )
+    parser.add_argument(
+        '--executor',
+        dest='executor',
+        choices=('auto', 'thread', 'process', 'prefork'),
+        default='auto',
+        help="how to run workers (default: %(default)s)",
+    )
+    parser.add_argument(
+        '--max-pending',
+        dest='max_pending',
+        type=cli_utils.positive_int,
+        default=1000,
+        help=textwrap.dedent(
+            """
+            answer 503 when %(metavar)s verifications are waiting
+            (default: %(default)s)
+            """
+        ).strip(),
+        metavar='N',
+    )
+    parser.add_argument(
+        '--verify-cache',
+        dest='verify_cache',
+        type=int,
+        default=10000,
+        help=textwrap.dedent(
+            """
+            remember up to %(metavar)s successful verifications
+            (default: %(default)s, 0 to disable)
+            """
+        ).strip(),
+        metavar='N',
+    )
+    parser.add_argument(
+        '--verify-cache-ttl',
+        dest='verify_cache_ttl',
+        type=cli_utils.positive_float,
+        default=60.0,
+        help="cached verifications expire after %(metavar)s seconds "
+             "(default: %(default)s)",
+        metavar='SECONDS',
+    )
+    cli_utils.add_version_arg(parser)
+    cli_utils.add_verbosity_mutex(parser)
+    cli_utils.add_log_format_arg(parser)
+    cli_utils.add_metrics_args(parser)
+    if __name__ == '__main__':
+        parser.prog = 'python -m ' + __spec__.name
+    return parser
+
+
+def main(inargs=None):
+    parser = make_parser()
+    args = parser.parse_args(inargs)
+    cli_utils.setup_output(args, metrics=False)
+
+    import asyncio
+    from . import cache
+    from . import executors
+    verify_cache = None
+    if args.verify_cache > 0:
+        verify_cache = cache.VerifyCache(maxsize=args.verify_cache,
+                                         ttl=args.verify_cache_ttl)
+    index = CredentialIndex(args.credentials, cache=verify_cache)
+    try:
+        index.load()
+    except (IOError, UnicodeError) as e:
+        raise SystemExit("unable to read {0}: {1}".format(
+            args.credentials, e))
+
+    kind = select_executor(index, args.jobs, args.executor)
+    logger.info("using %s executor (jobs=%d)", kind, args.jobs)
+    method = index.methods[0]
+    with executors.HashPool(method, {}, args.jobs, kind,
+                            operation=executors.VERIFY_MIXED) as pool:
+        # start the workers before the metrics writer and the event loop, so
+        # that worker processes are forked from a single threaded process
+        pool.start()
+        cli_utils.setup_metrics(args.metrics_file,
+                                interval=args.metrics_interval)
+        server = AuthServer(index, pool, verify_cache=verify_cache,
+                            realm=args.realm, max_pending=args.max_pending,
+                            executor=args.executor)
+        try:
+            asyncio.run(serve(server, *args.listen))
+        except KeyboardInterrupt:
+            pass
+        except OSError as e:
+            raise SystemExit(str(e))
+
+
+if __name__ == '__main__':
+    main()
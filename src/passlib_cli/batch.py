@@ -0,0 +1,257 @@
+# encoding: utf-8
+"""
+Batch hashing.
+
+Reads records from a file, one per line, and writes a cryptstring for each
+record.  A record is either a plaintext password, or a '<user>\t<password>'
+pair.  The user is passed to methods that require a username, and written
+in front of the resulting cryptstring.
+"""
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+)
+import collections
+import logging
+
+from . import executors
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+FIELD_SEP = '\t'
+
+
+def parse_record(line):
+    """ Parse a batch input line.
+
+    :return tuple: Return a (user, password) tuple, user may be `None`.
+    """
+    line = line.rstrip('\r\n')
+    user, sep, password = line.partition(FIELD_SEP)
+    if not sep:
+        return None, line
+    return user, password
+
+
+def format_record(user, cryptstring):
+    if user is None:
+        return cryptstring
+    return user + FIELD_SEP + cryptstring
+
+
+def iter_records(lines, start=1):
+    """ Yield (lineno, user, password) for all non-empty lines. """
+    for lineno, line in enumerate(lines, start):
+        if not line.rstrip('\r\n'):
+            continue
+        user, password = parse_record(line)
+        yield lineno, user, password
+
+
+class BatchResult(object):
+    """ Outcome of a batch run. """
+
+    def __init__(self):
+        self.records = 0
+        self.errors = 0
+
+
+def hash_batch(method, params, lines, output, jobs=1,
+               executor=executors.AUTO, progress=None, on_start=None):
+    """ Hash all records from `lines`, and write results to `output`.
+
+    :param methods.MethodWrapper method: the method to hash with
+    :param dict params: hash parameters
+    :param lines: iterable of input lines
+    :param output: file-like object or sink (see `sinks`) to write results to
+    :param int jobs: number of workers
+    :param str executor: executor kind (see `executors.EXECUTORS`)
+    :param checkpoint.Progress progress:
+        Checkpoint progress, for resumable runs.  The outcome includes
+        records from earlier runs.
+    :param on_start:
+        Callback once the workers are started, e.g. to start threads that
+        must not be running when worker processes are forked.
+
+    :return BatchResult:
+    """
+    from . import sinks
+    if not hasattr(output, 'write_record'):
+        output = sinks.TextSink(output)
+    kind = executors.select_executor(method, params, jobs, kind=executor)
+    # line numbers and users of records in flight, in order
+    pending = collections.deque()
+    start = progress.first_line if progress else 1
+
+    def items():
+        for lineno, user, password in iter_records(lines, start):
+            pending.append((lineno, user))
+            yield password, user
+
+    def on_pending(count):
+        metrics.registry.set('queue_depth', count, operation='hash')
+
+    outcome = progress.outcome if progress else BatchResult()
+    with executors.HashPool(method, params, jobs, kind) as pool:
+        pool.start()
+        if on_start:
+            on_start()
+        for cryptstring, error, duration in pool.map(items(),
+                                                     on_pending=on_pending):
+            lineno, user = pending.popleft()
+            outcome.records += 1
+            metrics.registry.add_record('hash', method.name, duration,
+                                        error=bool(error))
+            if error:
+                outcome.errors += 1
+                logger.error("line %d: unable to hash record: %s",
+                             lineno, error)
+            else:
+                try:
+                    output.write_record(user, cryptstring)
+                except ValueError as e:
+                    outcome.errors += 1
+                    logger.error("line %d: unable to write record: %s",
+                                 lineno, e)
+            if progress:
+                progress.update(lineno)
+    if progress:
+        progress.finish()
+    logger.info("hashed %d records (%d errors)", outcome.records,
+                outcome.errors, extra={'event': 'batch',
+                                       'method': method.name,
+                                       'records': outcome.records,
+                                       'errors': outcome.errors})
+    return outcome
+
+
+# verification results
+VERIFY_OK = 'ok'
+VERIFY_FAIL = 'fail'
+VERIFY_ERROR = 'error'
+
+
+def parse_verify_record(method, line):
+    """ Parse a verify input line.
+
+    A verify record is a '<cryptstring><TAB><password>' pair, or a
+    '<user><TAB><cryptstring><TAB><password>' triple, e.g. batch output with
+    the password appended.
+
+    :return tuple: Return a (user, cryptstring, password) tuple.
+    """
+    line = line.rstrip('\r\n')
+    first, _, rest = line.partition(FIELD_SEP)
+    if method.identify(first):
+        return None, first, rest
+    cryptstring, _, password = rest.partition(FIELD_SEP)
+    return first, cryptstring, password
+
+
+def verify_batch(method, params, lines, output, jobs=1,
+                 executor=executors.AUTO, cache=None, progress=None,
+                 on_start=None):
+    """ Verify all records from `lines`, and write results to `output`.
+
+    Cached verifications are answered without using the worker pool.
+
+    :param cache.VerifyCache cache: an optional verification cache
+    :param checkpoint.Progress progress: checkpoint progress (see hash_batch)
+    :param on_start: callback once the workers are started (see hash_batch)
+
+    :return BatchResult:
+    """
+    from . import sinks
+    if not hasattr(output, 'write_record'):
+        output = sinks.TextSink(output)
+    kind = executors.select_executor(method, params, jobs, kind=executor)
+    # (lineno, user, item, key) of records in flight, in order
+    pending = collections.deque()
+    # cache key -> [count, result] of records in flight - repeated
+    # credentials in flight are only verified once
+    inflight = {}
+
+    start = progress.first_line if progress else 1
+
+    def items():
+        for lineno, line in enumerate(lines, start):
+            if not line.rstrip('\r\n'):
+                continue
+            user, cryptstring, password = parse_verify_record(method, line)
+            item = (password, user, cryptstring)
+            if cache is None:
+                pending.append((lineno, user, item, None))
+                yield item
+                continue
+            key = cache.key(cryptstring, password, user)
+            if key in inflight:
+                cache.count_coalesced()
+                inflight[key][0] += 1
+                pending.append((lineno, user, None, key))
+                yield executors.Resolved(None)
+            elif cache.lookup(key):
+                pending.append((lineno, user, None, None))
+                yield executors.Resolved(True)
+            else:
+                inflight[key] = [1, None]
+                pending.append((lineno, user, item, key))
+                yield item
+
+    def on_pending(count):
+        metrics.registry.set('queue_depth', count, operation='verify')
+
+    outcome = progress.outcome if progress else BatchResult()
+    with executors.HashPool(method, params, jobs, kind,
+                            operation=executors.VERIFY) as pool:
+        pool.start()
+        if on_start:
+            on_start()
+        for result, error, duration in pool.map(items(),
+                                                on_pending=on_pending):
+            lineno, user, item, key = pending.popleft()
+            if key is not None:
+                state = inflight[key]
+                if item is None:
+                    # same credentials as an earlier record
+                    result, error = state[1]
+                else:
+                    state[1] = (result, error)
+                    if result:
+                        cache.insert(key, item[2])
+                state[0] -= 1
+                if not state[0]:
+                    del inflight[key]
+
+            outcome.records += 1
+            metrics.registry.add_record('verify', method.name, duration,
+                                        error=bool(error))
+            if error:
+                outcome.errors += 1
+                logger.error("line %d: unable to verify record: %s",
+                             lineno, error)
+                status = VERIFY_ERROR
+            elif result:
+                status = VERIFY_OK
+            else:
+                outcome.errors += 1
+                status = VERIFY_FAIL
+            output.write_record(user, status)
+            if progress:
+                progress.update(lineno)
+    if progress:
+        progress.finish()
+
+    logger.info("verified %d records (%d failed)", outcome.records,
+                outcome.errors, extra={'event': 'batch',
+                                       'method': method.name,
+                                       'records': outcome.records,
+                                       'errors': outcome.errors})
+    if cache is not None:
+        stats = cache.stats()
+        logger.info("verification cache: %r", stats,
+                    extra=dict(('cache_' + k, v) for k, v in stats.items()))
+    return outcome
@@ -0,0 +1,162 @@
+# encoding: utf-8
+"""
+Verification result cache.
+
+Remembers successful verifications of (cryptstring, password) pairs, so that
+repeated verifications of the same credentials don't need a full KDF run.
+
+Entries are keyed by an HMAC of the cryptstring and password, using a random
+per-process key - plaintext passwords are never stored.  As the cryptstring
+is part of the key, changing a stored hash automatically invalidates any
+cached results for the old hash.
+"""
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+)
+import collections
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(value):
+    if value is None:
+        return b'\xff'
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    # length prefix, to keep fields from running into each other
+    return len(value).to_bytes(8, 'big') + value
+
+
+class VerifyCache(object):
+    """ A bounded, thread safe LRU cache with expiring entries.
+
+    :param int maxsize: max number of entries
+    :param float ttl: seconds before an entry expires
+    """
+
+    def __init__(self, maxsize=10000, ttl=60.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._key = os.urandom(32)
+        self._lock = threading.Lock()
+        # key -> (hash fingerprint, expires)
+        self._entries = collections.OrderedDict()
+        # hash fingerprint -> set of keys
+        self._by_hash = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # verifications that joined an identical verification in flight
+        self.coalesced = 0
+
+    def _digest(self, *fields):
+        msg = b''.join(_encode(f) for f in fields)
+        return hmac.new(self._key, msg, hashlib.sha256).digest()
+
+    def key(self, cryptstring, password, user=None):
+        """ Get the (keyed) cache key for a verification. """
+        return self._digest(cryptstring, password, user)
+
+    def _remove(self, key):
+        fingerprint, _ = self._entries.pop(key)
+        keys = self._by_hash.get(fingerprint)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_hash[fingerprint]
+
+    def _count(self, name, value=1):
+        setattr(self, name, getattr(self, name) + value)
+        metrics.registry.inc('verify_cache_' + name + '_total', value)
+
+    def get(self, cryptstring, password, user=None):
+        """ Check if a verification is cached.
+
+        :return bool: `True` if this exact verification has succeeded
+        """
+        return self.lookup(self.key(cryptstring, password, user))
+
+    def lookup(self, key):
+        """ Check if a verification is cached, by its `key()`. """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= self.clock():
+                self._remove(key)
+                self._count('expirations')
+                entry = None
+            if entry is None:
+                self._count('misses')
+                return False
+            self._entries.move_to_end(key)
+            self._count('hits')
+            return True
+
+    def add(self, cryptstring, password, user=None):
+        """ Remember a successful verification. """
+        self.insert(self.key(cryptstring, password, user), cryptstring)
+
+    def insert(self, key, cryptstring):
+        """ Remember a successful verification, by its `key()`. """
+        if self.maxsize < 1:
+            return
+        fingerprint = self._digest(cryptstring)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (fingerprint, self.clock() + self.ttl)
+            self._by_hash.setdefault(fingerprint, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self._count('evictions')
+            metrics.registry.set('verify_cache_entries', len(self._entries))
+
+    def count_coalesced(self):
+        """ Count a verification that joined an identical one in flight.
+
+        These are neither hits nor misses - the caller checks for
+        verifications in flight before looking in the cache.
+        """
+        with self._lock:
+            self._count('coalesced')
+
+    def discard_hash(self, cryptstring):
+        """ Forget all cached verifications for a cryptstring.
+
+        Not needed for correctness, but frees entries for replaced hashes.
+        """
+        fingerprint = self._digest(cryptstring)
+        with self._lock:
+            for key in list(self._by_hash.get(fingerprint, ())):
+                self._remove(key)
+            metrics.registry.set('verify_cache_entries', len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_hash.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'coalesced': self.coalesced,
+        }
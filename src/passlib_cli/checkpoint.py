@@ -0,0 +1,188 @@
+# encoding: utf-8
+"""
+Checkpoints for resumable batch runs.
+
+A checkpoint is a small json file with the progress of a batch run: the input
+byte offset and line number after the last completed record, the number of
+completed records and errors, and the size of the output at that point.  It
+also holds a fingerprint of the operation, method, params and output, so
+that a run is only resumed with the same settings.
+
+Records are completed in input order, so everything before the input offset
+is done, and everything after the output offset can be discarded.
+"""
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+)
+import collections
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+# records between checkpoints
+CHECKPOINT_INTERVAL = 10000
+
+CHECKPOINT_VERSION = 1
+
+
+def get_fingerprint(**settings):
+    """ Get a fingerprint of the settings of a batch run. """
+    data = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class InputReader(object):
+    """ Read text lines from a binary file, and keep track of line offsets.
+
+    :param raw: a binary file object, must be seekable to start at an offset
+    :param int offset: byte offset to start reading at
+    :param int lineno: number of lines before `offset`
+    """
+
+    def __init__(self, raw, offset=0, lineno=0, encoding='utf-8'):
+        if offset:
+            raw.seek(offset)
+        self.raw = raw
+        self.offset = offset
+        self.lineno = lineno
+        self.encoding = encoding
+        # (lineno, end offset) of lines read, and not yet completed
+        self._offsets = collections.deque()
+
+    def __iter__(self):
+        offsets = self._offsets
+        encoding = self.encoding
+        for line in self.raw:
+            self.offset += len(line)
+            self.lineno += 1
+            offsets.append((self.lineno, self.offset))
+            yield line.decode(encoding, 'surrogateescape')
+
+    def complete(self, lineno):
+        """ Mark all lines up to `lineno` as completed.
+
+        :return int: the input offset after the line
+        """
+        offsets = self._offsets
+        offset = None
+        while offsets and offsets[0][0] <= lineno:
+            offset = offsets.popleft()[1]
+        return offset
+
+
+class Checkpoint(object):
+    """ A checkpoint file.
+
+    :param str filename: checkpoint file
+    :param str fingerprint: fingerprint of the batch run settings
+    """
+
+    def __init__(self, filename, fingerprint):
+        self.filename = filename
+        self.fingerprint = fingerprint
+
+    def load(self):
+        """ Read the checkpoint.
+
+        :raises ValueError:
+            If the checkpoint is invalid, or from a run with other settings.
+
+        :return dict: the saved progress
+        """
+        try:
+            with open(self.filename) as f:
+                state = json.load(f)
+            if state['version'] != CHECKPOINT_VERSION:
+                raise ValueError("unsupported version: " +
+                                 repr(state['version']))
+            for key in ('input_offset', 'lineno', 'records', 'errors'):
+                int(state[key])
+        except (ValueError, TypeError, KeyError) as e:
+            raise ValueError("invalid checkpoint {0}: {1}".format(
+                self.filename, e))
+        if state['fingerprint'] != self.fingerprint:
+            raise ValueError(
+                "checkpoint {0} is from a run with different settings".format(
+                    self.filename))
+        return state
+
+    def save(self, input_offset, lineno, records, errors, output_offset):
+        """ Write the checkpoint, atomically. """
+        state = collections.OrderedDict((
+            ('version', CHECKPOINT_VERSION),
+            ('fingerprint', self.fingerprint),
+            ('input_offset', input_offset),
+            ('lineno', lineno),
+            ('records', records),
+            ('errors', errors),
+            ('output_offset', output_offset),
+        ))
+        tmp = '{0}.{1}.tmp'.format(self.filename, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.filename)
+        logger.debug("checkpoint at line %d, %d records", lineno, records)
+
+
+class Progress(object):
+    """ Checkpointing for a batch run.
+
+    :param Checkpoint checkpoint: where to save progress
+    :param InputReader reader: the input of the batch run
+    :param output: the output sink of the batch run (see `sinks`)
+    :param dict state: progress from a resumed checkpoint
+    :param int interval: records between checkpoints
+    """
+
+    def __init__(self, checkpoint, reader, output, state=None,
+                 interval=CHECKPOINT_INTERVAL):
+        from . import batch
+        self.checkpoint = checkpoint
+        self.reader = reader
+        self.output = output
+        self.interval = interval
+        # the outcome includes records from earlier runs
+        self.outcome = batch.BatchResult()
+        if state:
+            self.outcome.records = state['records']
+            self.outcome.errors = state['errors']
+        self._lineno = reader.lineno
+        self._offset = reader.offset
+        self._saved = self.outcome.records
+
+    @property
+    def first_line(self):
+        return self._lineno + 1
+
+    def update(self, lineno):
+        """ Mark records up to `lineno` as completed. """
+        offset = self.reader.complete(lineno)
+        if offset is not None:
+            self._lineno, self._offset = lineno, offset
+        if self.outcome.records - self._saved >= self.interval:
+            self.save()
+
+    def save(self):
+        # the output must have all completed records before the checkpoint
+        # says so
+        output_offset = self.output.sync()
+        self.checkpoint.save(self._offset, self._lineno,
+                             self.outcome.records, self.outcome.errors,
+                             output_offset)
+        self._saved = self.outcome.records
+
+    def finish(self):
+        """ Save the final checkpoint, including trailing empty lines. """
+        offset = self.reader.complete(self.reader.lineno)
+        if offset is not None:
+            self._lineno, self._offset = self.reader.lineno, offset
+        self.save()
@@ -8,12 +8,16 @@ from __future__ import (
     print_function,
     unicode_literals,
 )
+import json
 import logging
+import os
+import time
 
 from . import metadata
 
 
 LOG_FORMAT = "%(levelname)s - %(name)s - %(message)s"
+LOG_FORMATS = ("text", "json")
 LOG_LEVELS = (
     logging.ERROR,
     logging.WARNING,
@@ -27,19 +31,129 @@ def get_verbosity(verbosity):
     return LOG_LEVELS[verbosity_idx]
 
 
-def setup_logging(verbosity):
+# LogRecord attributes that are not event fields
+_record_attrs = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+# Event fields that must never end up in a log
+_redacted_fields = {'password', 'plaintext', 'passwd', 'secret'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format log records as json objects, one per line.
+
+    Fields given to the logger through `extra` are included in the output.
+    """
+
+    def format(self, record):
+        event = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                  time.gmtime(record.created)) +
+            '.%03dZ' % record.msecs,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key in _record_attrs or key.startswith('_'):
+                continue
+            if key in _redacted_fields:
+                continue
+            event[key] = value
+        if record.exc_info:
+            event['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(event, default=repr, sort_keys=True)
+
+
+def setup_logging(verbosity, log_format="text"):
     """
     configure logging from verbosity
 
     :param int verbosity:
         The verbosity level from cli arguments.
+
+    :param str log_format:
+        The log format, one of LOG_FORMATS.
     """
     if verbosity < 0:
         root = logging.getLogger()
         root.addHandler(logging.NullHandler())
     else:
         level = get_verbosity(int(verbosity))
-        logging.basicConfig(format=LOG_FORMAT, level=level)
+        if log_format == "json":
+            handler = logging.StreamHandler()
+            handler.setFormatter(JsonFormatter())
+            logging.basicConfig(level=level, handlers=[handler])
+        else:
+            logging.basicConfig(format=LOG_FORMAT, level=level)
+
+
+def setup_metrics(filename, interval=15.0):
+    """
+    write metrics periodically and at exit, if a metrics file is given
+
+    :param str filename: Prometheus textfile to write to
+    :param float interval: seconds between each write
+    """
+    if not filename:
+        return None
+    from . import metrics
+    return metrics.start_writer(filename, interval=interval)
+
+
+def get_metrics_starter(args):
+    """ Get a callback that starts writing metrics from cli arguments. """
+    import functools
+    return functools.partial(setup_metrics, args.metrics_file,
+                             interval=args.metrics_interval)
+
+
+def setup_output(args, metrics=True):
+    """
+    setup logging and metrics from cli arguments
+
+    :param bool metrics:
+        Start writing metrics.  Commands that fork worker processes start
+        writing metrics with `setup_metrics` once the workers are started.
+    """
+    setup_logging(args.verbosity, log_format=args.log_format)
+    if metrics:
+        setup_metrics(args.metrics_file, interval=args.metrics_interval)
+
+
+def open_private(filename):
+    """ Open a file for writing, only readable and writable by the owner. """
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # the mode is only applied to new files
+    os.fchmod(fd, 0o600)
+    return open(fd, 'w')
+
+
+def positive_int(value):
+    """ Parse a positive int argument. """
+    import argparse
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            "invalid positive int value: {0!r}".format(value))
+    return number
+
+
+def positive_float(value):
+    """ Parse a positive float argument. """
+    import argparse
+    import math
+    try:
+        number = float(value)
+    except ValueError:
+        number = 0.0
+    if not (number > 0 and math.isfinite(number)):
+        raise argparse.ArgumentTypeError(
+            "invalid positive float value: {0!r}".format(value))
+    return number
 
 
 def add_verbosity_mutex(arg_parser, dest="verbosity"):
@@ -79,3 +193,42 @@ def add_version_arg(arg_parser):
         action='version',
         version='%s %s' % (metadata.package, metadata.version),
     )
+
+
+def add_log_format_arg(arg_parser, dest="log_format"):
+    """
+    add a log format argument (--log-format)
+
+    :param arg_parser: parser or argument group
+    :param str dest: name of the argument
+    """
+    return arg_parser.add_argument(
+        "--log-format",
+        choices=LOG_FORMATS,
+        default=LOG_FORMATS[0],
+        dest=dest,
+        help="log format (default: %(default)s)",
+    )
+
+
+def add_metrics_args(arg_parser):
+    """
+    add metrics arguments (--metrics-file, --metrics-interval)
+
+    :param arg_parser: parser or argument group
+    """
+    arg_parser.add_argument(
+        "--metrics-file",
+        default=None,
+        dest="metrics_file",
+        help="write Prometheus textfile metrics to %(metavar)s",
+        metavar="FILE",
+    )
+    arg_parser.add_argument(
+        "--metrics-interval",
+        type=positive_float,
+        default=15.0,
+        dest="metrics_interval",
+        help="seconds between metrics updates (default: %(default)s)",
+        metavar="SECONDS",
+    )
@@ -2,6 +2,9 @@
 # encoding: utf-8
 """
 Autocomplete utils.
+
+The generated scripts embed all known methods, settings and setting values,
+so that completion never has to start a Python process.
 """
 from __future__ import (
     absolute_import,
@@ -11,83 +14,378 @@ from __future__ import (
 )
 import argparse
 import logging
+import re
 import shlex
 
 from . import cli_utils
-from . import methods
+from . import mkpasswd
+from . import params
 
 logger = logging.getLogger(__name__)
 
 
-OPTIONS = (
-    "--list-all",
-    "--list-methods",
-    "--list-params",
-    "--no-verify",
-    "--show-docstring",
-    "--show-params",
-    "--version",
-    "-h", "--help",
-    "-p", "--param",
-    "-s", "--show-plaintext",
-    "-v", "--verbose",
-)
+PROGRAM = "passlib-mkpasswd"
+SHELLS = ("bash", "zsh", "fish")
+
+# Values that can be embedded without quoting issues in any of the shells
+# (e.g. scrypt idents like '$7$' would be expanded by `compgen -W`)
+_safe_word = re.compile(r'^[A-Za-z0-9_.,+-]+$')
+
+
+def is_safe_word(value):
+    return bool(_safe_word.match(value))
+
+
+def get_options(parser):
+    """ Get all option strings from a parser. """
+    return sorted(
+        option
+        for action in parser._actions
+        for option in action.option_strings)
+
+
+def get_method_options(parser):
+    """ Get option strings that take a METHOD argument. """
+    return sorted(
+        option
+        for action in parser._actions
+        if action.metavar == 'METHOD' and action.option_strings
+        for option in action.option_strings)
+
+
+class CompletionData(object):
+    """ Precomputed completion data for passlib-mkpasswd. """
+
+    def __init__(self, parser, method_list):
+        self.parser = parser
+        self.options = get_options(parser)
+        self.method_options = get_method_options(parser)
+        self.methods = [m.name for m in method_list]
+
+        # method -> settings
+        self.settings = dict(
+            (m.name, sorted(m.settings))
+            for m in method_list)
+        self.all_settings = sorted(
+            set(s for m in method_list for s in m.settings))
+
+        # param -> values, and method:param -> values
+        self.values = {}
+        for setting in self.all_settings:
+            known = params.get_known_values(setting)
+            if known:
+                self.values[setting] = list(known)
+        for m in method_list:
+            for setting, known in m.setting_values.items():
+                key = '{0}:{1}'.format(m.name, setting)
+                self.values[key] = list(known)
+
+        for key in list(self.values):
+            self.values[key] = [v for v in self.values[key]
+                                if is_safe_word(v)]
+            if not self.values[key]:
+                del self.values[key]
+
+    def iter_option_actions(self):
+        for action in self.parser._actions:
+            if action.option_strings:
+                yield action
+
+
+def format_text_list(items):
+    return " ".join(shlex.quote(item) for item in items)
+
 
+def format_assoc_items(mapping):
+    """ bash/zsh associative array items. """
+    return " ".join(
+        "[{0}]={1}".format(shlex.quote(key),
+                           shlex.quote(" ".join(mapping[key])))
+        for key in sorted(mapping))
 
-template = """
-_mkcrypt_autocomplete()
+
+bash_template = """
+_passlib_mkpasswd_autocomplete()
 {{
-    local curr
-    local -a methods opts
+    local line curr prev method word param known
+    local -a words methods opts method_opts all_settings
+    local -A settings values
 
-    curr="${{COMP_WORDS[$COMP_CWORD]}}"
     methods=( {methods} )
     opts=( {options} )
+    method_opts=( {method_options} )
+    all_settings=( {all_settings} )
+    settings=( {settings} )
+    values=( {values} )
+
+    # split on whitespace only, so that PARAM=VALUE stays one word
+    line="${{COMP_LINE:0:COMP_POINT}}"
+    read -ra words <<< "$line"
+    if [[ "$line" == *[[:space:]] ]];
+    then
+        curr=""
+        prev="${{words[-1]}}"
+    else
+        curr="${{words[-1]}}"
+        prev="${{words[-2]}}"
+    fi
+
+    method=""
+    for word in "${{words[@]:1}}";
+    do
+        [[ " ${{methods[*]}} " == *" $word "* ]] && method="$word"
+    done
 
     COMPREPLY=()
 
-    if [[ "$curr" == -* ]];
+    if [[ "$prev" == "-p" || "$prev" == "--param" ]];
     then
-        COMPREPLY=( $(compgen -W "${{opts[*]}}" -- "$curr") )
-    elif [ "${{COMP_CWORD}}" -gt 1 ] \\
-          && [ "${{COMP_WORDS[$COMP_CWORD-1]}}" == "-p" ];
+        if [[ "$curr" == *=* ]];
+        then
+            param="${{curr%%=*}}"
+            known="${{values[${{method}}:${{param}}]:-${{values[${{param}}]}}}}"
+            COMPREPLY=( $(compgen -W "$known" -- "${{curr#*=}}") )
+            if [[ "$COMP_WORDBREAKS" != *=* ]];
+            then
+                COMPREPLY=( "${{COMPREPLY[@]/#/${{param}}=}}" )
+            fi
+        else
+            if [[ -n "$method" ]];
+            then
+                known="${{settings[${{method}}]}}"
+            else
+                known="${{all_settings[*]}}"
+            fi
+            COMPREPLY=( $(compgen -S "=" -W "$known" -- "$curr") )
+            compopt -o nospace 2>/dev/null
+        fi
+    elif [[ " ${{method_opts[*]}} " == *" $prev "* ]];
+    then
+        COMPREPLY=( $(compgen -W "${{methods[*]}}" -- "$curr") )
+    elif [[ "$curr" == -* ]];
     then
-        # TODO: Implement fetching known/valid settings from mkcrypt
-        COMPREPLY=()
+        COMPREPLY=( $(compgen -W "${{opts[*]}}" -- "$curr") )
     else
         COMPREPLY=( $(compgen -W "${{methods[*]}}" -- "$curr") )
     fi
 }}
 
-complete -F _mkcrypt_autocomplete passlib-mkpasswd
+complete -F _passlib_mkpasswd_autocomplete {program}
 """
 
 
-def format_text_list(items):
-    return " ".join(shlex.quote(item) for item in items)
+zsh_template = """
+#compdef {program}
+
+typeset -gA _passlib_mkpasswd_settings _passlib_mkpasswd_values
+_passlib_mkpasswd_settings=( {settings} )
+_passlib_mkpasswd_values=( {values} )
 
+_passlib_mkpasswd_autocomplete()
+{{
+    local curr prev method word param known
+    local -a methods opts method_opts all_settings
 
-def format_autocomplete_script(methods):
-    return template.format(
-        options=format_text_list(OPTIONS),
-        methods=format_text_list(methods),
+    methods=( {methods} )
+    opts=( {options} )
+    method_opts=( {method_options} )
+    all_settings=( {all_settings} )
+
+    curr="${{words[CURRENT]}}"
+    prev="${{words[CURRENT-1]}}"
+
+    method=""
+    for word in "${{(@)words[2,CURRENT-1]}}";
+    do
+        (( ${{methods[(Ie)$word]}} )) && method="$word"
+    done
+
+    if [[ "$prev" == "-p" || "$prev" == "--param" ]];
+    then
+        if [[ "$curr" == *=* ]];
+        then
+            param="${{curr%%=*}}"
+            known="${{_passlib_mkpasswd_values[${{method}}:${{param}}]}}"
+            known="${{known:-${{_passlib_mkpasswd_values[${{param}}]}}}}"
+            compset -P '*='
+            compadd -- ${{=known}}
+        else
+            if [[ -n "$method" ]];
+            then
+                known="${{_passlib_mkpasswd_settings[${{method}}]}}"
+            else
+                known="${{all_settings[*]}}"
+            fi
+            compadd -S '=' -- ${{=known}}
+        fi
+    elif (( ${{method_opts[(Ie)$prev]}} ));
+    then
+        compadd -- "${{methods[@]}}"
+    elif [[ "$curr" == -* ]];
+    then
+        compadd -- "${{opts[@]}}"
+    else
+        compadd -- "${{methods[@]}}"
+    fi
+}}
+
+compdef _passlib_mkpasswd_autocomplete {program}
+"""
+
+
+fish_template = """
+function __passlib_mkpasswd_method
+    set -l methods {methods}
+    set -l method
+    for word in (commandline -opc)[2..-1]
+        contains -- $word $methods; and set method $word
+    end
+    echo $method
+end
+
+function __passlib_mkpasswd_params
+    set -l curr (commandline -ct)
+    set -l method (__passlib_mkpasswd_method)
+    set -l known
+    if string match -q -- '*=*' $curr
+        set -l param (string split -m 1 = -- $curr)[1]
+        switch "$method:$param"
+{method_value_cases}
+        end
+        if test -z "$known"
+            switch $param
+{value_cases}
+            end
+        end
+        test -n "$known"; and printf '%s=%s\\n' $param $known
+    else
+        switch $method
+{settings_cases}
+            case ''
+                set known {all_settings}
+        end
+        test -n "$known"; and printf '%s=\\n' $known
+    end
+end
+
+complete -c {program} -f
+complete -c {program} -a '{methods}'
+{option_lines}
+"""
+
+
+def format_fish_cases(mapping, indent):
+    lines = []
+    for key in sorted(mapping):
+        lines.append('{0}case {1}'.format(indent, shlex.quote(key)))
+        lines.append('{0}    set known {1}'.format(
+            indent, format_text_list(mapping[key])))
+    return "\n".join(lines)
+
+
+def format_fish_option(data, action):
+    parts = ["complete", "-c", PROGRAM]
+    for option in action.option_strings:
+        if option.startswith('--'):
+            parts.extend(["-l", option[2:]])
+        else:
+            parts.extend(["-s", option[1:]])
+    if action.dest == 'params':
+        parts.extend(["-x", "-a", "'(__passlib_mkpasswd_params)'"])
+    elif action.metavar == 'METHOD':
+        parts.extend(["-x", "-a", shlex.quote(" ".join(data.methods))])
+    elif action.nargs != 0:
+        parts.append("-r")
+    if action.help and action.help != argparse.SUPPRESS:
+        formatter = data.parser._get_formatter()
+        description = " ".join(formatter._expand_help(action).split())
+        parts.extend(["-d", shlex.quote(description)])
+    return " ".join(parts)
+
+
+def format_bash_script(data):
+    return bash_template.format(
+        program=PROGRAM,
+        methods=format_text_list(data.methods),
+        options=format_text_list(data.options),
+        method_options=format_text_list(data.method_options),
+        all_settings=format_text_list(data.all_settings),
+        settings=format_assoc_items(data.settings),
+        values=format_assoc_items(data.values),
     )
 
 
+def format_zsh_script(data):
+    def zsh_assoc_items(mapping):
+        return " ".join(
+            "{0} {1}".format(shlex.quote(key),
+                             shlex.quote(" ".join(mapping[key])))
+            for key in sorted(mapping))
+
+    return zsh_template.format(
+        program=PROGRAM,
+        methods=format_text_list(data.methods),
+        options=format_text_list(data.options),
+        method_options=format_text_list(data.method_options),
+        all_settings=format_text_list(data.all_settings),
+        settings=zsh_assoc_items(data.settings),
+        values=zsh_assoc_items(data.values),
+    ).lstrip()
+
+
+def format_fish_script(data):
+    method_values = dict(
+        (k, v) for k, v in data.values.items() if ':' in k)
+    values = dict(
+        (k, v) for k, v in data.values.items() if ':' not in k)
+    return fish_template.format(
+        program=PROGRAM,
+        methods=format_text_list(data.methods),
+        all_settings=format_text_list(data.all_settings),
+        method_value_cases=format_fish_cases(method_values, ' ' * 12),
+        value_cases=format_fish_cases(values, ' ' * 16),
+        settings_cases=format_fish_cases(data.settings, ' ' * 12),
+        option_lines="\n".join(
+            format_fish_option(data, action)
+            for action in data.iter_option_actions()),
+    )
+
+
+formatters = {
+    'bash': format_bash_script,
+    'zsh': format_zsh_script,
+    'fish': format_fish_script,
+}
+
+
+def format_autocomplete_script(method_list, shell='bash'):
+    data = CompletionData(mkpasswd.make_parser(), method_list)
+    return formatters[shell](data)
+
+
 def main(inargs=None):
     parser = argparse.ArgumentParser(
-        description="Make autocomplete bash script for passlib",
+        description="Make autocomplete script for passlib-mkpasswd",
     )
 
     cli_utils.add_verbosity_mutex(parser)
     cli_utils.add_version_arg(parser)
+    cli_utils.add_log_format_arg(parser)
+    cli_utils.add_metrics_args(parser)
+    parser.add_argument(
+        '--shell',
+        choices=SHELLS,
+        default=SHELLS[0],
+        help="shell to make autocomplete script for (default: %(default)s)",
+    )
     args = parser.parse_args(inargs)
 
-    cli_utils.setup_logging(args.verbosity)
+    cli_utils.setup_output(args)
 
-    method_list = [m.name for m in methods.iter_supported_methods()]
+    from . import methods
+    method_list = list(methods.iter_supported_methods())
 
-    script = format_autocomplete_script(method_list)
+    script = format_autocomplete_script(method_list, shell=args.shell)
     print(script)
 
 
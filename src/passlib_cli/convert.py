@@ -0,0 +1,151 @@
+# encoding: utf-8
+"""
+Hash format conversion.
+
+Some methods are wrappers that store the cryptstring of another method with
+a different prefix, e.g. `ldap_bcrypt` stores bcrypt cryptstrings as
+'{CRYPT}$2b$...'.  Cryptstrings can be converted between such equivalent
+methods by rewriting the prefix - no hashing is needed.
+
+Conversion reads records from a file, one per line.  A record is either a
+cryptstring, or a '<user><TAB><cryptstring>' pair.
+"""
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+)
+import logging
+
+from . import batch
+from . import methods
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# records between output writes and metrics updates
+METRICS_INTERVAL = 10000
+
+
+def iter_equivalent_methods(method):
+    """ Iterate over methods that store cryptstrings in the same format. """
+    base = method.base.name
+    for m in methods.iter_all_methods():
+        if m.base.name == base:
+            yield m
+
+
+class Converter(object):
+    """ Convert cryptstrings from one method to an equivalent method.
+
+    :param methods.MethodWrapper source: method of the input cryptstrings
+    :param methods.MethodWrapper target: method of the output cryptstrings
+    :param bool strict:
+        Fully parse each cryptstring, rather than just identify it.  This
+        catches truncated and malformed cryptstrings, but is slower.
+    """
+
+    def __init__(self, source, target, strict=False):
+        base = source.base
+        if base.name != target.base.name:
+            raise ValueError(
+                "cannot convert {0} to {1}, equivalent methods: {2}".format(
+                    source.name, target.name,
+                    ', '.join(m.name for m in iter_equivalent_methods(source)
+                              if m.name != source.name) or '(none)'))
+        self.source = source
+        self.target = target
+        self.base = base
+        self.strict = strict and hasattr(base.method, 'from_string')
+        self.source_prefix, self.source_orig = source.prefixes
+        self.target_prefix, self.target_orig = target.prefixes
+        # looked up once, this is called for every record
+        self._identify = base.method.identify
+        self._parse = base.method.from_string if self.strict else None
+
+    def _check(self, cryptstring):
+        if self._parse is not None:
+            # raises a ValueError for malformed cryptstrings
+            self._parse(cryptstring)
+        elif not self._identify(cryptstring):
+            raise ValueError("not a {0} hash".format(self.base.name))
+
+    def __call__(self, cryptstring):
+        """ Convert a cryptstring.
+
+        :raises ValueError:
+            If the cryptstring isn't a valid source cryptstring, or it cannot
+            be represented by the target method.
+        """
+        source_prefix = self.source_prefix
+        if not cryptstring.startswith(source_prefix):
+            raise ValueError("missing {0} prefix {1!r}".format(
+                self.source.name, source_prefix))
+        cryptstring = self.source_orig + cryptstring[len(source_prefix):]
+        self._check(cryptstring)
+        target_orig = self.target_orig
+        if not cryptstring.startswith(target_orig):
+            raise ValueError("cannot be represented as {0}".format(
+                self.target.name))
+        return self.target_prefix + cryptstring[len(target_orig):]
+
+
+def convert_batch(converter, lines, output):
+    """ Convert all records from `lines`, and write results to `output`.
+
+    Records that cannot be converted are reported, and left out of the
+    output.
+
+    :param Converter converter: the conversion to apply
+    :param lines: iterable of input lines
+    :param output: file-like object to write results to
+
+    :return batch.BatchResult:
+    """
+    outcome = batch.BatchResult()
+    method = converter.source.name
+    counted = [0, 0]
+    buffered = []
+
+    def flush():
+        output.writelines(buffered)
+        del buffered[:]
+        metrics.registry.inc('records_total', outcome.records - counted[0],
+                             operation='convert', method=method)
+        metrics.registry.inc('errors_total', outcome.errors - counted[1],
+                             operation='convert', method=method)
+        counted[:] = [outcome.records, outcome.errors]
+
+    # This runs at I/O speed, so records are parsed inline rather than with
+    # batch.iter_records(), and output is written in chunks.
+    sep = batch.FIELD_SEP
+    for lineno, line in enumerate(lines, 1):
+        line = line.rstrip('\r\n')
+        if not line:
+            continue
+        outcome.records += 1
+        user, has_user, cryptstring = line.partition(sep)
+        if not has_user:
+            user, cryptstring = None, line
+        try:
+            result = converter(cryptstring)
+        except ValueError as e:
+            outcome.errors += 1
+            logger.error("line %d: unable to convert record: %s", lineno, e)
+            continue
+        buffered.append(user + sep + result + '\n' if has_user
+                        else result + '\n')
+        if len(buffered) >= METRICS_INTERVAL:
+            flush()
+    flush()
+
+    logger.info("converted %d records from %s to %s (%d errors)",
+                outcome.records, method, converter.target.name,
+                outcome.errors, extra={'event': 'convert',
+                                       'method': method,
+                                       'target': converter.target.name,
+                                       'records': outcome.records,
+                                       'errors': outcome.errors})
+    return outcome
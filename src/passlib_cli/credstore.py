@@ -0,0 +1,485 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Generate synthetic credential stores for load testing.
+
+Writes htpasswd, shadow or LDIF files with random users and passwords,
+hashed with a weighted mix of methods and params.  The matching plaintext
+passwords can be written to a separate file, as '<user><TAB><password>'
+records.
+
+Records are generated and hashed in a stream, so memory use doesn't depend
+on the number of users.  With a seed, the output is reproducible.
+"""
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+)
+import argparse
+import collections
+import itertools
+import logging
+import os
+import sys
+import textwrap
+
+from . import cli_utils
+from . import generate
+from . import metrics
+from .mkpasswd import param_type
+
+logger = logging.getLogger(__name__)
+
+
+FORMATS = ('htpasswd', 'shadow', 'ldif')
+DEFAULT_METHOD = 'sha512_crypt'
+DEFAULT_BASE_DN = 'ou=people,dc=example,dc=com'
+
+# A method from the mix, with its params and relative weight
+MixEntry = collections.namedtuple('MixEntry', ('method', 'params', 'weight'))
+
+
+def method_spec_type(value):
+    """ Parse a mix entry, e.g. 'bcrypt:3,rounds=10'.
+
+    :return tuple: a (method name, params, weight) tuple
+    """
+    spec, _, raw_params = value.partition(',')
+    name, sep, raw_weight = spec.partition(':')
+    if not name:
+        raise argparse.ArgumentTypeError("empty method name")
+    weight = 1
+    if sep:
+        try:
+            weight = int(raw_weight)
+        except ValueError:
+            weight = -1
+        if weight < 1:
+            raise argparse.ArgumentTypeError(
+                "invalid weight ({0})".format(raw_weight))
+    params = dict(param_type(p) for p in raw_params.split(',') if p)
+    return name, params, weight
+
+
+def make_salt(method, rng):
+    """ Make a salt for a method using a given rng.
+
+    :return: a salt, or `None` if the method doesn't take a salt
+    """
+    from passlib.utils import getrandbytes, getrandstr
+    handler = method.method
+    size = getattr(handler, 'default_salt_size', None)
+    if 'salt' not in method.settings or not size:
+        return None
+    if getattr(handler, '_salt_is_bytes', False):
+        return getrandbytes(rng, size)
+    return getrandstr(rng, handler.salt_chars, size)
+
+
+def is_crypt_method(method):
+    """ Check if a method is a crypt(3) format on some unix host. """
+    from passlib import hosts
+    return any(method.name in context.schemes() for context in (
+        hosts.linux_context,
+        hosts.freebsd_context,
+        hosts.netbsd_context,
+        hosts.openbsd_context,
+    ))
+
+
+def get_ldap_converter(method):
+    """ Get a converter to an equivalent '{SCHEME}' method for LDAP.
+
+    LDAP methods, and cryptstrings that already have a '{SCHEME}' prefix,
+    are kept as is.  Other crypt(3) formats get a '{CRYPT}' prefix.
+
+    :return: a function that converts cryptstrings to an LDAP
+        userPassword value.
+    """
+    from . import convert
+
+    def keep(cryptstring):
+        return cryptstring
+
+    # a plaintext userPassword is valid as is
+    if method.name.startswith('ldap_') or method.name == 'plaintext':
+        return keep
+    for m in convert.iter_equivalent_methods(method):
+        if m.name.startswith('ldap_'):
+            return convert.Converter(method, m)
+    if is_crypt_method(method):
+        return lambda cryptstring: (
+            cryptstring if cryptstring.startswith('{')
+            else '{CRYPT}' + cryptstring)
+    prefix, _ = method.prefixes
+    if not (prefix.startswith('{') or
+            (getattr(method.method, 'ident', None) or '').startswith('{')):
+        logger.warning("no LDAP scheme for %s, writing cryptstrings as is",
+                       method.name)
+    return keep
+
+
+class StoreWriter(object):
+    """ Write credential store entries in a given format. """
+
+    def __init__(self, output, store_format, base_dn=DEFAULT_BASE_DN):
+        if store_format not in FORMATS:
+            raise ValueError("invalid format: " + repr(store_format))
+        self.output = output
+        self.format = store_format
+        self.base_dn = base_dn
+        self._ldap_converters = {}
+
+    def begin(self):
+        if self.format == 'ldif':
+            self.output.write('version: 1\n\n')
+
+    def write(self, user, method, cryptstring):
+        if self.format == 'htpasswd':
+            self.output.write('{0}:{1}\n'.format(user, cryptstring))
+        elif self.format == 'shadow':
+            # no password aging, as in a freshly created account
+            self.output.write('{0}:{1}::0:99999:7:::\n'.format(
+                user, cryptstring))
+        else:
+            convert = self._ldap_converters.get(method.name)
+            if convert is None:
+                convert = self._ldap_converters[method.name] = (
+                    get_ldap_converter(method))
+            self.output.write(textwrap.dedent(
+                """
+                dn: uid={0},{1}
+                objectClass: inetOrgPerson
+                uid: {0}
+                cn: {0}
+                sn: {0}
+                userPassword: {2}
+                """
+            ).lstrip().format(user, self.base_dn, convert(cryptstring)) +
+                '\n')
+
+
+def select_executor(mix, jobs, kind='auto'):
+    """ Pick an executor that suits all methods in the mix. """
+    from . import executors
+    return executors.select_mixed_executor(
+        ((entry.method, entry.params) for entry in mix), jobs, kind=kind)
+
+
+class StoreResult(object):
+    """ Outcome of a store generation. """
+
+    def __init__(self):
+        self.records = 0
+        self.errors = 0
+
+
+def generate_store(mix, count, writer, plaintext=None, rng=None,
+                   password_params=None, user_prefix='user', pool_size=0,
+                   jobs=1, executor='auto', on_start=None):
+    """ Generate a credential store with `count` users.
+
+    :param list mix: MixEntry objects
+    :param StoreWriter writer: the store to write to
+    :param plaintext: file-like object for '<user><TAB><password>' records
+    :param random.Random rng:
+        rng for users, methods, passwords and salts - use a seeded rng for
+        reproducible stores.  Without an rng, passlib generates the salts.
+    :param dict password_params: entropy and length of passwords
+    :param int pool_size:
+        hash this many passwords per method, and reuse them for all users,
+        rather than hashing a new password for each user.  Methods that
+        require a user are always hashed for each user.
+    :param int jobs: number of workers
+    :param on_start:
+        callback once the workers are started, e.g. to start threads that
+        must not be running when worker processes are forked
+
+    :return StoreResult:
+    """
+    import random
+    from . import executors
+    seeded = rng is not None
+    rng = rng or random.SystemRandom()
+    password_params = dict(password_params or {})
+    cum_weights = list(itertools.accumulate(e.weight for e in mix))
+    positions = range(len(mix))
+    width = len(str(count))
+
+    def make_password():
+        return generate.generate_password(rng=rng, **password_params)
+
+    def make_item(entry, user, password):
+        params = dict(entry.params)
+        salt = make_salt(entry.method, rng) if seeded else None
+        if salt is not None:
+            params['salt'] = salt
+        return password, user, entry.method.name, params
+
+    # loads methods and backends before workers are forked
+    for entry in mix:
+        entry.method.backend
+    kind = select_executor(mix, jobs, kind=executor)
+    logger.info("using %s executor for %d methods", kind, len(mix))
+
+    # mix position -> precomputed (password, cryptstring) pairs
+    pools = {}
+    pending = collections.deque()
+    outcome = StoreResult()
+
+    def items():
+        for index in range(1, count + 1):
+            user = '{0}{1:0{2}d}'.format(user_prefix, index, width)
+            pos = rng.choices(positions, cum_weights=cum_weights)[0]
+            entry = mix[pos]
+            if pos in pools:
+                password, cryptstring = rng.choice(pools[pos])
+                pending.append((user, entry, password))
+                yield executors.Resolved(cryptstring)
+            else:
+                password = make_password()
+                pending.append((user, entry, password))
+                yield make_item(entry, user, password)
+
+    def on_pending(count):
+        metrics.registry.set('queue_depth', count, operation='store')
+
+    with executors.HashPool(mix[0].method, {}, jobs, kind,
+                            operation=executors.HASH_MIXED) as pool:
+        pool.start()
+        if on_start:
+            on_start()
+        if pool_size:
+            # the precomputed pool is shared by all users of a method
+            for pos, entry in enumerate(mix):
+                if entry.method.require_user:
+                    continue
+                passwords = [make_password() for _ in range(pool_size)]
+                pairs = []
+                for password, (cryptstring, error, _) in zip(
+                        passwords,
+                        pool.map(make_item(entry, None, p)
+                                 for p in passwords)):
+                    if error:
+                        raise ValueError("unable to hash with {0}: {1}".format(
+                            entry.method.name, error))
+                    pairs.append((password, cryptstring))
+                pools[pos] = pairs
+            logger.info("precomputed %d hashes per method", pool_size)
+
+        writer.begin()
+        for cryptstring, error, duration in pool.map(items(),
+                                                     on_pending=on_pending):
+            user, entry, password = pending.popleft()
+            outcome.records += 1
+            metrics.registry.add_record('store', entry.method.name, duration,
+                                        error=bool(error))
+            if error:
+                outcome.errors += 1
+                logger.error("unable to hash for %s: %s", user, error)
+                continue
+            writer.write(user, entry.method, cryptstring)
+            if plaintext is not None:
+                plaintext.write(user + '\t' + password + '\n')
+
+    logger.info("generated %d users (%d errors)", outcome.records,
+                outcome.errors, extra={'event': 'store',
+                                       'records': outcome.records,
+                                       'errors': outcome.errors})
+    return outcome
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description=textwrap.dedent(
+            """
+            Generate synthetic credential stores (htpasswd, shadow, LDIF)
+            with random users and passwords, e.g. for load testing.
+            """
+        ).strip(),
+    )
+
+    parser.add_argument(
+        '-f', '--format',
+        choices=FORMATS,
+        default='htpasswd',
+        help="credential store format (default: %(default)s)",
+    )
+
+    parser.add_argument(
+        '-n', '--users',
+        type=int,
+        default=1000,
+        help="number of users (default: %(default)s)",
+        metavar='N',
+    )
+
+    parser.add_argument(
+        '-m', '--method',
+        dest='mix',
+        action='append',
+        type=method_spec_type,
+        default=[],
+        help=textwrap.dedent(
+            """
+            hash users with METHOD, with an optional weight and params, e.g.
+            `-m bcrypt:3,rounds=10 -m sha512_crypt,rounds=5000`.  Can be
+            given multiple times (default: {0})
+            """
+        ).format(DEFAULT_METHOD).strip(),
+        metavar='METHOD[:WEIGHT][,PARAM=VALUE...]',
+    )
+
+    parser.add_argument(
+        '--plaintext',
+        default=None,
+        help="write '<user><TAB><password>' records to %(metavar)s",
+        metavar='FILE',
+    )
+
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=None,
+        help="seed for reproducible users, passwords and salts",
+        metavar='N',
+    )
+
+    parser.add_argument(
+        '--pool',
+        dest='pool_size',
+        type=int,
+        default=0,
+        help=textwrap.dedent(
+            """
+            precompute %(metavar)s hashes per method, and reuse them for all
+            users - fast, but passwords are shared between users
+            (default: %(default)s, hash each user)
+            """
+        ).strip(),
+        metavar='N',
+    )
+
+    parser.add_argument(
+        '--user-prefix',
+        default='user',
+        help="username prefix (default: %(default)s)",
+    )
+
+    parser.add_argument(
+        '--base-dn',
+        default=DEFAULT_BASE_DN,
+        help="base DN for LDIF entries (default: %(default)s)",
+        metavar='DN',
+    )
+
+    parser.add_argument(
+        '--entropy',
+        default=None,
+        type=generate.entropy_type,
+        help="generate passwords of (minimum) strength %(metavar)s",
+        metavar="E",
+    )
+
+    parser.add_argument(
+        '--length',
+        type=int,
+        default=None,
+        help="generate passwords of (at least) %(metavar)s characters",
+        metavar="N",
+    )
+
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of parallel workers (default: %(default)s)",
+        metavar='N',
+    )
+
+    parser.add_argument(
+        '--executor',
+        choices=('auto', 'serial', 'thread', 'process', 'prefork'),
+        default='auto',
+        help="how to run workers (default: %(default)s)",
+    )
+
+    cli_utils.add_version_arg(parser)
+    cli_utils.add_verbosity_mutex(parser)
+    cli_utils.add_log_format_arg(parser)
+    cli_utils.add_metrics_args(parser)
+    if __name__ == '__main__':
+        parser.prog = 'python -m ' + __spec__.name
+    return parser
+
+
+def main(inargs=None):
+    parser = make_parser()
+    args = parser.parse_args(inargs)
+    # metrics are written once the workers are started
+    cli_utils.setup_output(args, metrics=False)
+
+    from . import methods
+    if args.users < 0:
+        parser.error("invalid number of users: {0}".format(args.users))
+    if args.jobs < 1:
+        parser.error("invalid number of jobs: {0}".format(args.jobs))
+    if args.pool_size < 0:
+        parser.error("invalid pool size: {0}".format(args.pool_size))
+
+    mix = []
+    for name, params, weight in args.mix or [(DEFAULT_METHOD, {}, 1)]:
+        if not (methods.is_known_method(name) and
+                methods.get_method(name).supported):
+            parser.error(
+                "argument --method: invalid choice: {0!r} (use "
+                "passlib-mkpasswd --list-methods to see available)".format(
+                    name))
+        method = methods.get_method(name)
+        for p in params:
+            if p not in method.settings:
+                parser.error("argument --method: {0} has no parameter "
+                             "{1}".format(name, p))
+        mix.append(MixEntry(method, params, weight))
+
+    rng = None
+    if args.seed is not None:
+        import random
+        rng = random.Random(args.seed)
+        # passlib warns about salts it needs to adjust, e.g. the padding
+        # bits of bcrypt salts
+        import warnings
+        from passlib.exc import PasslibHashWarning
+        warnings.filterwarnings('ignore', category=PasslibHashWarning)
+
+    plaintext = None
+    if args.plaintext:
+        # plaintext passwords - only readable by the owner
+        plaintext = cli_utils.open_private(args.plaintext)
+
+    try:
+        outcome = generate_store(
+            mix, args.users,
+            StoreWriter(sys.stdout, args.format, base_dn=args.base_dn),
+            plaintext=plaintext,
+            rng=rng,
+            password_params={'entropy': args.entropy, 'length': args.length},
+            user_prefix=args.user_prefix,
+            pool_size=args.pool_size,
+            jobs=args.jobs,
+            executor=args.executor,
+            on_start=cli_utils.get_metrics_starter(args))
+    except ValueError as e:
+        raise SystemExit(str(e))
+    finally:
+        if plaintext is not None:
+            plaintext.close()
+    if outcome.errors:
+        raise SystemExit("{0} of {1} users failed".format(
+            outcome.errors, outcome.records))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# encoding: utf-8
+"""
+Memory efficient duplicate filters for bulk generation.
+
+Small batches are checked exactly, with a set of all values.  Large batches
+use a Bloom filter, which needs a few bytes per value regardless of value
+size.  A Bloom filter never misses a value that has been added, but may
+report an unseen value as seen (a false positive) - when generating unique
+values, a false positive only costs an extra attempt.
+"""
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+)
+import hashlib
+import math
+
+# use an exact set for up to this many values
+EXACT_LIMIT = 100000
+
+# default Bloom filter false positive rate
+DEFAULT_ERROR_RATE = 0.001
+
+
+def expected_collisions(count, entropy):
+    """ Expected number of repeated values in `count` random values.
+
+    :param int count: number of values
+    :param float entropy: entropy (bits) of each value
+
+    :return float: expected number of values that repeat an earlier value
+    """
+    space = 2.0 ** entropy
+    if count < 2:
+        return 0.0
+    # expected number of distinct values: S * (1 - (1 - 1/S) ** N)
+    distinct = -space * math.expm1(count * math.log1p(-1.0 / space))
+    return max(0.0, count - distinct)
+
+
+class BloomFilter(object):
+    """ A Bloom filter sized for `capacity` values.
+
+    :param int capacity: expected number of values
+    :param float error_rate: false positive rate at capacity
+    """
+
+    def __init__(self, capacity, error_rate=DEFAULT_ERROR_RATE):
+        if not 0 < error_rate < 1:
+            raise ValueError("invalid error rate: " + repr(error_rate))
+        capacity = max(1, capacity)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16)
+        digest = digest.digest()
+        # double hashing: h1 + i * h2
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, value):
+        """ Add a value.
+
+        :return bool: `True` if the value may have been added before
+        """
+        bits = self._bits
+        seen = True
+        for pos in self._positions(value):
+            byte, mask = pos >> 3, 1 << (pos & 7)
+            if not bits[byte] & mask:
+                seen = False
+                bits[byte] |= mask
+        if not seen:
+            self.count += 1
+        return seen
+
+    def __contains__(self, value):
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(value))
+
+    @property
+    def current_error_rate(self):
+        """ Estimated false positive rate with the current values. """
+        return (1 - math.exp(-self.hashes * self.count / self.size)
+                ) ** self.hashes
+
+    @property
+    def nbytes(self):
+        return len(self._bits)
+
+
+class ExactFilter(object):
+    """ A duplicate filter that remembers all values. """
+
+    error_rate = 0.0
+    current_error_rate = 0.0
+
+    def __init__(self):
+        self._values = set()
+
+    def add(self, value):
+        """ Add a value.
+
+        :return bool: `True` if the value has been added before
+        """
+        if value in self._values:
+            return True
+        self._values.add(value)
+        return False
+
+    def __contains__(self, value):
+        return value in self._values
+
+    @property
+    def count(self):
+        return len(self._values)
+
+
+def make_filter(capacity, error_rate=DEFAULT_ERROR_RATE,
+                exact_limit=EXACT_LIMIT):
+    """ Get a duplicate filter for up to `capacity` values.
+
+    Small batches use an exact filter, large batches a Bloom filter.
+    """
+    if capacity <= exact_limit:
+        return ExactFilter()
+    return BloomFilter(capacity, error_rate=error_rate)
@@ -0,0 +1,564 @@
+# encoding: utf-8
+"""
+Backend-aware executors for parallel hashing.
+
+Some backends (e.g. bcrypt, argon2-cffi, hashlib.scrypt) release the GIL while
+hashing, and scale well with threads.  Pure python backends need processes.
+Which one to use is probed once per method and backend, and the result is
+cached.
+"""
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+)
+import collections
+import json
+import logging
+import math
+import os
+import time
+
+from . import methods
+
+logger = logging.getLogger(__name__)
+
+
+SERIAL = 'serial'
+THREAD = 'thread'
+PROCESS = 'process'
+PREFORK = 'prefork'
+AUTO = 'auto'
+EXECUTORS = (AUTO, SERIAL, THREAD, PROCESS, PREFORK)
+
+# Minimal time to spend on each probe run (seconds)
+PROBE_TIME = 0.05
+
+# Minimal time of a single probe hash (seconds) - rounds are lowered towards
+# it, so that probing expensive params stays cheap
+PROBE_HASH_TIME = 0.002
+
+# Threads must give at least this fraction of a linear speedup to be used
+THREAD_EFFICIENCY = 0.5
+
+# Records per task, when sending work to other processes
+PROCESS_CHUNK_SIZE = 16
+
+# Max number of threads to probe with
+PROBE_THREADS = 4
+
+# Seconds before a cached probe result is probed again
+PROBE_CACHE_TTL = 7 * 24 * 3600
+
+
+def get_cache_file():
+    """ Get the file used to cache probe results. """
+    cache_dir = (os.environ.get('XDG_CACHE_HOME') or
+                 os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_dir, 'passlib-cli', 'executors.json')
+
+
+def get_cache_key(method, params, threads):
+    """ Probe results depend on the method, backend, params, the number of
+    threads probed with, and the python version. """
+    import platform
+    import passlib
+    # salts and users don't change the cost of a hash, and probes don't use
+    # the given rounds (see get_probe_params)
+    settings = ','.join(
+        '{0}={1}'.format(k, params[k]) for k in sorted(params)
+        if k not in ('salt', 'user', 'rounds'))
+    return ':'.join((
+        method.name,
+        method.backend or '-',
+        settings or '-',
+        'threads={0}'.format(threads),
+        passlib.__version__,
+        platform.python_implementation(),
+        platform.python_version(),
+    ))
+
+
+class ProbeCache(object):
+    """ Cache of probe results, kept in memory and in a json file. """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self._results = None
+
+    @property
+    def results(self):
+        if self._results is None:
+            self._results = self._load()
+        return self._results
+
+    def _load(self):
+        if not self.filename:
+            return {}
+        try:
+            with open(self.filename) as f:
+                return dict(json.load(f))
+        except (IOError, OSError, ValueError, TypeError):
+            logger.debug("unable to read probe cache %s",
+                         repr(self.filename), exc_info=True)
+            return {}
+
+    def _save(self):
+        if not self.filename:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            tmp = '{0}.{1}.tmp'.format(self.filename, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(self.results, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.filename)
+        except (IOError, OSError):
+            logger.debug("unable to write probe cache %s",
+                         repr(self.filename), exc_info=True)
+
+    def get(self, key, ttl=PROBE_CACHE_TTL):
+        """ Get a cached result, unless it has expired. """
+        result = self.results.get(key)
+        if result is not None and time.time() - result.get('time', 0) > ttl:
+            return None
+        return result
+
+    def set(self, key, value):
+        self.results[key] = dict(value, time=time.time())
+        self._save()
+
+    def clear(self):
+        """ Forget all probe results. """
+        self._results = {}
+        self._save()
+
+
+# probe results, alongside the methods registry
+probe_cache = ProbeCache(get_cache_file())
+
+
+def _timed(func, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return time.perf_counter() - start
+
+
+def get_probe_params(method, params):
+    """ Get the params to probe a method with.
+
+    How a backend scales doesn't depend on the number of rounds, as long as
+    a hash takes longer than calling it.  Rounds are lowered to the least
+    that take PROBE_HASH_TIME, and at most the given (or default) rounds.
+    """
+    params = dict(params)
+    if method.require_user:
+        params.setdefault('user', 'probe')
+    handler = methods.get_base_method(method.method)
+    min_rounds = getattr(handler, 'min_rounds', None)
+    if 'rounds' not in method.settings or min_rounds is None:
+        return params
+    max_rounds = params.get('rounds', handler.default_rounds)
+    rounds = min_rounds
+    # loads the backend
+    method('probe', **dict(params, rounds=rounds))
+    while rounds < max_rounds:
+        trial = dict(params, rounds=rounds)
+        if _timed(lambda: method('probe', **trial), 1) >= PROBE_HASH_TIME:
+            break
+        if handler.rounds_cost == 'log2':
+            rounds += 1
+        else:
+            # odd, as bsdi_crypt requires
+            rounds = rounds * 2 + 1
+    params['rounds'] = min(rounds, max_rounds)
+    return params
+
+
+def probe_thread_speedup(method, params, threads):
+    """ Measure how well hashing with a given method scales with threads.
+
+    :return float:
+        Return the speedup of hashing with `threads` threads, compared to
+        hashing serially.
+    """
+    import concurrent.futures
+    params = get_probe_params(method, params)
+
+    def work():
+        return method('probe', **params)
+
+    # warm up, and estimate the cost of a single hash
+    cost = max(_timed(work, 1), 1e-6)
+    per_thread = max(1, int(math.ceil(PROBE_TIME / cost / threads)))
+    count = per_thread * threads
+
+    serial = _timed(work, count)
+    with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+        start = time.perf_counter()
+        futures = [pool.submit(_timed, work, per_thread)
+                   for _ in range(threads)]
+        for future in futures:
+            future.result()
+        threaded = time.perf_counter() - start
+    speedup = serial / max(threaded, 1e-9)
+    logger.debug("probe %s (backend=%s, rounds=%s): %d hashes, "
+                 "serial=%.3fs, threaded=%.3fs, speedup=%.2f (threads=%d)",
+                 method.name, method.backend, params.get('rounds', '-'),
+                 count, serial, threaded, speedup, threads)
+    return speedup
+
+
+def threads_scale(method, params, jobs, cache=None):
+    """ Check (and cache) if threaded hashing scales for a method. """
+    cache = probe_cache if cache is None else cache
+    threads = min(jobs, PROBE_THREADS)
+    key = get_cache_key(method, params, threads)
+    result = cache.get(key)
+    if result is None:
+        speedup = probe_thread_speedup(method, params, threads)
+        result = {
+            'threads': threads,
+            'speedup': speedup,
+            'scales': speedup >= max(1.2, THREAD_EFFICIENCY * threads),
+        }
+        cache.set(key, result)
+    return result['scales']
+
+
+def can_fork():
+    import multiprocessing
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def select_executor(method, params, jobs, kind=AUTO, cache=None):
+    """ Pick the executor kind to use for hashing with a method.
+
+    :param methods.MethodWrapper method: the hash method
+    :param dict params: hash parameters
+    :param int jobs: number of workers
+    :param str kind: requested executor, or AUTO to probe
+
+    :return str: one of SERIAL, THREAD, PROCESS, PREFORK
+    """
+    if kind != AUTO:
+        selected = kind
+    elif jobs < 2:
+        selected = SERIAL
+    elif threads_scale(method, params, jobs, cache=cache):
+        selected = THREAD
+    elif can_fork():
+        selected = PREFORK
+    else:
+        selected = PROCESS
+    logger.info("using %s executor for %s (backend=%s, jobs=%d)",
+                selected, method.name, method.backend, jobs)
+    return selected
+
+
+def select_mixed_executor(items, jobs, kind=AUTO, cache=None):
+    """ Pick an executor kind that suits a mix of methods.
+
+    :param items: (method, params) tuples
+    :param int jobs: number of workers
+    :param str kind: requested executor, or AUTO to probe
+
+    :return str: one of SERIAL, THREAD, PROCESS, PREFORK
+    """
+    if kind != AUTO:
+        return kind
+    kinds = set(select_executor(method, params, jobs, cache=cache)
+                for method, params in items)
+    if not kinds:
+        return SERIAL
+    if len(kinds) == 1:
+        return kinds.pop()
+    # some methods don't scale with threads
+    if PREFORK in kinds:
+        return PREFORK
+    return PROCESS
+
+
+#
+# Workers
+#
+# A task is a list of items, and returns a list of (result, error, duration)
+# items.
+#
+
+def _get_params(method, params, user):
+    if user is not None and method.require_user:
+        return dict(params, user=user)
+    return params
+
+
+def _run_item(func, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        result, error = func(*args, **kwargs), None
+    except Exception as e:
+        result, error = None, '{0}: {1}'.format(type(e).__name__, e)
+    return result, error, time.perf_counter() - start
+
+
+def hash_items(method, params, items):
+    """ Hash (password, user) items. """
+    return [
+        _run_item(method, password, **_get_params(method, params, user))
+        for password, user in items]
+
+
+def verify_items(method, params, items):
+    """ Verify (password, user, cryptstring) items. """
+    return [
+        _run_item(method.verify, password, cryptstring,
+                  **_get_params(method, params, user))
+        for password, user, cryptstring in items]
+
+
+def hash_mixed_items(method, params, items):
+    """ Hash (password, user, method name, params) items.
+
+    For pools that hash with several methods - the pool method and params
+    are not used.
+    """
+    results = []
+    for password, user, name, item_params in items:
+        item_method = methods.get_method(name)
+        results.append(_run_item(
+            item_method, password,
+            **_get_params(item_method, item_params, user)))
+    return results
+
+
+def verify_mixed_items(method, params, items):
+    """ Verify (password, user, cryptstring, method name) items.
+
+    For pools that verify hashes of several methods - the pool method and
+    params are not used.
+    """
+    results = []
+    for password, user, cryptstring, name in items:
+        item_method = methods.get_method(name)
+        results.append(_run_item(
+            item_method.verify, password, cryptstring,
+            **_get_params(item_method, {}, user)))
+    return results
+
+
+HASH = 'hash'
+HASH_MIXED = 'hash-mixed'
+VERIFY = 'verify'
+VERIFY_MIXED = 'verify-mixed'
+_operations = {
+    HASH: hash_items,
+    HASH_MIXED: hash_mixed_items,
+    VERIFY: verify_items,
+    VERIFY_MIXED: verify_mixed_items,
+}
+
+
+def _run_by_name(operation, method_name, params, items):
+    """ process pool task - looks up the method in each task. """
+    return _operations[operation](
+        methods.get_method(method_name), params, items)
+
+
+_worker_method = None
+_worker_params = None
+
+
+def _init_preforked(method_name, params):
+    """ prefork pool initializer - load the method and its backend. """
+    global _worker_method, _worker_params
+    _worker_method = methods.get_method(method_name)
+    _worker_params = params
+    # loads the backend
+    _worker_method.backend
+
+
+def _run_preloaded(operation, items):
+    """ prefork pool task - uses the preloaded method. """
+    return _operations[operation](_worker_method, _worker_params, items)
+
+
+def ordered_map(func, items, jobs):
+    """ Map func over items in a process pool, and yield results in order.
+
+    Unlike Executor.map, only a few items per worker are kept in flight, so
+    that memory use doesn't depend on the number of items.  Items are
+    processed in the calling process if `jobs` is less than 2.
+    """
+    if jobs < 2:
+        for item in items:
+            yield func(item)
+        return
+    import concurrent.futures
+    import multiprocessing
+    context = multiprocessing.get_context('fork') if can_fork() else None
+    max_pending = jobs * 2
+    pending = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(
+            jobs, mp_context=context) as pool:
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class Resolved(object):
+    """ An item with a known result, that doesn't need a worker.
+
+    Resolved items are passed through `HashPool.map` in order, e.g. for
+    cached verification results.
+    """
+
+    __slots__ = ('result',)
+
+    def __init__(self, result):
+        self.result = result
+
+
+def _resolved_future(results):
+    import concurrent.futures
+    future = concurrent.futures.Future()
+    future.set_result(results)
+    return future
+
+
+class _SerialExecutor(object):
+    """ Runs tasks in the calling thread, with the Executor interface. """
+
+    def submit(self, func, *args):
+        import concurrent.futures
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class HashPool(object):
+    """ Hash or verify passwords in parallel, using a given kind of executor.
+
+    :param str operation: HASH, HASH_MIXED, VERIFY or VERIFY_MIXED
+    """
+
+    def __init__(self, method, params, jobs, kind, operation=HASH):
+        self.method = method
+        self.params = dict(params)
+        self.jobs = jobs
+        self.kind = kind
+        self.operation = operation
+        self.chunk_size = (PROCESS_CHUNK_SIZE if kind in (PROCESS, PREFORK)
+                           else 1)
+        self._executor = None
+
+    def _make_executor(self):
+        import concurrent.futures
+        if self.kind == SERIAL:
+            return _SerialExecutor()
+        if self.kind == THREAD:
+            return concurrent.futures.ThreadPoolExecutor(self.jobs)
+        if self.kind == PROCESS:
+            return concurrent.futures.ProcessPoolExecutor(self.jobs)
+        if self.kind == PREFORK:
+            import multiprocessing
+            return concurrent.futures.ProcessPoolExecutor(
+                self.jobs,
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=_init_preforked,
+                initargs=(self.method.name, self.params),
+            )
+        raise ValueError("invalid executor: " + repr(self.kind))
+
+    def start(self):
+        """ Start all workers.
+
+        Worker processes are forked from the calling process - start them
+        before any other threads (e.g. the metrics writer) are started.
+        """
+        for future in [self.submit([]) for _ in range(self.jobs)]:
+            future.result()
+        return self
+
+    def submit(self, items):
+        if self._executor is None:
+            self._executor = self._make_executor()
+        if self.kind == PREFORK:
+            return self._executor.submit(
+                _run_preloaded, self.operation, items)
+        if self.kind == PROCESS:
+            return self._executor.submit(
+                _run_by_name, self.operation, self.method.name, self.params,
+                items)
+        return self._executor.submit(
+            _operations[self.operation], self.method, self.params, items)
+
+    def map(self, items, on_pending=None):
+        """ Process items, and yield results in order.
+
+        At most a few tasks per worker are kept in flight, so that memory
+        use doesn't depend on the number of items.
+
+        :param items:
+            iterable of (password, user) tuples to hash, or
+            (password, user, method name, params) tuples to hash with
+            HASH_MIXED, or (password, user, cryptstring) tuples to verify,
+            or (password, user, cryptstring, method name) tuples to verify
+            with VERIFY_MIXED, or Resolved items
+        :param on_pending: callback with the number of items in flight
+
+        :return: generator of (result, error, duration) tuples
+        """
+        max_pending = max(1, self.jobs) * 4
+        pending = collections.deque()
+        pending_items = 0
+        items = iter(items)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < max_pending:
+                chunk = []
+                resolved = None
+                for item in items:
+                    if isinstance(item, Resolved):
+                        resolved = item
+                        break
+                    chunk.append(item)
+                    if len(chunk) >= self.chunk_size:
+                        break
+                if not chunk and resolved is None:
+                    exhausted = True
+                    break
+                if chunk:
+                    pending.append((len(chunk), self.submit(chunk)))
+                    pending_items += len(chunk)
+                if resolved is not None:
+                    pending.append((0, _resolved_future(
+                        [(resolved.result, None, 0.0)])))
+            if on_pending:
+                on_pending(pending_items)
+            if not pending:
+                break
+            size, future = pending.popleft()
+            pending_items -= size
+            for result in future.result():
+                yield result
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
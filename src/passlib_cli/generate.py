@@ -8,12 +8,14 @@ from __future__ import (
     unicode_literals,
 )
 import argparse
+import itertools
 import logging
+import os
+import sys
 import textwrap
 
-from passlib import pwd
-
 from . import cli_utils
+from . import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -29,62 +31,71 @@ def generate_passphrase(entropy=None, length=None, sep=default_phrase_sep):
         'sep': sep,
     }
     logger.info("generating passphrase using %s", repr(params))
+    from passlib import pwd
     return pwd.genphrase(**params)
 
 
-def generate_password(entropy=None, length=None, charset=default_word_charset):
+def generate_password(entropy=None, length=None, charset=default_word_charset,
+                      rng=None):
     params = {
         'entropy': entropy,
         'length': length,
         'charset': charset,
     }
     logger.info("generating password using %s", repr(params))
+    from passlib import pwd
+    if rng is not None:
+        # e.g. a seeded random.Random for reproducible passwords
+        params['rng'] = rng
     return pwd.genword(**params)
 
 
-parser = argparse.ArgumentParser(
-    description="Generate plaintext passwords using passlib.pwd",
-    formatter_class=argparse.RawDescriptionHelpFormatter,
-)
+def get_generator(kind, entropy=None, length=None,
+                  charset=default_word_charset, sep=default_phrase_sep,
+                  rng=None):
+    """ Get a reusable passlib.pwd generator, for bulk generation.
 
-default_type = "genword"
-type_mutex = parser.add_mutually_exclusive_group()
-type_mutex.add_argument(
-    "--random",
-    action="store_const",
-    const="genword",
-    dest="type",
-    help=(
-        "Generate a random string" +
-        (" (default)" if default_type == "genword" else "")
-    ),
-)
-type_mutex.add_argument(
-    "--phrase",
-    action="store_const",
-    const="genphrase",
-    dest="type",
-    help=(
-        "Generate a passphrase" +
-        (" (default)" if default_type == "genphrase" else "")
-    ),
-)
-type_mutex.set_defaults(type=default_type)
+    :param str kind: "genword" or "genphrase"
+
+    :return passlib.pwd.SequenceGenerator:
+        Return a generator - call it to get a new password.  Its `entropy`
+        attribute is the entropy of each password.
+    """
+    from passlib import pwd
+    params = {
+        'entropy': entropy,
+        'length': length,
+    }
+    if rng is not None:
+        params['rng'] = rng
+    if kind == "genphrase":
+        return pwd.PhraseGenerator(sep=sep, **params)
+    return pwd.WordGenerator(charset=charset, **params)
 
-params_group = parser.add_argument_group(
-    "Parameters",
-    textwrap.dedent(
-        """
-        Parameters for the password generator.
 
-        Note that some parameters only applies to passwords or passphrases.
+# give up after this many duplicates in a row
+MAX_ATTEMPTS = 1000
 
-        If both entropy and length is given, the stronger will be used.
-        Entropy can be given as a numerical value, or as a preset.  Valid
-        presets are: "weak" (24), "fair" (36), "strong" (48), "secure" (56).
-        """
-    ).lstrip(),
-)
+
+def generate_unique(generator, count, dupe_filter):
+    """ Generate `count` unique passwords.
+
+    :param generator: a passlib.pwd generator (see `get_generator`)
+    :param dupe_filter: a duplicate filter (see `dedupe.make_filter`)
+
+    :return: generator of passwords
+    """
+    add = dupe_filter.add
+    for _ in range(count):
+        for _ in range(MAX_ATTEMPTS):
+            value = generator()
+            if not add(value):
+                break
+        else:
+            raise ValueError(
+                "unable to generate a unique password after {0} attempts, "
+                "use a higher entropy or length".format(MAX_ATTEMPTS))
+        yield value
 
 
 def entropy_type(value):
@@ -93,39 +104,296 @@ def entropy_type(value):
     return value
 
 
-params_group.add_argument(
-    "--entropy",
-    default=None,
-    type=entropy_type,
-    help="Generate a password of (minimum) strength %(metavar)s",
-    metavar="E",
-)
+def get_entropy_bits(value):
+    """ Get bits of entropy from a number or a preset name. """
+    if isinstance(value, int):
+        return value
+    from passlib import pwd
+    try:
+        return pwd.entropy_aliases[value]
+    except KeyError:
+        raise ValueError("invalid entropy preset: {0!r}".format(value))
 
-params_group.add_argument(
-    "--length",
-    type=int,
-    default=None,
-    help="Generate a password of (at least) %(metavar)s characters",
-    metavar="N",
-)
 
-params_group.add_argument(
-    "--sep",
-    default=default_phrase_sep,
-    help=(
-        "For passphrase: use %(metavar)s as word separator " +
-        "(default: %(default)s)"
-    ),
-    metavar="D",
-)
+def shard_type(value):
+    """ Parse a shard argument, e.g. 2/8. """
+    index, sep, count = value.partition('/')
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        index = count = 0
+    if not sep or not 0 < index <= count:
+        raise argparse.ArgumentTypeError(
+            "invalid shard ({0}), use I/N".format(value))
+    return index, count
+
+
+default_type = "genword"
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Generate plaintext passwords using passlib.pwd",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    type_mutex = parser.add_mutually_exclusive_group()
+    type_mutex.add_argument(
+        "--random",
+        action="store_const",
+        const="genword",
+        dest="type",
+        help=(
+            "Generate a random string" +
+            (" (default)" if default_type == "genword" else "")
+        ),
+    )
+    type_mutex.add_argument(
+        "--phrase",
+        action="store_const",
+        const="genphrase",
+        dest="type",
+        help=(
+            "Generate a passphrase" +
+            (" (default)" if default_type == "genphrase" else "")
+        ),
+    )
+    type_mutex.set_defaults(type=default_type)
+
+    params_group = parser.add_argument_group(
+        "Parameters",
+        textwrap.dedent(
+            """
+            Parameters for the password generator.
 
-cli_utils.add_version_arg(parser)
-cli_utils.add_verbosity_mutex(parser)
+            Note that some parameters only applies to passwords or passphrases.
+
+            If both entropy and length is given, the stronger will be used.
+            Entropy can be given as a numerical value, or as a preset.
+            Valid presets are: "weak" (24), "fair" (36), "strong" (48),
+            "secure" (56).
+            """
+        ).lstrip(),
+    )
+
+    params_group.add_argument(
+        "--entropy",
+        default=None,
+        type=entropy_type,
+        help="Generate a password of (minimum) strength %(metavar)s",
+        metavar="E",
+    )
+
+    params_group.add_argument(
+        "--length",
+        type=int,
+        default=None,
+        help="Generate a password of (at least) %(metavar)s characters",
+        metavar="N",
+    )
+
+    bulk_group = params_group.add_argument_group()
+    bulk_group.add_argument(
+        "-n", "--count",
+        type=int,
+        default=1,
+        help="Generate %(metavar)s passwords, one per line (default: 1)",
+        metavar="N",
+    )
+
+    bulk_group.add_argument(
+        "--unique",
+        action="store_true",
+        default=False,
+        help=(
+            "Never repeat a password.  Large batches use a compact Bloom "
+            "filter, where a filter hit counts as a duplicate without an "
+            "exact check - some unique passwords are rejected, but no "
+            "duplicate is written"
+        ),
+    )
+
+    bulk_group.add_argument(
+        "--filter-error-rate",
+        type=float,
+        default=0.001,
+        help=(
+            "With --unique, false positive rate of the Bloom filter, i.e. "
+            "the share of unique passwords that are rejected " +
+            "(default: %(default)s)"
+        ),
+        metavar="P",
+    )
+
+    params_group.add_argument(
+        "--sep",
+        default=default_phrase_sep,
+        help=(
+            "For passphrase: use %(metavar)s as word separator " +
+            "(default: %(default)s)"
+        ),
+        metavar="D",
+    )
+
+    analyze_group = parser.add_argument_group(
+        "Analysis",
+        textwrap.dedent(
+            """
+            Estimate the entropy of existing passwords from stdin, one per
+            line, using the passlib charset and wordset model.  Passwords
+            below the threshold are written to stdout, as
+            '<bits><TAB><password>' records, and histograms to stderr.
+            """
+        ).lstrip(),
+    )
+
+    analyze_group.add_argument(
+        "--analyze",
+        action="store_true",
+        default=False,
+        help="Analyze passwords from stdin",
+    )
+
+    analyze_group.add_argument(
+        "--threshold",
+        type=entropy_type,
+        default="fair",
+        help="Flag passwords below %(metavar)s bits (default: %(default)s)",
+        metavar="E",
+    )
+
+    analyze_group.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of processes (default: %(default)s)",
+        metavar="N",
+    )
+
+    analyze_group.add_argument(
+        "--shard",
+        type=shard_type,
+        default=None,
+        help=(
+            "Only analyze every N-th line, starting at line I, e.g. to " +
+            "split a file between hosts"
+        ),
+        metavar="I/N",
+    )
+
+    cli_utils.add_version_arg(parser)
+    cli_utils.add_verbosity_mutex(parser)
+    cli_utils.add_log_format_arg(parser)
+    cli_utils.add_metrics_args(parser)
+    if __name__ == '__main__':
+        parser.prog = 'python -m ' + __spec__.name
+    return parser
+
+
+def report_collisions(generator, count, dupe_filter):
+    """ Report the expected collision rate of a bulk generation. """
+    from . import dedupe
+    collisions = dedupe.expected_collisions(count, generator.entropy)
+    print(
+        "{0} passwords with {1:.1f} bits of entropy: expected {2:.0f} "
+        "collisions ({3:.3g}%)".format(count, generator.entropy, collisions,
+                                       100.0 * collisions / max(count, 1)),
+        file=sys.stderr)
+    if isinstance(dupe_filter, dedupe.BloomFilter):
+        print(
+            "using a {0:.1f} MiB filter with a {1:.3g}% false positive "
+            "rate".format(dupe_filter.nbytes / 2 ** 20,
+                          100.0 * dupe_filter.error_rate),
+            file=sys.stderr)
+    if count > round(2 ** generator.entropy):
+        raise SystemExit("not enough unique passwords, use a higher entropy "
+                         "or length")
+
+
+def run_bulk(args, params):
+    """ Generate many passwords. """
+    from . import dedupe
+    generator = get_generator(args.type, **params)
+    values = (generator() for _ in range(args.count))
+    dupe_filter = None
+    attempts = [0]
+
+    def counted_generator():
+        attempts[0] += 1
+        return generator()
+
+    if args.unique:
+        try:
+            dupe_filter = dedupe.make_filter(
+                args.count, error_rate=args.filter_error_rate)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        report_collisions(generator, args.count, dupe_filter)
+        values = generate_unique(counted_generator, args.count, dupe_filter)
+
+    write = sys.stdout.write
+    generated = 0
+    # a value that was generated, but not written
+    unwritten = 0
+    try:
+        for value in values:
+            write(value + '\n')
+            generated += 1
+    except ValueError as e:
+        raise SystemExit(str(e))
+    except BrokenPipeError:
+        # e.g. piped to `head`, which is not an error.  Python flushes
+        # stdout at exit, so point it at devnull to keep that from failing.
+        unwritten = 1
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        os.close(devnull)
+        raise SystemExit()
+    finally:
+        metrics.registry.inc('records_total', generated,
+                             operation='generate', method=args.type)
+        if dupe_filter is not None:
+            rejected = attempts[0] - generated - unwritten
+            metrics.registry.inc('duplicates_total', rejected,
+                                 operation='generate', method=args.type)
+            print("rejected {0} duplicates".format(rejected),
+                  file=sys.stderr)
+
+
+def run_analyze(args):
+    """ Analyze passwords from stdin. """
+    from . import strength
+    try:
+        threshold = get_entropy_bits(args.threshold)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if args.jobs < 1:
+        raise SystemExit("invalid number of jobs: {0}".format(args.jobs))
+    # leaked lists are not always valid utf-8
+    for stream in (sys.stdin, sys.stdout):
+        if hasattr(stream, 'reconfigure'):
+            stream.reconfigure(encoding='utf-8', errors='surrogateescape')
+    lines = sys.stdin
+    output = sys.stdout
+    if args.shard:
+        index, count = args.shard
+        lines = itertools.islice(lines, index - 1, None, count)
+    summary = strength.analyze(lines, output, threshold=threshold,
+                               sep=args.sep, jobs=args.jobs)
+    output.flush()
+    metrics.registry.inc('records_total', summary.count,
+                         operation='analyze', method='entropy')
+    print(summary.format(threshold), file=sys.stderr)
 
 
 def main(inargs=None):
+    parser = make_parser()
     args = parser.parse_args(inargs)
-    cli_utils.setup_logging(args.verbosity)
+    cli_utils.setup_output(args)
+
+    if args.analyze:
+        run_analyze(args)
+        return
 
     if args.type == "genphrase":
         generate = generate_passphrase
@@ -141,9 +409,15 @@ def main(inargs=None):
         'entropy': args.entropy,
         'length': args.length,
     })
-    print(generate(**params))
+    if args.count < 1:
+        parser.error("invalid count: {0}".format(args.count))
+    if args.count > 1 or args.unique:
+        run_bulk(args, params)
+        return
+    with metrics.registry.record('generate', args.type):
+        password = generate(**params)
+    print(password)
 
 
 if __name__ == '__main__':
-    parser.prog = 'python -m ' + __spec__.name
     main()
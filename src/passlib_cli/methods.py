@@ -91,6 +91,107 @@ def get_settings(method):
     return set(getattr(method, 'setting_kwds', None) or ())
 
 
+def get_setting_values(method):
+    """ Get known values for method specific settings.
+
+    :param passlib.ifc.PasswordHash method:
+        The PasswordHash implementation to check.
+
+    :return dict:
+        Return a mapping of setting name to a tuple of known values.
+    """
+    if isinstance(method, PrefixWrapper):
+        return get_setting_values(method.wrapped)
+    settings = get_settings(method)
+    values = {}
+
+    idents = (getattr(method, 'ident_aliases', None) or
+              getattr(method, 'ident_values', None))
+    if 'ident' in settings and idents:
+        values['ident'] = tuple(sorted(idents))
+
+    variants = getattr(method, '_variant_aliases', None)
+    if 'variant' in settings and variants:
+        values['variant'] = tuple(sorted(variants))
+
+    if 'type' in settings:
+        try:
+            # argon2 needs a backend to list its types
+            values['type'] = tuple(method.type_values)
+        except Exception:
+            logger.debug("unable to get type values for %s", repr(method),
+                         exc_info=True)
+    return values
+
+
+def verify_hash(method, password, cryptstring, **params):
+    """ Verify a password against a cryptstring using a given implementation.
+
+    :param passlib.ifc.PasswordHash method:
+        The PasswordHash implementation to use.
+
+    :return bool:
+        Return `True` if the password matches the cryptstring.
+    """
+    return getattr(method, "verify")(password, cryptstring, **params)
+
+
+def get_backend_name(method):
+    """ Get the name of the active backend of a hash implementation.
+
+    :param passlib.ifc.PasswordHash method:
+        The PasswordHash implementation to check.
+
+    :return str:
+        Return the backend name, or `None` if the implementation doesn't
+        have multiple backends.
+    """
+    if isinstance(method, PrefixWrapper):
+        return get_backend_name(method.wrapped)
+    if not hasattr(method, 'get_backend'):
+        return None
+    return method.get_backend()
+
+
+def get_base_method(method):
+    """ Get the innermost implementation of a wrapped hash method.
+
+    :param passlib.ifc.PasswordHash method:
+        The PasswordHash implementation to check.
+
+    :return passlib.ifc.PasswordHash:
+        Return the wrapped implementation of a PrefixWrapper, or the method
+        itself.
+    """
+    if isinstance(method, PrefixWrapper):
+        return get_base_method(method.wrapped)
+    return method
+
+
+def get_prefixes(method):
+    """ Get the prefix a wrapped hash method adds to its cryptstrings.
+
+    A PrefixWrapper replaces a prefix of the wrapped cryptstring, e.g.
+    `ldap_pbkdf2_sha256` replaces '$pbkdf2-sha256$' with '{PBKDF2-SHA256}'.
+
+    :param passlib.ifc.PasswordHash method:
+        The PasswordHash implementation to check.
+
+    :return tuple:
+        Return a (prefix, orig_prefix) tuple, relative to the innermost
+        implementation.  Both are empty for methods that are not wrappers.
+    """
+    if not isinstance(method, PrefixWrapper):
+        return '', ''
+    prefix, orig_prefix = method.prefix, method.orig_prefix
+    inner_prefix, inner_orig = get_prefixes(method.wrapped)
+    if orig_prefix.startswith(inner_prefix):
+        return prefix, inner_orig + orig_prefix[len(inner_prefix):]
+    if inner_prefix.startswith(orig_prefix):
+        return prefix + inner_prefix[len(orig_prefix):], inner_orig
+    raise ValueError("unsupported wrapper: " + repr(method))
+
+
 def make_hash(method, password, **params):
     """ Hash a password using a given implementation.
 
@@ -137,6 +238,22 @@ class MethodWrapper(object):
             settings.add('user')
         return settings
 
+    @property
+    def setting_values(self):
+        return get_setting_values(self.method)
+
+    @property
+    def backend(self):
+        return get_backend_name(self.method)
+
+    @property
+    def base(self):
+        return get_method(get_base_method(self.method).name)
+
+    @property
+    def prefixes(self):
+        return get_prefixes(self.method)
+
     @property
     def supported(self):
         return is_supported(self.method)
@@ -153,25 +270,57 @@ class MethodWrapper(object):
 
         return make_hash(self.method, password, **params)
 
+    def verify(self, password, cryptstring, **params):
+        if self.require_user and 'user' not in params:
+            raise TypeError(
+                "{0.name} requires a 'user' parameter".format(self))
+        return verify_hash(self.method, password, cryptstring, **params)
+
+    def identify(self, cryptstring):
+        return self.method.identify(cryptstring)
 
-# Init the hash mappings:
-# attr_name -> MethodWrapper(attr_name, implementation_class)
-methods = OrderedDict(
-    (name, MethodWrapper(get_crypt_handler(name)))
-    for name in list_crypt_handlers())
+
+# The hash mappings are populated on demand, as loading a handler imports
+# its implementation module:
+# attr_name -> MethodWrapper(implementation_class)
+methods = OrderedDict()
+_all_methods_loaded = False
+
+
+def _load_method(name):
+    if name not in methods:
+        methods[name] = MethodWrapper(get_crypt_handler(name))
+    return methods[name]
+
+
+def _load_all_methods():
+    global _all_methods_loaded
+    if not _all_methods_loaded:
+        loaded = OrderedDict(
+            (name, _load_method(name))
+            for name in list_crypt_handlers())
+        methods.clear()
+        methods.update(loaded)
+        _all_methods_loaded = True
+    return methods
 
 
 def get_method(name):
     """ Look up a MethodWrapper for a given passlib method name. """
     logger.debug("looking up method from name=%s", repr(name))
-    m = methods[name]
+    m = _load_method(name)
     logger.debug("found method name=%s, method=%s", m.name, repr(m.method))
     return m
 
 
+def is_known_method(name):
+    """ Check if a given name is a known passlib method name. """
+    return name in methods or name in list_crypt_handlers()
+
+
 def iter_all_methods():
     """ Iterate over all passlib methods as MethodWrapper objects. """
-    return iter(methods.values())
+    return iter(_load_all_methods().values())
 
 
 def iter_supported_methods():
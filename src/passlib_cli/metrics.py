@@ -0,0 +1,245 @@
+# encoding: utf-8
+"""
+Performance metrics for long running batch jobs.
+
+Metrics are collected in a process wide registry, and can be written to a
+file in the Prometheus textfile format (e.g. for the node exporter textfile
+collector).
+"""
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+)
+import atexit
+import contextlib
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+PREFIX = 'passlib_cli'
+
+# Histogram buckets (seconds) - from fast hashes to expensive KDFs
+DURATION_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+# name -> (type, help)
+DESCRIPTIONS = {
+    'records_total': (
+        'counter', 'Number of processed records'),
+    'errors_total': (
+        'counter', 'Number of records that failed'),
+    'duplicates_total': (
+        'counter', 'Number of generated values rejected as duplicates'),
+    'results_total': (
+        'counter', 'Number of records by result'),
+    'record_duration_seconds': (
+        'histogram', 'Time spent processing a single record'),
+    'records_per_second': (
+        'gauge', 'Average number of processed records per second'),
+    'queue_depth': (
+        'gauge', 'Number of records waiting to be processed'),
+    'verify_cache_hits_total': (
+        'counter', 'Number of verifications answered from the cache'),
+    'verify_cache_misses_total': (
+        'counter', 'Number of verifications not found in the cache'),
+    'verify_cache_evictions_total': (
+        'counter', 'Number of cache entries evicted to make room'),
+    'verify_cache_expirations_total': (
+        'counter', 'Number of cache entries that expired'),
+    'verify_cache_coalesced_total': (
+        'counter', 'Number of verifications joined with one in flight'),
+    'verify_cache_entries': (
+        'gauge', 'Number of entries in the verification cache'),
+    'start_time_seconds': (
+        'gauge', 'Start time of the process since unix epoch'),
+    'last_update_seconds': (
+        'gauge', 'Time of the last metrics update since unix epoch'),
+}
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{0}="{1}"'.format(
+            k, str(v).replace('\\', '\\\\').replace('"', '\\"')
+                     .replace('\n', '\\n'))
+        for k, v in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics(object):
+    """ A minimal, thread safe metrics registry. """
+
+    def __init__(self, prefix=PREFIX, buckets=DURATION_BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                # [bucket counts..., sum, count]
+                hist = self._histograms[key] = [0] * len(self.buckets) + [
+                    0.0, 0]
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    hist[idx] += 1
+            hist[-2] += value
+            hist[-1] += 1
+
+    @contextlib.contextmanager
+    def record(self, operation, method):
+        """ Time and count a single record.
+
+        Errors are counted, and re-raised.
+        """
+        start = time.perf_counter()
+        error = True
+        try:
+            yield
+            error = False
+        finally:
+            self.add_record(operation, method, time.perf_counter() - start,
+                            error=error)
+
+    def add_record(self, operation, method, duration, error=False):
+        """ Count a single record that took `duration` seconds. """
+        if error:
+            self.inc('errors_total', operation=operation, method=method)
+        self.observe('record_duration_seconds', duration,
+                     operation=operation, method=method)
+        self.inc('records_total', operation=operation, method=method)
+
+    def _iter_samples(self):
+        now = time.time()
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = dict((k, list(v))
+                              for k, v in self._histograms.items())
+
+        # throughput per operation
+        elapsed = max(now - self.start_time, 1e-9)
+        per_operation = {}
+        for (name, labels), value in counters.items():
+            if name == 'records_total':
+                op = tuple((k, v) for k, v in labels if k == 'operation')
+                per_operation[op] = per_operation.get(op, 0) + value
+        for op, value in per_operation.items():
+            gauges[('records_per_second', op)] = value / elapsed
+        gauges[('start_time_seconds', ())] = self.start_time
+        gauges[('last_update_seconds', ())] = now
+
+        for (name, labels), value in counters.items():
+            yield name, name, labels, value
+        for (name, labels), value in gauges.items():
+            yield name, name, labels, value
+        for (name, labels), hist in histograms.items():
+            # bucket counts are cumulative
+            for bound, count in zip(self.buckets, hist):
+                yield (name, name + '_bucket',
+                       labels + (('le', _format_value(bound)),), count)
+            yield (name, name + '_bucket',
+                   labels + (('le', '+Inf'),), hist[-1])
+            yield name, name + '_sum', labels, hist[-2]
+            yield name, name + '_count', labels, hist[-1]
+
+    def format_textfile(self):
+        """ Format all metrics in the Prometheus text format. """
+        lines = []
+        described = set()
+        for metric, name, labels, value in sorted(
+                self._iter_samples(), key=lambda s: s[0]):
+            if metric not in described:
+                described.add(metric)
+                mtype, mhelp = DESCRIPTIONS.get(metric, ('untyped', metric))
+                lines.append('# HELP {0}_{1} {2}'.format(
+                    self.prefix, metric, mhelp))
+                lines.append('# TYPE {0}_{1} {2}'.format(
+                    self.prefix, metric, mtype))
+            lines.append('{0}_{1}{2} {3}'.format(
+                self.prefix, name, _format_labels(labels),
+                _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, filename):
+        """ Atomically write metrics to a file. """
+        tmp = '{0}.{1}.tmp'.format(filename, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(self.format_textfile())
+        os.replace(tmp, filename)
+        logger.debug("wrote metrics to %s", repr(filename))
+
+
+class MetricsWriter(threading.Thread):
+    """ Periodically write metrics to a textfile. """
+
+    def __init__(self, metrics, filename, interval=15.0):
+        super(MetricsWriter, self).__init__(name='metrics-writer')
+        self.daemon = True
+        self.metrics = metrics
+        self.filename = filename
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def write(self):
+        try:
+            self.metrics.write_textfile(self.filename)
+        except Exception:
+            logger.warning("unable to write metrics to %s",
+                           repr(self.filename), exc_info=True)
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        """ Stop writing, and write the final metrics. """
+        self._stopped.set()
+        self.write()
+
+
+# process wide metrics registry
+registry = Metrics()
+
+
+def start_writer(filename, interval=15.0, metrics=None):
+    """ Write metrics periodically, and at exit. """
+    writer = MetricsWriter(metrics or registry, filename, interval=interval)
+    writer.start()
+    atexit.register(writer.stop)
+    return writer
@@ -11,11 +11,12 @@ import argparse
 import getpass
 import itertools
 import logging
+import os
 import sys
 import textwrap
 
 from . import cli_utils
-from . import methods
+from . import metrics
 from . import params
 
 logger = logging.getLogger(__name__)
@@ -85,15 +86,14 @@ def param_type(raw_value):
     return param, value
 
 
-def make_parser(supported_methods=None):
-    supported_methods = supported_methods or []
-    method_choices = [m.name for m in supported_methods]
-
+def make_parser():
     parser = argparse.ArgumentParser(
         description="Make password hashes and cryptstrings using passlib",
     )
 
     cli_utils.add_verbosity_mutex(parser)
+    cli_utils.add_log_format_arg(parser)
+    cli_utils.add_metrics_args(parser)
 
     alt = parser.add_argument_group(
         'alternate actions',
@@ -126,14 +126,12 @@ def make_parser(supported_methods=None):
     )
     alt_actions.add_argument(
         '--show-params',
-        choices=method_choices,
         default=None,
         help="show supported parameters for %(metavar)s and exit",
         metavar='METHOD',
     )
     alt_actions.add_argument(
         '--show-docstring',
-        choices=method_choices,
         default=None,
         help="show docstring for a given implementation and exit",
         metavar='METHOD',
@@ -182,7 +180,6 @@ def make_parser(supported_methods=None):
 
     main.add_argument(
         'method',
-        choices=method_choices,
         nargs='?',
         default='scrypt',
         help=textwrap.dedent(
@@ -192,27 +189,367 @@ def make_parser(supported_methods=None):
         ).format('|'.join(list_m.option_strings)).strip(),
         metavar="METHOD",
     )
+
+    batch = parser.add_argument_group(
+        'batch mode',
+        textwrap.dedent(
+            """
+            Hash records from stdin, one per line, and write one
+            hash/cryptstring per record to stdout.  A record is either a
+            password, or a '<user><TAB><password>' pair.
+
+            With --check, records are verified instead.  A record is then a
+            '<cryptstring><TAB><password>' pair, or a
+            '<user><TAB><cryptstring><TAB><password>' triple, and the result
+            (ok, fail, error) is written for each record.
+
+            With --convert, cryptstrings are converted from METHOD to an
+            equivalent method, without hashing.  A record is then a
+            cryptstring, or a '<user><TAB><cryptstring>' pair.
+
+            With --make-vectors or --check-vectors, known-answer test vectors
+            are made or checked for all supported methods, e.g. to check that
+            a passlib or backend upgrade still verifies stored hashes.
+            Sample passwords are read from stdin, one per line.  Params given
+            with -p are used by all methods that support them.
+
+            Only one of these modes can be used at a time.
+            """
+        ).strip(),
+    )
+    modes = batch.add_mutually_exclusive_group()
+
+    modes.add_argument(
+        '--batch',
+        dest='batch',
+        action='store_true',
+        default=False,
+        help="hash records from stdin using METHOD",
+    )
+
+    modes.add_argument(
+        '--check',
+        dest='check',
+        action='store_true',
+        default=False,
+        help="verify records from stdin using METHOD",
+    )
+
+    modes.add_argument(
+        '--convert',
+        dest='convert',
+        default=None,
+        help=textwrap.dedent(
+            """
+            convert cryptstrings from stdin from METHOD to %(metavar)s, e.g.
+            `bcrypt --convert ldap_bcrypt` from bcrypt to ldap_bcrypt
+            """
+        ).strip(),
+        metavar='TARGET',
+    )
+
+    modes.add_argument(
+        '--make-vectors',
+        dest='make_vectors',
+        action='store_true',
+        default=False,
+        help="write test vectors for passwords from stdin to stdout",
+    )
+
+    modes.add_argument(
+        '--check-vectors',
+        dest='check_vectors',
+        default=None,
+        help=textwrap.dedent(
+            """
+            check test vectors from %(metavar)s, and write a report of
+            differences to stdout
+            """
+        ).strip(),
+        metavar='FILE',
+    )
+
+    batch.add_argument(
+        '--strict',
+        dest='strict',
+        action='store_true',
+        default=False,
+        help="with --convert, reject malformed or truncated cryptstrings",
+    )
+
+    batch.add_argument(
+        '-o', '--output',
+        dest='output',
+        default='-',
+        help=textwrap.dedent(
+            """
+            with --batch or --check, write results to %(metavar)s.  With
+            --batch, results can be upserted into an sqlite table with
+            'sqlite:PATH?table=TABLE&key=COLUMN' (default: stdout)
+            """
+        ).strip(),
+        metavar='OUTPUT',
+    )
+
+    batch.add_argument(
+        '-j', '--jobs',
+        dest='jobs',
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of parallel workers (default: %(default)s)",
+        metavar='N',
+    )
+
+    batch.add_argument(
+        '--executor',
+        dest='executor',
+        choices=('auto', 'serial', 'thread', 'process', 'prefork'),
+        default='auto',
+        help=textwrap.dedent(
+            """
+            how to run workers - the default is to pick the fastest executor
+            for the method and backend (default: %(default)s)
+            """
+        ).strip(),
+    )
+
+    batch.add_argument(
+        '--verify-cache',
+        dest='verify_cache',
+        type=int,
+        default=0,
+        help=textwrap.dedent(
+            """
+            with --check, remember up to %(metavar)s successful
+            verifications, so that repeated credentials are verified without
+            running the hash again (default: %(default)s, disabled)
+            """
+        ).strip(),
+        metavar='N',
+    )
+
+    batch.add_argument(
+        '--verify-cache-ttl',
+        dest='verify_cache_ttl',
+        type=float,
+        default=60.0,
+        help="cached verifications expire after %(metavar)s seconds "
+             "(default: %(default)s)",
+        metavar='SECONDS',
+    )
+
+    batch.add_argument(
+        '--checkpoint',
+        dest='checkpoint',
+        default=None,
+        help=textwrap.dedent(
+            """
+            with --batch or --check, save progress to %(metavar)s, so that
+            an interrupted run can be resumed.  Requires input from a file
+            and an output other than stdout
+            """
+        ).strip(),
+        metavar='FILE',
+    )
+
+    batch.add_argument(
+        '--checkpoint-interval',
+        dest='checkpoint_interval',
+        type=int,
+        default=10000,
+        help="records between checkpoints (default: %(default)s)",
+        metavar='N',
+    )
+
+    batch.add_argument(
+        '--resume',
+        dest='resume',
+        action='store_true',
+        default=False,
+        help=textwrap.dedent(
+            """
+            continue from the --checkpoint, if it exists, and append to the
+            output
+            """
+        ).strip(),
+    )
+
     if parser.prog == "__main__":
         parser.prog = 'python -m ' + __package__
     return parser
 
 
+def check_method(parser, name, metavar="METHOD", supported=True):
+    """ Check that a METHOD argument is a known (and supported) method. """
+    from . import methods
+    if methods.is_known_method(name) and (
+            not supported or methods.get_method(name).supported):
+        return
+    parser.error(
+        "argument {0}: invalid choice: {1!r} (use --list-methods to see "
+        "available)".format(metavar, name))
+
+
+def open_batch(args, operation, method, params):
+    """ Open the input and output of a batch run, and its checkpoint.
+
+    :return tuple: an (input lines, output sink, checkpoint.Progress) tuple
+    """
+    from . import checkpoint
+    from . import sinks
+    if not args.checkpoint:
+        try:
+            return sys.stdin, sinks.open_sink(args.output), None
+        except (ValueError, IOError) as e:
+            raise SystemExit("invalid output {0}: {1}".format(args.output, e))
+
+    raw = sys.stdin.buffer
+    if not raw.seekable():
+        raise SystemExit("--checkpoint requires input from a file")
+    if args.output == '-':
+        raise SystemExit("--checkpoint requires an output file (-o)")
+    if args.checkpoint_interval < 1:
+        raise SystemExit("invalid checkpoint interval: {0}".format(
+            args.checkpoint_interval))
+    saved = checkpoint.Checkpoint(
+        args.checkpoint,
+        checkpoint.get_fingerprint(operation=operation, method=method.name,
+                                   params=params, output=args.output))
+    state = None
+    if args.resume and os.path.exists(args.checkpoint):
+        try:
+            state = saved.load()
+        except (ValueError, IOError) as e:
+            raise SystemExit(str(e))
+        logger.info("resuming at line %d, after %d records",
+                    state['lineno'] + 1, state['records'])
+    elif args.resume:
+        logger.info("no checkpoint %s, starting from the beginning",
+                    args.checkpoint)
+
+    offset = state['output_offset'] if state else None
+    is_sqlite = args.output.startswith(sinks.SQLITE_SCHEME + ':')
+    if state and offset is None and not is_sqlite:
+        raise SystemExit("checkpoint {0} has no output offset".format(
+            args.checkpoint))
+    try:
+        sink = sinks.open_sink(args.output, offset=offset)
+    except (ValueError, IOError) as e:
+        raise SystemExit("invalid output {0}: {1}".format(args.output, e))
+    if state:
+        reader = checkpoint.InputReader(raw, offset=state['input_offset'],
+                                        lineno=state['lineno'])
+    else:
+        reader = checkpoint.InputReader(raw)
+    progress = checkpoint.Progress(saved, reader, sink, state=state,
+                                   interval=args.checkpoint_interval)
+    return reader, sink, progress
+
+
+def run_batch(args, method, params):
+    """ Hash records from stdin. """
+    from . import batch
+    if args.jobs < 1:
+        raise SystemExit("invalid number of jobs: {0}".format(args.jobs))
+    lines, sink, progress = open_batch(args, 'hash', method, params)
+    try:
+        with sink:
+            outcome = batch.hash_batch(
+                method, params, lines, sink, jobs=args.jobs,
+                executor=args.executor, progress=progress,
+                on_start=cli_utils.get_metrics_starter(args))
+    except IOError as e:
+        raise SystemExit(str(e))
+    if outcome.errors:
+        raise SystemExit("{0} of {1} records failed".format(
+            outcome.errors, outcome.records))
+
+
+def run_check(args, method, params):
+    """ Verify records from stdin. """
+    from . import batch
+    from . import cache
+    if args.jobs < 1:
+        raise SystemExit("invalid number of jobs: {0}".format(args.jobs))
+    verify_cache = None
+    if args.verify_cache > 0:
+        verify_cache = cache.VerifyCache(maxsize=args.verify_cache,
+                                         ttl=args.verify_cache_ttl)
+    # settings like rounds are read from the cryptstring
+    params = dict((k, v) for k, v in params.items() if k == 'user')
+    lines, sink, progress = open_batch(args, 'verify', method, params)
+    try:
+        with sink:
+            outcome = batch.verify_batch(
+                method, params, lines, sink, jobs=args.jobs,
+                executor=args.executor, cache=verify_cache,
+                progress=progress,
+                on_start=cli_utils.get_metrics_starter(args))
+    except IOError as e:
+        raise SystemExit(str(e))
+    if outcome.errors:
+        raise SystemExit("{0} of {1} records failed".format(
+            outcome.errors, outcome.records))
+
+
+def run_convert(args, method, target):
+    """ Convert records from stdin. """
+    from . import convert
+    try:
+        converter = convert.Converter(method, target, strict=args.strict)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    outcome = convert.convert_batch(converter, sys.stdin, sys.stdout)
+    if outcome.errors:
+        raise SystemExit("{0} of {1} records failed".format(
+            outcome.errors, outcome.records))
+
+
+def run_vectors(args, params):
+    """ Make or check test vectors. """
+    from . import vectors
+    if args.jobs < 1:
+        raise SystemExit("invalid number of jobs: {0}".format(args.jobs))
+    if args.make_vectors:
+        # as in batch mode, empty lines are skipped
+        passwords = [line.rstrip('\r\n') for line in sys.stdin
+                     if line.rstrip('\r\n')]
+        if not passwords:
+            raise SystemExit("no passwords given")
+        vectors.make_vectors(passwords, params, sys.stdout, jobs=args.jobs)
+        return
+    try:
+        with open(args.check_vectors) as f:
+            stored = list(vectors.read_vectors(f))
+    except (IOError, OSError, ValueError) as e:
+        raise SystemExit("unable to read vectors from {0}: {1}".format(
+            args.check_vectors, e))
+    differences = vectors.check_vectors(stored, sys.stdout, jobs=args.jobs)
+    if differences:
+        raise SystemExit("{0} differences".format(differences))
+
+
 def main(inargs=None):
-    supported_methods = list(methods.iter_supported_methods())
-    parser = make_parser(supported_methods=supported_methods)
+    parser = make_parser()
     args = parser.parse_args(inargs)
 
-    cli_utils.setup_logging(args.verbosity)
+    # batch modes write metrics once the workers are started
+    cli_utils.setup_output(args, metrics=not (args.batch or args.check))
+
+    # passlib and its handlers are imported only when needed, to keep e.g.
+    # --help fast
+    from . import methods
 
     if args.list_methods:
         logger.debug("listing all supported methods")
-        for m in supported_methods:
+        for m in methods.iter_supported_methods():
             print(m.name)
         raise SystemExit()
 
     if args.list_params:
         logger.debug("listing all known params")
-        params = {p for m in supported_methods for p in m.settings}
+        params = {p for m in methods.iter_supported_methods()
+                  for p in m.settings}
         for param in sorted(params):
             print(param)
         raise SystemExit()
@@ -223,6 +560,7 @@ def main(inargs=None):
         raise SystemExit()
 
     if args.show_params:
+        check_method(parser, args.show_params, "--show-params")
         logger.debug("showing params for %s", repr(args.show_params))
         m = methods.get_method(args.show_params)
         for param in sorted(m.settings):
@@ -230,6 +568,7 @@ def main(inargs=None):
         raise SystemExit()
 
     if args.show_docstring:
+        check_method(parser, args.show_docstring, "--show-docstring")
         logger.debug("showing docstring for %s", repr(args.show_docstring))
         m = methods.get_method(args.show_docstring)
         try:
@@ -239,10 +578,41 @@ def main(inargs=None):
             print(m.method.__doc__)
         raise SystemExit()
 
+    if args.make_vectors or args.check_vectors:
+        run_vectors(args, dict(args.params))
+        raise SystemExit()
+
+    if args.convert:
+        # conversion doesn't hash, and doesn't need a backend
+        check_method(parser, args.method, supported=False)
+        check_method(parser, args.convert, "--convert", supported=False)
+        run_convert(args,
+                    methods.get_method(args.method),
+                    methods.get_method(args.convert))
+        raise SystemExit()
+
+    if args.output != '-' and not (args.batch or args.check):
+        parser.error("argument -o/--output: requires --batch or --check")
+    if args.check and args.output.startswith('sqlite:'):
+        parser.error("argument -o/--output: sqlite output requires --batch")
+    if args.checkpoint and not (args.batch or args.check):
+        parser.error("argument --checkpoint: requires --batch or --check")
+    if args.resume and not args.checkpoint:
+        parser.error("argument --resume: requires --checkpoint")
+
+    check_method(parser, args.method)
     logger.debug("generate using %s", repr(args.method))
     params = dict(args.params)
     method = methods.get_method(args.method)
 
+    if args.batch:
+        run_batch(args, method, params)
+        raise SystemExit()
+
+    if args.check:
+        run_check(args, method, params)
+        raise SystemExit()
+
     if method.require_user and 'user' not in params:
         raise ValueError(
             "Method {0} requires a 'user' parameter".format(method.name))
@@ -257,7 +627,10 @@ def main(inargs=None):
     else:
         password = ''
 
-    cryptstring = method(password, **params)
+    with metrics.registry.record('hash', method.name):
+        cryptstring = method(password, **params)
+    logger.info("hashed password", extra={'event': 'hash',
+                                          'method': method.name})
     if args.print_pass:
         print(password)
     print(cryptstring)
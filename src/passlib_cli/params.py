@@ -23,12 +23,25 @@ def param(name):
     return register
 
 
+def known_values(*values):
+    """ Set known values for all parameters that use a given parser. """
+    def register(func):
+        func.known_values = values
+        return func
+    return register
+
+
 def parse_parameter(parameter, value):
     if parameter not in _parameters:
-        return parameter
+        return value
     return _parameters[parameter](value)
 
 
+def get_known_values(parameter):
+    """ Get known values for a given parameter, if any. """
+    return tuple(getattr(_parameters.get(parameter), 'known_values', ()))
+
+
 @param('block_size')
 @param('digest_size')
 @param('hash_len')
@@ -45,6 +58,7 @@ def _int(input_value):
 
 
 @param('truncate_error')
+@known_values('yes', 'no')
 def _bool(input_value):
     """
     Boolean input value.
@@ -69,6 +83,7 @@ def _bool(input_value):
 @param('ident')
 @param('marker')
 @param('salt')
+@param('type')
 @param('variant')
 def _unmodified(input_value):
     """ raw string param. """
@@ -0,0 +1,315 @@
+# encoding: utf-8
+"""
+Batch output sinks.
+
+A sink receives (user, cryptstring) records from batch hashing.  The output
+is given as:
+
+- '-', to write '<user><TAB><cryptstring>' lines to stdout
+- a filename, to write the same lines to a file
+- 'sqlite:PATH?table=TABLE&key=COLUMN', to upsert records into an SQLite
+  database
+
+The SQLite sink writes from a separate thread, in large transactions, so that
+database I/O overlaps with hashing.
+
+Sinks can be synced, e.g. before writing a checkpoint (see `checkpoint`).
+"""
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+)
+import logging
+import os
+import re
+import stat
+import sys
+import threading
+
+from . import batch
+
+logger = logging.getLogger(__name__)
+
+
+SQLITE_SCHEME = 'sqlite'
+
+# sqlite sink options, and their defaults
+SQLITE_OPTIONS = {
+    'table': 'credentials',
+    'key': 'user',
+    'hash': 'hash',
+    'batch': '50000',
+}
+
+# records per queued chunk
+CHUNK_SIZE = 1000
+
+# chunks in flight between the hashing loop and the writer thread
+MAX_PENDING = 16
+
+_identifier = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def _quote(name):
+    if not _identifier.match(name):
+        raise ValueError("invalid sql identifier: " + repr(name))
+    return '"' + name + '"'
+
+
+class TextSink(object):
+    """ Write records as '<user><TAB><cryptstring>' lines. """
+
+    def __init__(self, output, close=False):
+        self.output = output
+        self._close = close
+
+    def write_record(self, user, cryptstring):
+        self.output.write(batch.format_record(user, cryptstring) + '\n')
+
+    def sync(self):
+        """ Flush records to disk.
+
+        :return int: size of the output, or `None` if not a regular file
+        """
+        self.output.flush()
+        try:
+            fd = self.output.fileno()
+        except (AttributeError, ValueError, IOError):
+            return None
+        if not stat.S_ISREG(os.fstat(fd).st_mode):
+            return None
+        os.fsync(fd)
+        return os.fstat(fd).st_size
+
+    def close(self):
+        if self._close:
+            self.output.close()
+        else:
+            self.output.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SqliteSink(object):
+    """ Upsert records into an SQLite table.
+
+    The table is created if it doesn't exist, with the key column as primary
+    key.  An existing table must have a unique key column.  Records without a
+    user are rejected.
+
+    :param str filename: database file
+    :param str table: table name
+    :param str key: user column
+    :param str hash: cryptstring column
+    :param int batch: records per transaction
+    """
+
+    def __init__(self, filename, table='credentials', key='user',
+                 hash='hash', batch=50000, timeout=30.0):
+        self.filename = filename
+        self.batch_size = batch
+        self.timeout = timeout
+        table, key, hash = _quote(table), _quote(key), _quote(hash)
+        self.schema = (
+            "CREATE TABLE IF NOT EXISTS {0} "
+            "({1} TEXT PRIMARY KEY NOT NULL, {2} TEXT NOT NULL)"
+        ).format(table, key, hash)
+        self.upsert = (
+            "INSERT INTO {0} ({1}, {2}) VALUES (?, ?) "
+            "ON CONFLICT ({1}) DO UPDATE SET {2} = excluded.{2}"
+        ).format(table, key, hash)
+        self.records = 0
+        self._chunk = []
+        self._error = None
+        self._conn = self._connect()
+        import queue
+        self._queue = queue.Queue(MAX_PENDING)
+        # started with the first write, e.g. after worker processes are
+        # forked
+        self._thread = None
+
+    def _connect(self):
+        import sqlite3
+        logger.debug("opening output db %s", repr(self.filename))
+        conn = None
+        try:
+            # the connection is only used by the writer thread, after setup
+            conn = sqlite3.connect(self.filename, timeout=self.timeout,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+            # WAL and synchronous=NORMAL, as in totp_state
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(self.schema)
+            # check the statement up front, e.g. for existing tables without
+            # a unique key column
+            conn.execute("EXPLAIN " + self.upsert, (None, None))
+        except sqlite3.Error as e:
+            if conn is not None:
+                conn.close()
+            raise ValueError("unable to write to {0}: {1}".format(
+                self.filename, e))
+        return conn
+
+    def _run(self):
+        conn = self._conn
+        pending = 0
+        try:
+            conn.execute("BEGIN")
+            while True:
+                chunk = self._queue.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, threading.Event):
+                    # sync
+                    conn.execute("COMMIT")
+                    conn.execute("BEGIN")
+                    pending = 0
+                    chunk.set()
+                    continue
+                conn.executemany(self.upsert, chunk)
+                pending += len(chunk)
+                if pending >= self.batch_size:
+                    conn.execute("COMMIT")
+                    conn.execute("BEGIN")
+                    logger.debug("committed %d records", pending)
+                    pending = 0
+            conn.execute("COMMIT")
+        except Exception as e:
+            self._error = IOError("unable to write to {0}: {1}".format(
+                self.filename, e))
+            try:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+            except Exception:
+                logger.debug("unable to roll back", exc_info=True)
+            # keep the producer from blocking on a full queue or a sync
+            while True:
+                chunk = self._queue.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, threading.Event):
+                    chunk.set()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,
+                                            name='sqlite-sink', daemon=True)
+            self._thread.start()
+
+    def _put(self, chunk):
+        if self._error is not None:
+            raise self._error
+        self._start()
+        self._queue.put(chunk)
+
+    def write_record(self, user, cryptstring):
+        """ Queue a record.
+
+        :raises ValueError: if the record has no user
+        :raises IOError: if the writer thread has failed
+        """
+        if user is None:
+            raise ValueError("missing user for sqlite output")
+        self._chunk.append((user, cryptstring))
+        self.records += 1
+        if len(self._chunk) >= CHUNK_SIZE:
+            self._put(self._chunk)
+            self._chunk = []
+
+    def sync(self):
+        """ Commit all records, and wait for the commit.
+
+        :return: `None`, the output has no meaningful size
+        """
+        if self._chunk:
+            self._put(self._chunk)
+            self._chunk = []
+        done = threading.Event()
+        self._put(done)
+        done.wait()
+        if self._error is not None:
+            raise self._error
+        return None
+
+    def close(self):
+        """ Write remaining records, and wait for the last commit. """
+        if self._conn is None:
+            return
+        self._start()
+        if self._chunk and self._error is None:
+            self._queue.put(self._chunk)
+            self._chunk = []
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._conn.close()
+        self._conn = None
+        if self._error is not None:
+            raise self._error
+        logger.info("wrote %d records to %s", self.records, self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def parse_sqlite_url(url):
+    """ Parse a 'sqlite:PATH?option=value&...' output url.
+
+    :return tuple: a (filename, options) tuple
+    """
+    from urllib.parse import parse_qsl, unquote, urlsplit
+    parts = urlsplit(url)
+    filename = unquote(parts.netloc + parts.path)
+    if not filename:
+        raise ValueError("missing database file: " + repr(url))
+    options = dict(SQLITE_OPTIONS)
+    for name, value in parse_qsl(parts.query, keep_blank_values=True):
+        if name not in SQLITE_OPTIONS:
+            raise ValueError("unknown sqlite option: " + repr(name))
+        options[name] = value
+    try:
+        options['batch'] = int(options['batch'])
+    except ValueError:
+        raise ValueError("invalid sqlite batch size: " +
+                         repr(options['batch']))
+    if options['batch'] < 1:
+        raise ValueError("invalid sqlite batch size: " +
+                         repr(options['batch']))
+    return filename, options
+
+
+def open_sink(output, offset=None):
+    """ Get a sink for an output name.
+
+    :param int offset:
+        Resume writing at this output offset, from a checkpoint.  Text
+        output is truncated to the offset, and appended to.  Records are
+        upserted into SQLite, so the offset doesn't apply.
+
+    :raises ValueError: if the output is invalid
+    """
+    if output in (None, '-'):
+        if offset is not None:
+            raise ValueError("unable to resume output to stdout")
+        return TextSink(sys.stdout)
+    if output.startswith(SQLITE_SCHEME + ':'):
+        filename, options = parse_sqlite_url(output)
+        return SqliteSink(filename, **options)
+    if offset is None:
+        return TextSink(open(output, 'w'), close=True)
+    f = open(output, 'a')
+    if os.fstat(f.fileno()).st_size < offset:
+        f.close()
+        raise ValueError("output is shorter than the checkpoint")
+    f.truncate(offset)
+    return TextSink(f, close=True)
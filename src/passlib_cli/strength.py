@@ -0,0 +1,321 @@
+# encoding: utf-8
+"""
+Password strength estimation.
+
+Estimates the entropy of existing passwords with the same model that
+`passlib.pwd` uses to generate them: a password drawn from an alphabet of
+`A` symbols has `length * log2(A)` bits of entropy, and a passphrase of `W`
+words from a wordset of `S` words has `W * log2(S)` bits.
+
+Each password is assigned the smallest alphabet that covers all of its
+characters - the passlib charsets (hex, ascii_50, ascii_62, ascii_72), and
+common character classes.  Passwords that consist of wordset words are also
+scored as passphrases, and the lower estimate is used.
+"""
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+)
+import collections
+import logging
+import math
+import string
+
+logger = logging.getLogger(__name__)
+
+
+# Assumed alphabet size for passwords with non-ascii characters
+UNICODE_ALPHABET_SIZE = 256
+
+# Histogram bucket sizes, and the last bucket
+ENTROPY_BUCKET = 8
+ENTROPY_MAX = 128
+LENGTH_BUCKET = 4
+LENGTH_MAX = 32
+
+# Lines per batch
+BATCH_SIZE = 10000
+
+
+def get_alphabets():
+    """ Get the alphabets of the charset model, from small to large.
+
+    :return list: (name, characters) tuples
+    """
+    from passlib import pwd
+    charsets = pwd.default_charsets
+    alphabets = [
+        ('digits', string.digits),
+        ('hex', charsets['hex']),
+        ('lower', string.ascii_lowercase),
+        ('upper', string.ascii_uppercase),
+        ('lower_digits', string.ascii_lowercase + string.digits),
+        ('ascii_50', charsets['ascii_50']),
+        ('alpha', string.ascii_letters),
+        ('ascii_62', charsets['ascii_62']),
+        ('ascii_72', charsets['ascii_72']),
+        ('ascii_95', ''.join(chr(c) for c in range(32, 127))),
+    ]
+    return sorted(alphabets, key=lambda a: len(a[1]))
+
+
+class _MaskTable(dict):
+    """ str.translate table that maps unknown characters to a default. """
+
+    def __init__(self, masks, default):
+        super(_MaskTable, self).__init__(masks)
+        self.default = default
+
+    def __missing__(self, key):
+        return self.default
+
+
+class Estimator(object):
+    """ Estimate password entropy.
+
+    :param str sep: word separator for passphrases, in addition to space
+    """
+
+    def __init__(self, sep='-'):
+        alphabets = get_alphabets()
+        self.seps = tuple(set((sep or ' ', ' ')))
+        self.names = [name for name, _ in alphabets] + ['unicode']
+        sizes = [len(chars) for _, chars in alphabets]
+        sizes.append(UNICODE_ALPHABET_SIZE)
+        self.bits_per_char = [math.log(size, 2) for size in sizes]
+
+        # Each character has a mask, with a bit set for each alphabet that
+        # contains it.  Characters are translated to a single letter code
+        # for their mask, so that the set of codes in a password is quick to
+        # build.
+        masks = collections.defaultdict(int)
+        for idx, (_, chars) in enumerate(alphabets):
+            for c in chars:
+                masks[ord(c)] |= 1 << idx
+        unicode_mask = 1 << len(alphabets)
+        codes = {}
+        for mask in sorted(set(masks.values())) + [0]:
+            codes[mask] = chr(ord('A') + len(codes))
+        self._masks = dict((code, mask | unicode_mask)
+                           for mask, code in codes.items())
+        self._table = _MaskTable(
+            dict((c, codes[m]) for c, m in masks.items()), codes[0])
+        # batches are translated as newline separated passwords
+        self._table[ord('\n')] = '\n'
+        # set of mask characters -> alphabet index
+        self._alphabet_cache = {}
+        self._words = None
+
+    @property
+    def words(self):
+        """ word -> bits, for all words in the passlib wordsets. """
+        if self._words is None:
+            from passlib import pwd
+            words = {}
+            for wordset in pwd.default_wordsets.values():
+                bits = math.log(len(wordset), 2)
+                for word in wordset:
+                    words[word] = min(bits, words.get(word, bits))
+            self._words = words
+        return self._words
+
+    def _get_alphabet(self, key):
+        # key is the set of mask codes of a password
+        idx = self._alphabet_cache.get(key)
+        if idx is None:
+            mask = -1
+            for c in key:
+                mask &= self._masks[c]
+            # lowest set bit
+            idx = (mask & -mask).bit_length() - 1
+            self._alphabet_cache[key] = idx
+        return idx
+
+    def get_phrase_bits(self, password):
+        """ Get the entropy of a passphrase, or `None` if not a phrase. """
+        words = self.words
+        bits = words.get(password)
+        if bits is not None:
+            return bits
+        for sep in self.seps:
+            if sep not in password:
+                continue
+            bits = 0.0
+            for word in password.split(sep):
+                word_bits = words.get(word)
+                if word_bits is None:
+                    break
+                bits += word_bits
+            else:
+                return bits
+        return None
+
+    def estimate(self, password):
+        """ Estimate the entropy of a password.
+
+        :return tuple: a (bits, model name) tuple
+        """
+        return self.estimate_batch([password])[0]
+
+    def estimate_batch(self, passwords):
+        """ Estimate the entropy of a list of passwords.
+
+        Characters are translated to alphabet masks for the whole batch at
+        once.
+
+        :return list: (bits, model name) tuples
+        """
+        translated = '\n'.join(passwords).translate(self._table).split('\n')
+        cache = self._alphabet_cache
+        words = self.words
+        seps = self.seps
+        bits_per_char = self.bits_per_char
+        names = self.names
+        results = []
+        for password, masks in zip(passwords, translated):
+            key = frozenset(masks)
+            idx = cache.get(key)
+            if idx is None:
+                idx = self._get_alphabet(key)
+            bits = len(password) * bits_per_char[idx]
+            # the phrase model only applies to words and separated words
+            phrase_bits = words.get(password)
+            if phrase_bits is None and any(sep in password for sep in seps):
+                phrase_bits = self.get_phrase_bits(password)
+            if phrase_bits is not None and phrase_bits < bits:
+                results.append((phrase_bits, 'words'))
+            else:
+                results.append((bits, names[idx]))
+        return results
+
+
+class Summary(object):
+    """ Histograms of analyzed passwords.
+
+    Entropy (whole bits) and lengths are counted exactly, and bucketed when
+    formatted.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.flagged = 0
+        self.entropy = collections.Counter()
+        self.length = collections.Counter()
+        self.models = collections.Counter()
+
+    def update(self, other):
+        self.count += other.count
+        self.flagged += other.flagged
+        self.entropy.update(other.entropy)
+        self.length.update(other.length)
+        self.models.update(other.models)
+
+    def format(self, threshold=None):
+        """ Format the summary as text histograms. """
+        lines = ['{0} passwords'.format(self.count)]
+        if threshold is not None:
+            lines[0] += ', {0} below {1} bits ({2:.1f}%)'.format(
+                self.flagged, threshold,
+                100.0 * self.flagged / max(self.count, 1))
+
+        def histogram(title, counter, label):
+            lines.append('')
+            lines.append(title)
+            top = max(counter.values() or [1])
+            for key in sorted(counter):
+                lines.append('  {0:>10}  {1:>10}  {2}'.format(
+                    label(key), counter[key],
+                    '#' * int(round(40.0 * counter[key] / top))))
+
+        def buckets(counter, size, last):
+            result = collections.Counter()
+            for key, count in counter.items():
+                result[min(key // size * size, last)] += count
+            return result
+
+        def bucket_label(size, last):
+            def label(key):
+                if key >= last:
+                    return '{0}+'.format(last)
+                return '{0}-{1}'.format(key, key + size - 1)
+            return label
+
+        histogram('entropy (bits):',
+                  buckets(self.entropy, ENTROPY_BUCKET, ENTROPY_MAX),
+                  bucket_label(ENTROPY_BUCKET, ENTROPY_MAX))
+        histogram('length:',
+                  buckets(self.length, LENGTH_BUCKET, LENGTH_MAX),
+                  bucket_label(LENGTH_BUCKET, LENGTH_MAX))
+        histogram('model:', self.models, lambda k: k)
+        return '\n'.join(lines)
+
+
+_estimators = {}
+
+
+def analyze_batch(task):
+    """ Analyze a batch of passwords (pool task).
+
+    :param tuple task: a (lines, threshold, sep) tuple
+
+    :return tuple:
+        Return a (Summary, flagged) tuple, where flagged is a list of
+        (bits, password) tuples for passwords below the threshold.
+    """
+    lines, threshold, sep = task
+    estimator = _estimators.get(sep)
+    if estimator is None:
+        estimator = _estimators[sep] = Estimator(sep=sep)
+    passwords = [p for p in (line.rstrip('\r\n') for line in lines) if p]
+    results = estimator.estimate_batch(passwords)
+    summary = Summary()
+    summary.count = len(passwords)
+    summary.length.update(map(len, passwords))
+    summary.entropy.update(int(bits) for bits, _ in results)
+    summary.models.update(model for _, model in results)
+    flagged = []
+    if threshold is not None:
+        flagged = [(bits, password)
+                   for password, (bits, _) in zip(passwords, results)
+                   if bits < threshold]
+    summary.flagged = len(flagged)
+    return summary, flagged
+
+
+def iter_batches(lines, size=BATCH_SIZE):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def analyze(lines, output, threshold=None, sep='-', jobs=1):
+    """ Analyze passwords from `lines`.
+
+    Passwords below the threshold are written to `output`, as
+    '<bits><TAB><password>' records.
+
+    :param float threshold: flag passwords below this entropy
+    :param int jobs: number of processes
+
+    :return Summary:
+    """
+    from . import executors
+    summary = Summary()
+    tasks = ((batch, threshold, sep) for batch in iter_batches(lines))
+    for batch_summary, flagged in executors.ordered_map(
+            analyze_batch, tasks, jobs):
+        summary.update(batch_summary)
+        for bits, password in flagged:
+            output.write('{0:.1f}\t{1}\n'.format(bits, password))
+    logger.info("analyzed %d passwords, %d flagged", summary.count,
+                summary.flagged, extra={'event': 'analyze',
+                                        'records': summary.count,
+                                        'flagged': summary.flagged})
+    return summary
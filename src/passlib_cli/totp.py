@@ -8,15 +8,19 @@ from __future__ import (
     unicode_literals,
 )
 import argparse
+import contextlib
+import hashlib
+import itertools
 import logging
+import os
 import string
 import sys
 import textwrap
 import time
 
-from passlib import totp
-
 from . import cli_utils
+from . import metrics
+from . import totp_state
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +41,7 @@ def could_be_hex(value):
 
 def get_totp(secret, fmt=None):
     """ parse totp input secret. """
+    from passlib import totp
     logger.debug("totp format: %r", repr(fmt) if fmt else "auto")
     if fmt == 'uri' or (not fmt and secret.startswith('otpauth://')):
         return totp.TOTP.from_uri(secret)
@@ -56,74 +61,446 @@ def format_totp(obj, fmt=None):
         return obj.base32_key
     if fmt == 'hex':
         return obj.hex_key
+    if fmt == 'json':
+        # the key is encrypted if the factory has application secrets
+        return obj.to_json()
     return obj.to_uri()
 
 
+def get_totp_factory(secrets_path=None):
+    """ get a TOTP class, with application secrets for encrypting keys. """
+    from passlib import totp
+    if not secrets_path:
+        return totp.TOTP
+    return totp.TOTP.using(secrets_path=secrets_path)
+
+
+def load_totp_factory(secrets_path=None):
+    """ get a TOTP class, or exit if the application secrets are invalid. """
+    try:
+        return get_totp_factory(secrets_path)
+    except (IOError, OSError, ValueError) as e:
+        raise SystemExit("unable to read {0}: {1}".format(secrets_path, e))
+
+
+# random bytes read from the os at a time when provisioning secrets
+RANDOM_BUFFER_SIZE = 64 * 1024
+
+# labels per batch - batches are written in order, and may be created in
+# parallel (encrypting keys is slow)
+BATCH_SIZE = 100
+
+
+class BufferedRandom(object):
+    """ secure random bytes, read from the os in large chunks. """
+
+    def __init__(self, buffer_size=RANDOM_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._buffer = b''
+        self._pos = 0
+
+    def read(self, size):
+        if self._pos + size > len(self._buffer):
+            self._buffer = os.urandom(max(size, self.buffer_size))
+            self._pos = 0
+        data = self._buffer[self._pos:self._pos + size]
+        self._pos += size
+        return data
+
+
+_factories = {}
+
+
+def make_secrets(task):
+    """ create secrets for a batch of labels (pool task).
+
+    :param tuple task:
+        a (records, fmt, issuer, secrets_path) tuple, where records is a
+        list of (lineno, label, key) tuples
+
+    :return list: (lineno, label, secret, error) tuples
+    """
+    records, fmt, issuer, secrets_path = task
+    factory = _factories.get(secrets_path)
+    if factory is None:
+        factory = _factories[secrets_path] = get_totp_factory(secrets_path)
+    results = []
+    for lineno, label, key in records:
+        try:
+            obj = factory(key=key, format='raw', label=label, issuer=issuer)
+            results.append((lineno, label, format_totp(obj, fmt=fmt), None))
+        except ValueError as e:
+            results.append((lineno, label, None, str(e)))
+    return results
+
+
+def iter_label_batches(labels, key_size, rng, size=BATCH_SIZE):
+    """ get batches of (lineno, label, key) records from label lines. """
+    batch = []
+    for lineno, line in enumerate(labels, 1):
+        label = line.strip()
+        if not label:
+            continue
+        batch.append((lineno, label, rng.read(key_size)))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def provision(labels, output, fmt=None, issuer=None, secrets_path=None,
+              rng=None, jobs=1):
+    """ create a new secret for each label.
+
+    Writes a '<label><TAB><secret>' record to `output` for each non-empty
+    line in `labels`.  Labels that cannot be used are reported, and left out
+    of the output.
+
+    :param str secrets_path: application secrets for encrypting keys
+    :param BufferedRandom rng: source of keys
+    :param int jobs: number of processes
+
+    :return batch.BatchResult:
+    """
+    from . import batch
+    from . import executors
+    rng = rng or BufferedRandom()
+    # default key size, per RFC 6238 Section 5.1
+    key_size = hashlib.new(get_totp_factory(secrets_path).alg).digest_size
+    outcome = batch.BatchResult()
+    tasks = ((records, fmt, issuer, secrets_path)
+             for records in iter_label_batches(labels, key_size, rng))
+    for results in executors.ordered_map(make_secrets, tasks, jobs):
+        errors = 0
+        for lineno, label, secret, error in results:
+            if error:
+                errors += 1
+                logger.error("line %d: unable to create secret: %s",
+                             lineno, error)
+                continue
+            output.write(label + '\t' + secret + '\n')
+        output.flush()
+        outcome.records += len(results)
+        outcome.errors += errors
+        metrics.registry.inc('records_total', len(results),
+                             operation='new', method='totp')
+        metrics.registry.inc('errors_total', errors,
+                             operation='new', method='totp')
+
+    logger.info("created %d secrets (%d errors)",
+                outcome.records - outcome.errors, outcome.errors,
+                extra={'event': 'new',
+                       'records': outcome.records,
+                       'errors': outcome.errors})
+    return outcome
+
+
 def get_token(t):
     return t.generate()
 
 
-parser = argparse.ArgumentParser(
-    description="Generate TOTP codes using passlib",
-    formatter_class=argparse.RawDescriptionHelpFormatter,
-)
-parser.add_argument(
-    '--live',
-    action='store_true',
-    help=textwrap.dedent(
-        """
-        Keep generating one-time passwords
-        """
-    ).strip(),
-)
-fmt_args = parser.add_argument_group(
-    "secret format",
-    textwrap.dedent(
-        """
-        Set the format for the shared secret input.  The format is guessed if
-        not given.
-
-        If a new secret is generated, this controls the output format.  If
-        generating a new uri formatted secret (the default), you *must* provide
-        a label.
-        """
-    ).strip()
-)
-fmt_mutex = fmt_args.add_mutually_exclusive_group()
-fmt_mutex.add_argument(
-    "--uri",
-    action="store_const",
-    dest="fmt",
-    const="uri",
-)
-fmt_mutex.add_argument(
-    "--base32",
-    action="store_const",
-    dest="fmt",
-    const="base32",
-)
-fmt_mutex.add_argument(
-    "--hex",
-    action="store_const",
-    dest="fmt",
-    const="hex",
-)
+# verification results
+VERIFY_OK = 'ok'
+VERIFY_INVALID = 'invalid'
+VERIFY_REPLAYED = 'replayed'
+
+
+def verify_token(obj, token, store=None):
+    """ verify a token, and record it as used in the store. """
+    secret_id = totp_state.get_secret_id(obj)
+    with metrics.registry.record('verify', 'totp'):
+        result = _verify_token(obj, secret_id, token, store=store)
+    metrics.registry.inc('results_total', operation='verify', result=result)
+    logger.info("verified token", extra={'event': 'verify',
+                                         'secret_id': secret_id,
+                                         'result': result})
+    return result
+
+
+def _verify_token(obj, secret_id, token, store=None):
+    from passlib import totp
+    last_counter = store.get_last_counter(secret_id) if store else None
+    try:
+        match = obj.match(token, last_counter=last_counter)
+    except totp.UsedTokenError:
+        return VERIFY_REPLAYED
+    except totp.TokenError as e:
+        logger.debug("token rejected: %s", e)
+        return VERIFY_INVALID
+    if store and not store.claim(secret_id, match.counter):
+        return VERIFY_REPLAYED
+    return VERIFY_OK
+
+
+def parse_verify_record(line, fmt=None):
+    """ parse a '<secret> <token>' line. """
+    secret, _, token = line.strip().rpartition(' ')
+    secret = secret.strip()
+    if not secret or not token:
+        raise ValueError('invalid record')
+    return get_totp(secret, fmt=fmt), token
+
+
+def verify_batch(lines, store=None, fmt=None, batch_size=1000):
+    """ verify '<secret> <token>' lines, in batched transactions. """
+    lines = iter(lines)
+    while True:
+        batch = list(itertools.islice(lines, batch_size))
+        if not batch:
+            break
+        results = []
+        with (store.transaction() if store else contextlib.nullcontext()):
+            for idx, line in enumerate(batch):
+                metrics.registry.set('queue_depth', len(batch) - idx,
+                                     operation='verify')
+                try:
+                    obj, token = parse_verify_record(line, fmt=fmt)
+                except ValueError as e:
+                    logger.debug("invalid record: %s", e)
+                    metrics.registry.inc('errors_total', operation='verify',
+                                         method='totp')
+                    metrics.registry.inc('results_total', operation='verify',
+                                         result=VERIFY_INVALID)
+                    results.append(VERIFY_INVALID)
+                    continue
+                results.append(verify_token(obj, token, store=store))
+            metrics.registry.set('queue_depth', 0, operation='verify')
+        # results are only reported after the batch is committed
+        for result in results:
+            yield result
+
+
 not_set = object()
-label_arg = parser.add_argument(
-    "--new",
-    dest="label",
-    nargs="?",
-    default=not_set,
-    help="create and print a new TOTP secret",
-    metavar="label"
-)
-cli_utils.add_version_arg(parser)
-cli_utils.add_verbosity_mutex(parser)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Generate TOTP codes using passlib",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        '--live',
+        action='store_true',
+        help=textwrap.dedent(
+            """
+            Keep generating one-time passwords
+            """
+        ).strip(),
+    )
+    fmt_args = parser.add_argument_group(
+        "secret format",
+        textwrap.dedent(
+            """
+            Set the format for the shared secret input.  The format is
+            guessed if not given.
+
+            If a new secret is generated, this controls the output format.
+            If generating a new uri formatted secret (the default), you *must*
+            provide a label.
+            """
+        ).strip()
+    )
+    fmt_mutex = fmt_args.add_mutually_exclusive_group()
+    fmt_mutex.add_argument(
+        "--uri",
+        action="store_const",
+        dest="fmt",
+        const="uri",
+    )
+    fmt_mutex.add_argument(
+        "--base32",
+        action="store_const",
+        dest="fmt",
+        const="base32",
+    )
+    fmt_mutex.add_argument(
+        "--hex",
+        action="store_const",
+        dest="fmt",
+        const="hex",
+    )
+    parser.add_argument(
+        "--new",
+        dest="label",
+        nargs="?",
+        default=not_set,
+        help="create and print a new TOTP secret",
+        metavar="label"
+    )
+    new_args = parser.add_argument_group(
+        "provisioning",
+        textwrap.dedent(
+            """
+            Create new secrets in bulk.  With --labels, a new secret is
+            created for each line in the label file, and written as a
+            '<label><TAB><secret>' record.
+
+            With --secrets, new secrets are written as json objects, with
+            the key encrypted using the application secrets in the secrets
+            file (one 'tag: secret' per line; requires the cryptography
+            package).  Output files are only readable by the owner.
+            """
+        ).strip()
+    )
+    new_args.add_argument(
+        "--labels",
+        dest="labels",
+        default=None,
+        help="create a new secret for each label in %(metavar)s "
+             "('-' for stdin)",
+        metavar="FILE",
+    )
+    new_args.add_argument(
+        "--issuer",
+        dest="issuer",
+        default=None,
+        help="issuer of new secrets",
+        metavar="NAME",
+    )
+    new_args.add_argument(
+        "--secrets",
+        dest="secrets",
+        default=None,
+        help="encrypt new secrets with the application secrets in "
+             "%(metavar)s",
+        metavar="FILE",
+    )
+    new_args.add_argument(
+        "-j", "--jobs",
+        dest="jobs",
+        type=int,
+        default=1,
+        help="number of processes (default: %(default)s)",
+        metavar="N",
+    )
+    new_args.add_argument(
+        "-o", "--output",
+        dest="output",
+        default=None,
+        help="write new secrets to %(metavar)s",
+        metavar="FILE",
+    )
+    verify_args = parser.add_argument_group(
+        "verification",
+        textwrap.dedent(
+            """
+            Verify one-time passwords.  A single token is verified against
+            the secret from stdin.  Without a token, each line from stdin is
+            verified as a '<secret> <token>' pair, and the result is written
+            to stdout.
+
+            Give a state file to reject tokens that have already been used.
+            The state file can be shared by multiple processes.
+            """
+        ).strip()
+    )
+    verify_args.add_argument(
+        "--verify",
+        dest="verify",
+        nargs="?",
+        default=not_set,
+        help="verify a token, or '<secret> <token>' lines from stdin",
+        metavar="token",
+    )
+    verify_args.add_argument(
+        "--state",
+        dest="state",
+        default=None,
+        help="keep track of used tokens in %(metavar)s (sqlite)",
+        metavar="FILE",
+    )
+    verify_args.add_argument(
+        "--batch-size",
+        dest="batch_size",
+        type=int,
+        default=1000,
+        help=(
+            "number of lines to verify per transaction " +
+            "(default: %(default)s)"
+        ),
+        metavar="N",
+    )
+    cli_utils.add_version_arg(parser)
+    cli_utils.add_verbosity_mutex(parser)
+    cli_utils.add_log_format_arg(parser)
+    cli_utils.add_metrics_args(parser)
+    if __name__ == '__main__':
+        parser.prog = 'python -m ' + __spec__.name
+    return parser
 
 
 def main(inargs=None):
+    parser = make_parser()
     args = parser.parse_args(inargs)
-    cli_utils.setup_logging(args.verbosity)
+    cli_utils.setup_output(args)
+
+    if args.verify is not not_set:
+        if args.label is not not_set:
+            parser.error("argument --verify: not allowed with argument --new")
+        if not args.state:
+            logger.warning("no state file given, replays will not be detected")
+        store = totp_state.TotpStateStore(args.state) if args.state else None
+        try:
+            if args.verify:
+                secret = sys.stdin.readline().rstrip()
+                generator = get_totp(secret, fmt=args.fmt)
+                transaction = (store.transaction() if store
+                               else contextlib.nullcontext())
+                with transaction:
+                    result = verify_token(generator, args.verify, store=store)
+                print(result)
+                raise SystemExit(0 if result == VERIFY_OK else 1)
+            for result in verify_batch(sys.stdin, store=store, fmt=args.fmt,
+                                       batch_size=args.batch_size):
+                print(result)
+        finally:
+            if store:
+                store.close()
+        raise SystemExit()
+
+    if args.label is not_set:
+        for opt, value in (("--labels", args.labels),
+                           ("--issuer", args.issuer),
+                           ("--secrets", args.secrets),
+                           ("--output", args.output)):
+            if value:
+                parser.error("argument {0}: requires --new".format(opt))
+    elif args.secrets:
+        if args.fmt:
+            parser.error(
+                "argument --secrets: not allowed with argument --" + args.fmt)
+        args.fmt = 'json'
+
+    if args.labels:
+        if args.label:
+            parser.error("argument --labels: not allowed with a --new label")
+        # check the secrets before truncating the output
+        load_totp_factory(args.secrets)
+        try:
+            labels_file = (contextlib.nullcontext(sys.stdin)
+                           if args.labels == '-' else open(args.labels))
+        except (IOError, OSError) as e:
+            raise SystemExit("unable to read {0}: {1}".format(
+                args.labels, e))
+        with labels_file as labels:
+            output = (cli_utils.open_private(args.output) if args.output
+                      else sys.stdout)
+            try:
+                outcome = provision(labels, output, fmt=args.fmt,
+                                    issuer=args.issuer,
+                                    secrets_path=args.secrets,
+                                    jobs=args.jobs)
+            except RuntimeError as e:
+                # e.g. encryption without the cryptography package
+                raise SystemExit(str(e))
+            finally:
+                if output is not sys.stdout:
+                    output.close()
+        if outcome.errors:
+            raise SystemExit("{0} of {1} labels failed".format(
+                outcome.errors, outcome.records))
+        raise SystemExit()
 
     if args.label is not_set:
         # read totp secret from stdin
@@ -132,13 +509,19 @@ def main(inargs=None):
     else:
         # generate new totp secret
         if (args.fmt == "uri" or not args.fmt) and not args.label:
-            err = argparse.ArgumentError(
-                label_arg,
-                "missing label for new uri formatted secret",
-            )
-            parser.error(str(err))
-        generator = totp.TOTP(new=True, label=args.label)
-        print(format_totp(generator, fmt=args.fmt))
+            parser.error(
+                "argument --new: missing label for new uri formatted secret")
+        factory = load_totp_factory(args.secrets)
+        generator = factory(new=True, label=args.label, issuer=args.issuer)
+        try:
+            secret = format_totp(generator, fmt=args.fmt)
+        except RuntimeError as e:
+            raise SystemExit(str(e))
+        if args.output:
+            with cli_utils.open_private(args.output) as f:
+                f.write(secret + '\n')
+        else:
+            print(secret)
 
     def needs_wait(token):
         return token.expire_time - time.time()
@@ -159,5 +542,4 @@ def main(inargs=None):
 
 
 if __name__ == '__main__':
-    parser.prog = 'python -m ' + __spec__.name
     main()
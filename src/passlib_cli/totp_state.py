@@ -0,0 +1,124 @@
+# encoding: utf-8
+"""
+Persistent TOTP verification state.
+
+Keeps track of the last accepted time step (counter) for each TOTP secret, so
+that a token can't be accepted twice.  The state is kept in a local SQLite
+database, which can be shared by multiple verifying processes.
+"""
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+)
+import contextlib
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS totp_state (
+    secret_id TEXT PRIMARY KEY NOT NULL,
+    last_counter INTEGER NOT NULL
+) WITHOUT ROWID
+"""
+
+SELECT_COUNTER = """
+SELECT last_counter FROM totp_state WHERE secret_id = ?
+"""
+
+# Only ever move the counter forwards.  If another process has already
+# accepted this (or a later) time step, no rows are changed.
+CLAIM_COUNTER = """
+INSERT INTO totp_state (secret_id, last_counter) VALUES (?, ?)
+ON CONFLICT (secret_id) DO UPDATE SET last_counter = excluded.last_counter
+WHERE excluded.last_counter > totp_state.last_counter
+"""
+
+
+def get_secret_id(obj):
+    """ Get a stable, non-secret identifier for a TOTP secret.
+
+    :param passlib.totp.TOTP obj:
+        The TOTP object to identify.
+
+    :return str:
+        Return a hex digest of the TOTP key.
+    """
+    return hashlib.sha256(obj.key).hexdigest()
+
+
+class TotpStateStore(object):
+    """ SQLite backed store of last accepted TOTP counters. """
+
+    def __init__(self, filename, timeout=30.0):
+        self.filename = filename
+        self.timeout = timeout
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def _connect(self):
+        import sqlite3
+        logger.debug("opening totp state db %s", repr(self.filename))
+        # isolation_level=None - we manage transactions ourselves
+        conn = sqlite3.connect(
+            self.filename,
+            timeout=self.timeout,
+            isolation_level=None,
+        )
+        # WAL lets readers in other processes work alongside a writer, and
+        # synchronous=NORMAL is durable enough with WAL.
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(SCHEMA)
+        return conn
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """ Run a batch of lookups and claims in one write transaction.
+
+        The write lock is taken up front, so that a lookup and the following
+        claim can't be interleaved with another process.
+        """
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def get_last_counter(self, secret_id):
+        """ Get the last accepted counter for a secret, if any. """
+        row = self.conn.execute(SELECT_COUNTER, (secret_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def claim(self, secret_id, counter):
+        """ Record a counter as used.
+
+        :return bool:
+            Return `True` if the counter was newer than the last accepted
+            counter, `False` if it has already been used.
+        """
+        cursor = self.conn.execute(CLAIM_COUNTER, (secret_id, counter))
+        return cursor.rowcount > 0
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,239 @@
+# encoding: utf-8
+"""
+Known-answer test vectors.
+
+A vector file holds, for each supported method and sample password, the
+params and the resulting cryptstring, as json objects, one per line.
+
+Checking a vector file against the current passlib version and backends
+verifies that:
+
+- stored cryptstrings still verify, and still reject a wrong password
+- new cryptstrings with the same params verify
+- methods without a salt still produce the exact same cryptstring
+
+All work is spread over a pool of processes.
+"""
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+)
+import collections
+import json
+import logging
+
+from . import executors
+from . import methods
+
+logger = logging.getLogger(__name__)
+
+
+# user for methods that require one, unless given in params
+DEFAULT_USER = 'user'
+
+# prepended to a password to get a password that must not verify - some
+# methods only use the first few characters of a password
+WRONG_PREFIX = 'wrong-'
+
+
+def get_vector_params(method, params):
+    """ Get params for making test vectors with a method.
+
+    Params that the method doesn't support are ignored.  Unless given, the
+    cheapest rounds are used, to keep the vectors fast to check.
+    """
+    settings = method.settings
+    result = dict((k, v) for k, v in params.items() if k in settings)
+    min_rounds = getattr(method.method, 'min_rounds', None)
+    if 'rounds' in settings and 'rounds' not in result and min_rounds:
+        result['rounds'] = min_rounds
+    if method.require_user:
+        result.setdefault('user', DEFAULT_USER)
+    return result
+
+
+def _verify_params(params):
+    # settings like rounds are read from the cryptstring
+    return dict((k, v) for k, v in params.items() if k == 'user')
+
+
+def _error(e):
+    return '{0}: {1}'.format(type(e).__name__, e)
+
+
+def _is_identified(vector):
+    method = methods.get_method(vector['method'])
+    try:
+        return bool(method.identify(vector['hash']))
+    except Exception:
+        return False
+
+
+def make_vector(task):
+    """ Hash a sample password (pool task).
+
+    :param tuple task: a (method name, password, params) tuple
+
+    :return dict: a test vector
+    """
+    import passlib
+    name, password, params = task
+    method = methods.get_method(name)
+    vector = collections.OrderedDict((
+        ('method', name),
+        ('backend', method.backend),
+        ('passlib', passlib.__version__),
+        ('params', params),
+        ('password', password),
+        ('hash', None),
+    ))
+    try:
+        vector['hash'] = method(password, **params)
+    except Exception as e:
+        vector['error'] = _error(e)
+    return vector
+
+
+def check_vector(vector):
+    """ Check a stored test vector (pool task).
+
+    :return list: a list of problems, empty if the vector checks out
+    """
+    name = vector['method']
+    password = vector['password']
+    params = vector['params']
+    stored = vector.get('hash')
+    problems = []
+    method = methods.get_method(name)
+
+    if not method.require_password:
+        # disabled methods only mark accounts as disabled
+        current = make_vector((name, password, params))
+        if current.get('error') and not vector.get('error'):
+            problems.append("unable to hash: " + current['error'])
+        return problems
+
+    if stored is not None:
+        try:
+            if not method.verify(password, stored,
+                                 **_verify_params(params)):
+                problems.append("stored hash no longer verifies")
+            elif method.verify(WRONG_PREFIX + password, stored,
+                               **_verify_params(params)):
+                problems.append("stored hash verifies a wrong password")
+        except Exception as e:
+            problems.append("unable to verify stored hash: " + _error(e))
+
+    current = make_vector((name, password, params))
+    if current.get('error'):
+        if not vector.get('error'):
+            problems.append("unable to hash: " + current['error'])
+        return problems
+    if vector.get('error'):
+        problems.append("hashing no longer fails: " + vector['error'])
+    try:
+        if not method.verify(password, current['hash'],
+                             **_verify_params(params)):
+            problems.append("new hash does not verify")
+    except Exception as e:
+        problems.append("unable to verify new hash: " + _error(e))
+    if (stored is not None and 'salt' not in method.settings and
+            current['hash'] != stored):
+        problems.append("hash changed: {0} -> {1}".format(
+            stored, current['hash']))
+    return problems
+
+
+def make_vectors(passwords, params, output, jobs=1):
+    """ Write test vectors for all supported methods to `output`.
+
+    Passwords that a method is unable to hash are stored as failing
+    vectors, and are expected to keep failing.  Hashes that the method
+    itself doesn't identify (e.g. an empty ldap_plaintext hash) can't be
+    checked, and are left out.
+
+    :param list passwords: sample passwords
+    :param dict params: params to use, where supported
+    :param output: file-like object to write vectors to
+
+    :return int: number of vectors
+    """
+    tasks = []
+    for method in methods.iter_supported_methods():
+        method_params = get_vector_params(method, params)
+        tasks.extend((method.name, password, method_params)
+                     for password in passwords)
+    count = 0
+    for vector in executors.ordered_map(make_vector, tasks, jobs):
+        if vector.get('error'):
+            logger.warning("unable to hash with %s: %s",
+                           vector['method'], vector['error'])
+        elif not _is_identified(vector):
+            logger.warning("skipping %s vector, hash not identified: %r",
+                           vector['method'], vector['hash'])
+            continue
+        output.write(json.dumps(vector) + '\n')
+        count += 1
+    logger.info("wrote %d vectors", count)
+    return count
+
+
+def read_vectors(lines):
+    """ Read test vectors from a vector file. """
+    for lineno, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            vector = json.loads(line)
+            vector['method'], vector['password'], vector['params']
+        except (ValueError, TypeError, KeyError) as e:
+            raise ValueError("line {0}: invalid vector: {1}".format(
+                lineno, e))
+        yield vector
+
+
+def check_vectors(vectors, output, jobs=1):
+    """ Check test vectors, and write a diff report to `output`.
+
+    The report has a line for each difference:
+
+    - '+ <method>' for supported methods without vectors
+    - '- <method>' for methods that are no longer supported
+    - '! <method> #<n>: <problem>' for vectors that don't check out
+
+    :param list vectors: stored test vectors
+    :param output: file-like object to write the report to
+
+    :return int: number of differences
+    """
+    supported = set(m.name for m in methods.iter_supported_methods())
+    stored = set(v['method'] for v in vectors)
+    differences = 0
+
+    for name in sorted(supported - stored):
+        output.write('+ {0}: no stored vectors\n'.format(name))
+        differences += 1
+
+    for name in sorted(stored - supported):
+        reason = ('unknown method' if not methods.is_known_method(name)
+                  else 'no backend')
+        output.write('- {0}: no longer supported ({1})\n'.format(
+            name, reason))
+        differences += 1
+
+    tasks = [v for v in vectors if v['method'] in supported]
+    index = collections.Counter()
+    for vector, problems in zip(
+            tasks, executors.ordered_map(check_vector, tasks, jobs)):
+        name = vector['method']
+        index[name] += 1
+        for problem in problems:
+            output.write('! {0} #{1}: {2}\n'.format(
+                name, index[name], problem))
+            differences += 1
+
+    logger.info("checked %d vectors for %d methods, %d differences",
+                len(tasks), len(stored & supported), differences)
+    return differences
@@ -0,0 +1,9 @@
+# encoding: utf-8
+""" Test setup - run against the source tree, installed or not. """
+import os
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'src')
+
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
@@ -0,0 +1,201 @@
+# encoding: utf-8
+"""
+Requests to a running auth server.
+
+An AuthServer is started with `serve()` on a free local port, and is sent
+HTTP requests with Basic credentials.
+"""
+import asyncio
+import base64
+import os
+import socket
+
+import pytest
+
+from passlib_cli import authserver
+from passlib_cli import cache
+from passlib_cli import executors
+from passlib_cli import methods
+
+USER = 'alice'
+PASSWORD = 'secret'
+
+
+def make_hash(password):
+    return methods.get_method('md5_crypt')(password)
+
+
+def write_credentials(path, password):
+    # replaced, so that the change is always seen
+    tmp = str(path) + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write('{0}:{1}\n'.format(USER, make_hash(password)))
+    os.replace(tmp, str(path))
+
+
+def get_free_port():
+    sock = socket.socket()
+    try:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+def basic(user, password):
+    value = '{0}:{1}'.format(user, password).encode('utf-8')
+    return 'Basic ' + base64.b64encode(value).decode('ascii')
+
+
+async def request(port, authorization=None):
+    """ Send an auth request.
+
+    :return tuple: a (status, headers) tuple
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        head = ['GET /auth HTTP/1.1', 'Host: localhost', 'Connection: close']
+        if authorization is not None:
+            head.append('Authorization: ' + authorization)
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        response = await reader.read()
+    finally:
+        writer.close()
+    lines = response.decode('latin-1').split('\r\n')
+    headers = dict(line.split(': ', 1) for line in lines[1:] if line)
+    return int(lines[0].split(' ')[1]), headers
+
+
+def run_server(server, check):
+    """ Run `check(port)` against a running server. """
+    port = get_free_port()
+
+    async def run():
+        task = asyncio.ensure_future(
+            authserver.serve(server, '127.0.0.1', port))
+        try:
+            for _ in range(100):
+                try:
+                    _, writer = await asyncio.open_connection('127.0.0.1',
+                                                              port)
+                except OSError:
+                    assert not task.done()
+                    await asyncio.sleep(0.05)
+                    continue
+                writer.close()
+                break
+            await check(port)
+        finally:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    asyncio.run(run())
+
+
+@pytest.fixture
+def credentials(tmp_path):
+    path = tmp_path / 'htpasswd'
+    write_credentials(path, PASSWORD)
+    return path
+
+
+@pytest.fixture
+def pool():
+    method = methods.get_method(authserver.SCHEMES[0])
+    with executors.HashPool(method, {}, 1, executors.THREAD,
+                            operation=executors.VERIFY_MIXED) as pool:
+        yield pool
+
+
+def make_server(credentials, pool, **kwargs):
+    verify_cache = cache.VerifyCache(maxsize=100)
+    index = authserver.CredentialIndex(str(credentials), cache=verify_cache,
+                                       interval=0)
+    index.load()
+    return authserver.AuthServer(index, pool, verify_cache=verify_cache,
+                                 **kwargs)
+
+
+def test_valid(credentials, pool):
+    async def check(port):
+        status, headers = await request(port, basic(USER, PASSWORD))
+        assert status == 200
+        assert headers['X-Auth-User'] == USER
+
+    run_server(make_server(credentials, pool), check)
+
+
+def test_invalid(credentials, pool):
+    async def check(port):
+        assert (await request(port, basic(USER, 'wrong')))[0] == 401
+        assert (await request(port, basic('bob', PASSWORD)))[0] == 401
+        status, headers = await request(port)
+        assert status == 401
+        assert headers['WWW-Authenticate'] == 'Basic realm="test"'
+
+    run_server(make_server(credentials, pool, realm='test'), check)
+
+
+def test_bad_request(credentials, pool):
+    async def check(port):
+        assert (await request(port, 'Basic !not-base64!'))[0] == 400
+        no_colon = base64.b64encode(b'alice').decode('ascii')
+        assert (await request(port, 'Basic ' + no_colon))[0] == 400
+
+    run_server(make_server(credentials, pool), check)
+
+
+def test_overloaded(credentials, pool):
+    async def check(port):
+        status, headers = await request(port, basic(USER, PASSWORD))
+        assert status == 503
+        assert headers['Retry-After'] == '1'
+
+    run_server(make_server(credentials, pool, max_pending=0), check)
+
+
+def test_reload(credentials, pool):
+    async def check(port):
+        assert (await request(port, basic(USER, PASSWORD)))[0] == 200
+        write_credentials(credentials, 'changed')
+        # the old password is cached, and must be dropped on reload
+        assert (await request(port, basic(USER, PASSWORD)))[0] == 401
+        assert (await request(port, basic(USER, 'changed')))[0] == 200
+
+    run_server(make_server(credentials, pool), check)
+
+
+@pytest.mark.parametrize('args', [
+    ['--max-pending', '-1'],
+    ['--max-pending', '0'],
+    ['--jobs', '0'],
+    ['--verify-cache-ttl', '0'],
+])
+def test_invalid_args(credentials, args):
+    with pytest.raises(SystemExit) as exc_info:
+        authserver.make_parser().parse_args([str(credentials)] + args)
+    assert exc_info.value.code == 2
+
+
+def test_reload_executor_warning(monkeypatch, caplog, credentials):
+    # md5_crypt scales with threads, sha512_crypt doesn't
+    monkeypatch.setattr(
+        executors, 'threads_scale',
+        lambda method, params, jobs, cache=None: method.name == 'md5_crypt')
+    method = methods.get_method(authserver.SCHEMES[0])
+    with executors.HashPool(method, {}, 2, executors.THREAD,
+                            operation=executors.VERIFY_MIXED) as pool:
+        server = make_server(credentials, pool)
+        assert authserver.select_executor(server.index, 2) == pool.kind
+
+        server.reload()
+        assert 'executor' not in caplog.text
+
+        with open(str(credentials), 'a') as f:
+            f.write('bob:{0}\n'.format(
+                methods.get_method('sha512_crypt')('x', rounds=1000)))
+        server.reload()
+        assert 'executor is used until restarted' in caplog.text
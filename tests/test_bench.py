@@ -0,0 +1,34 @@
+# encoding: utf-8
+"""
+Benchmark script setup.
+
+Only the parts that don't need a full benchmark run are tested here.
+"""
+import importlib.util
+import os
+
+import pytest
+
+from conftest import SRC_DIR
+
+BENCH_PATH = os.path.join(os.path.dirname(SRC_DIR), 'benchmarks', 'bench.py')
+
+
+@pytest.fixture
+def bench():
+    spec = importlib.util.spec_from_file_location('bench', BENCH_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_missing_baseline(bench, monkeypatch, tmp_path):
+    def run_benchmarks(*args, **kwargs):
+        raise AssertionError("benchmarks run without a baseline")
+
+    monkeypatch.setattr(bench, 'run_benchmarks', run_benchmarks)
+    baseline = str(tmp_path / 'baseline.json')
+    with pytest.raises(SystemExit) as exc_info:
+        bench.main(['--baseline', baseline])
+    assert 'no baseline in ' + baseline in exc_info.value.code
+    assert '--update' in exc_info.value.code
@@ -0,0 +1,39 @@
+# encoding: utf-8
+"""
+Verification cache.
+"""
+import io
+
+from passlib_cli import batch
+from passlib_cli import cache
+from passlib_cli import executors
+from passlib_cli import methods
+
+
+def test_keyed_lookup():
+    verify_cache = cache.VerifyCache(maxsize=10)
+    key = verify_cache.key('hash', 'password', 'user')
+    assert not verify_cache.lookup(key)
+    verify_cache.insert(key, 'hash')
+    assert verify_cache.lookup(key)
+    assert verify_cache.get('hash', 'password', 'user')
+    assert not verify_cache.get('hash', 'password')
+    verify_cache.discard_hash('hash')
+    assert not verify_cache.lookup(key)
+
+
+def test_verify_batch_counts():
+    method = methods.get_method('md5_crypt')
+    cryptstring = method('secret')
+    lines = ['{0}\tsecret\n'.format(cryptstring)] * 20
+    verify_cache = cache.VerifyCache(maxsize=10)
+    output = io.StringIO()
+    outcome = batch.verify_batch(method, {}, lines, output, jobs=2,
+                                 executor=executors.THREAD,
+                                 cache=verify_cache)
+    assert outcome.records == 20
+    assert outcome.errors == 0
+    stats = verify_cache.stats()
+    # only the first record is verified, the rest are cached or joined
+    assert stats['misses'] == 1
+    assert stats['hits'] + stats['coalesced'] == 19
@@ -0,0 +1,135 @@
+# encoding: utf-8
+"""
+Interrupted and resumed batch runs.
+
+A run is interrupted after some records, by an input that raises
+KeyboardInterrupt, and then resumed from its checkpoint.  The result must be
+the same as that of an uninterrupted run.
+"""
+import io
+import os
+import sqlite3
+import sys
+
+import pytest
+
+from passlib_cli import mkpasswd
+
+RECORDS = 50
+INTERVAL = 7
+INTERRUPT_AFTER = 23
+
+# unsalted, so that the output of each run is the same
+METHOD = 'hex_sha256'
+
+
+class InterruptingInput(io.BytesIO):
+    """ Input that is interrupted after a number of lines. """
+
+    def __init__(self, data, lines):
+        super(InterruptingInput, self).__init__(data)
+        self.lines = lines
+
+    def __next__(self):
+        if self.lines == 0:
+            raise KeyboardInterrupt()
+        self.lines -= 1
+        return super(InterruptingInput, self).__next__()
+
+
+def run(monkeypatch, raw, *args):
+    monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(raw))
+    with pytest.raises(SystemExit) as exc_info:
+        mkpasswd.main(['-q', '--executor', 'serial', '-j', '1'] +
+                      list(args))
+    return exc_info.value.code
+
+
+def make_input(records):
+    return ''.join('user{0}\tpassword{0}\n'.format(i)
+                   for i in range(records)).encode('utf-8')
+
+
+def run_interrupted(monkeypatch, data, *args):
+    """ Interrupt a run, and resume it. """
+    with pytest.raises(KeyboardInterrupt):
+        run(monkeypatch, InterruptingInput(data, INTERRUPT_AFTER), *args)
+    return run(monkeypatch, io.BytesIO(data), '--resume', *args)
+
+
+@pytest.fixture
+def data():
+    return make_input(RECORDS)
+
+
+@pytest.fixture
+def ckpt(tmp_path):
+    return ['--checkpoint', str(tmp_path / 'run.ckpt'),
+            '--checkpoint-interval', str(INTERVAL)]
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_resume_batch(monkeypatch, tmp_path, data, ckpt):
+    expected = tmp_path / 'expected.txt'
+    output = tmp_path / 'output.txt'
+    assert run(monkeypatch, io.BytesIO(data),
+               '--batch', '-o', str(expected), METHOD) is None
+    assert run_interrupted(monkeypatch, data, '--batch', '-o', str(output),
+                           *(ckpt + [METHOD])) is None
+    assert read_bytes(output) == read_bytes(expected)
+
+
+def test_resume_check(monkeypatch, tmp_path, data, ckpt):
+    hashes = tmp_path / 'hashes.txt'
+    run(monkeypatch, io.BytesIO(data), '--batch', '-o', str(hashes), METHOD)
+    # '<user><TAB><cryptstring><TAB><password>' records
+    records = b''.join(
+        line + b'\tpassword' + str(i).encode('ascii') + b'\n'
+        for i, line in enumerate(read_bytes(hashes).splitlines()))
+
+    expected = tmp_path / 'expected.txt'
+    output = tmp_path / 'output.txt'
+    assert run(monkeypatch, io.BytesIO(records),
+               '--check', '-o', str(expected), METHOD) is None
+    assert run_interrupted(monkeypatch, records, '--check', '-o', str(output),
+                           *(ckpt + [METHOD])) is None
+    assert read_bytes(output) == read_bytes(expected)
+
+
+def test_resume_sqlite(monkeypatch, tmp_path, data, ckpt):
+    db = tmp_path / 'output.db'
+    assert run_interrupted(monkeypatch, data, '--batch',
+                           '-o', 'sqlite:' + str(db),
+                           *(ckpt + [METHOD])) is None
+    conn = sqlite3.connect(str(db))
+    try:
+        rows = conn.execute("SELECT user FROM credentials").fetchall()
+    finally:
+        conn.close()
+    assert sorted(user for user, in rows) == sorted(
+        'user{0}'.format(i) for i in range(RECORDS))
+
+
+def test_resume_other_settings(monkeypatch, tmp_path, data, ckpt):
+    output = str(tmp_path / 'output.txt')
+    with pytest.raises(KeyboardInterrupt):
+        run(monkeypatch, InterruptingInput(data, INTERRUPT_AFTER),
+            '--batch', '-o', output, *(ckpt + [METHOD]))
+    code = run(monkeypatch, io.BytesIO(data), '--resume', '--batch',
+               '-o', output, *(ckpt + ['hex_sha512']))
+    assert 'different settings' in code
+
+
+def test_resume_short_output(monkeypatch, tmp_path, data, ckpt):
+    output = str(tmp_path / 'output.txt')
+    with pytest.raises(KeyboardInterrupt):
+        run(monkeypatch, InterruptingInput(data, INTERRUPT_AFTER),
+            '--batch', '-o', output, *(ckpt + [METHOD]))
+    os.truncate(output, 10)
+    code = run(monkeypatch, io.BytesIO(data), '--resume', '--batch',
+               '-o', output, *(ckpt + [METHOD]))
+    assert 'shorter than the checkpoint' in code
@@ -0,0 +1,54 @@
+# encoding: utf-8
+"""
+Conversion between equivalent hash formats.
+"""
+import io
+import sys
+
+import pytest
+
+from passlib_cli import convert
+from passlib_cli import methods
+from passlib_cli import mkpasswd
+
+
+def run(monkeypatch, capsys, stdin, *args):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO(stdin))
+    with pytest.raises(SystemExit) as exc_info:
+        mkpasswd.main(['-q'] + list(args))
+    return exc_info.value.code, capsys.readouterr().out
+
+
+@pytest.mark.parametrize('source, target, rounds', [
+    ('bcrypt', 'ldap_bcrypt', 4),
+    ('sha512_crypt', 'ldap_sha512_crypt', 1000),
+    ('pbkdf2_sha256', 'ldap_pbkdf2_sha256', 1000),
+])
+def test_round_trip(monkeypatch, capsys, source, target, rounds):
+    method = methods.get_method(source)
+    params = {'rounds': rounds}
+    cryptstrings = [method('password{0}'.format(i), **params)
+                    for i in range(3)]
+    records = ''.join('user{0}\t{1}\n'.format(i, c)
+                      for i, c in enumerate(cryptstrings))
+
+    code, converted = run(monkeypatch, capsys, records, source,
+                          '--convert', target)
+    assert code is None
+    assert converted != records
+    target_method = methods.get_method(target)
+    for i, line in enumerate(converted.splitlines()):
+        user, cryptstring = line.split('\t')
+        assert user == 'user{0}'.format(i)
+        assert target_method.verify('password{0}'.format(i), cryptstring)
+
+    code, restored = run(monkeypatch, capsys, converted, target,
+                         '--convert', source)
+    assert code is None
+    assert restored == records
+
+
+def test_not_equivalent():
+    with pytest.raises(ValueError):
+        convert.Converter(methods.get_method('bcrypt'),
+                          methods.get_method('md5_crypt'))
@@ -0,0 +1,53 @@
+# encoding: utf-8
+"""
+Executor selection, and worker startup.
+"""
+import io
+import multiprocessing
+import sys
+import time
+
+import pytest
+
+from passlib_cli import cli_utils
+from passlib_cli import executors
+from passlib_cli import methods
+from passlib_cli import mkpasswd
+
+
+def test_probe_params():
+    method = methods.get_method('sha512_crypt')
+    # far too expensive to probe with
+    params = {'rounds': 999999999}
+    start = time.perf_counter()
+    probe_params = executors.get_probe_params(method, params)
+    assert time.perf_counter() - start < 5
+    assert probe_params['rounds'] < params['rounds']
+    # probe results don't depend on the rounds
+    assert (executors.get_cache_key(method, params, 2) ==
+            executors.get_cache_key(method, {}, 2))
+
+
+def test_probe_params_without_rounds():
+    method = methods.get_method('md5_crypt')
+    assert executors.get_probe_params(method, {}) == {}
+
+
+@pytest.mark.skipif(not executors.can_fork(), reason="requires fork")
+def test_metrics_after_workers(monkeypatch, tmp_path):
+    workers = []
+
+    def setup_metrics(filename, interval=15.0):
+        workers.append(len(multiprocessing.active_children()))
+
+    monkeypatch.setattr(cli_utils, 'setup_metrics', setup_metrics)
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('alice\tsecret\n'))
+    output = tmp_path / 'output.txt'
+    with pytest.raises(SystemExit) as exc_info:
+        mkpasswd.main(['-q', '--batch', '--executor', 'prefork', '-j', '2',
+                       '--metrics-file', str(tmp_path / 'metrics.prom'),
+                       '-o', str(output), 'md5_crypt'])
+    assert exc_info.value.code is None
+    # started once, when the workers were running
+    assert workers == [2]
+    assert output.read_text().startswith('alice\t$1$')
@@ -0,0 +1,62 @@
+# encoding: utf-8
+"""
+Bulk password generation.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import SRC_DIR
+from passlib_cli import generate
+from passlib_cli import metrics
+
+
+class ClosingOutput(object):
+    """ An output that is closed by the reader after some lines. """
+
+    def __init__(self, path, lines):
+        self.file = open(path, 'w')
+        self.lines = lines
+        self.written = []
+
+    def write(self, data):
+        if len(self.written) == self.lines:
+            raise BrokenPipeError()
+        self.written.append(data)
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def flush(self):
+        pass
+
+
+def test_closed_output(monkeypatch, tmp_path, capsys):
+    registry = metrics.Metrics()
+    monkeypatch.setattr(metrics, 'registry', registry)
+    output = ClosingOutput(str(tmp_path / 'output'), 3)
+    monkeypatch.setattr(sys, 'stdout', output)
+    with pytest.raises(SystemExit) as exc_info:
+        generate.main(['-q', '-n', '100', '--unique'])
+    output.file.close()
+    assert exc_info.value.code is None
+    assert len(output.written) == 3
+    key = registry._key('records_total',
+                        {'operation': 'generate', 'method': 'genword'})
+    assert registry._counters[key] == 3
+    assert 'rejected 0 duplicates' in capsys.readouterr().err
+
+
+def test_closed_pipe():
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'passlib_cli.generate', '-n', '100000'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    assert proc.stdout.readline()
+    proc.stdout.close()
+    stderr = proc.stderr.read()
+    proc.stderr.close()
+    assert proc.wait() == 0
+    assert b'Traceback' not in stderr
@@ -0,0 +1,39 @@
+# encoding: utf-8
+"""
+Metrics output and options.
+"""
+import glob
+import os
+import re
+
+import pytest
+
+from conftest import SRC_DIR
+from passlib_cli import cache
+from passlib_cli import generate
+from passlib_cli import metrics
+
+
+def iter_metric_names():
+    # names only, e.g. not the 'verify_cache_' prefix
+    pattern = re.compile(r"registry\.(?:inc|set)\('([a-z_]+)'[,)]")
+    for filename in glob.glob(os.path.join(SRC_DIR, 'passlib_cli', '*.py')):
+        with open(filename) as f:
+            for name in pattern.findall(f.read()):
+                yield name
+    verify_cache = cache.VerifyCache()
+    for name in verify_cache.stats():
+        if name != 'entries':
+            yield 'verify_cache_' + name + '_total'
+
+
+@pytest.mark.parametrize('name', sorted(set(iter_metric_names())))
+def test_description(name):
+    assert name in metrics.DESCRIPTIONS
+
+
+@pytest.mark.parametrize('value', ['0', '-1', 'nan', 'inf', 'x'])
+def test_invalid_interval(value):
+    with pytest.raises(SystemExit) as exc_info:
+        generate.main(['--metrics-interval', value])
+    assert exc_info.value.code == 2
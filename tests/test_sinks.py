@@ -0,0 +1,95 @@
+# encoding: utf-8
+"""
+Batch output sinks.
+"""
+import threading
+import time
+
+import pytest
+
+from passlib_cli import sinks
+
+
+class FailingConnection(object):
+    """ A connection where writes, and rolling back, fail.
+
+    Writes fail once the queue is full, so that the producer is blocked
+    when the writer fails.
+    """
+
+    in_transaction = True
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.queue = None
+
+    def execute(self, sql, *args):
+        if sql == "ROLLBACK":
+            raise RuntimeError("rollback failed")
+        return self.conn.execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        deadline = time.monotonic() + 5
+        while not self.queue.full() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        raise RuntimeError("disk full")
+
+    def close(self):
+        self.conn.close()
+
+
+class FailingSink(sinks.SqliteSink):
+
+    def _connect(self):
+        return FailingConnection(super(FailingSink, self)._connect())
+
+    def _run(self):
+        self._conn.queue = self._queue
+        super(FailingSink, self)._run()
+
+
+def write_all(sink, count):
+    for i in range(count):
+        sink.write_record('user{0}'.format(i), 'hash')
+    sink.close()
+
+
+def test_sqlite_write_error(tmp_path):
+    sink = FailingSink(str(tmp_path / 'output.db'))
+    errors = []
+
+    def run():
+        try:
+            # more than fits in the queue
+            write_all(sink, sinks.CHUNK_SIZE * (sinks.MAX_PENDING + 4))
+        except IOError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive(), "writer blocked"
+    assert len(errors) == 1
+    assert 'disk full' in str(errors[0])
+
+
+def test_sqlite_upsert(tmp_path):
+    filename = str(tmp_path / 'output.db')
+    with sinks.SqliteSink(filename) as sink:
+        sink.write_record('alice', 'old')
+        sink.write_record('bob', 'hash')
+        sink.write_record('alice', 'new')
+    import sqlite3
+    conn = sqlite3.connect(filename)
+    try:
+        rows = conn.execute(
+            "SELECT user, hash FROM credentials ORDER BY user").fetchall()
+    finally:
+        conn.close()
+    assert rows == [('alice', 'new'), ('bob', 'hash')]
+
+
+def test_sqlite_missing_user(tmp_path):
+    with sinks.SqliteSink(str(tmp_path / 'output.db')) as sink:
+        with pytest.raises(ValueError):
+            sink.write_record(None, 'hash')
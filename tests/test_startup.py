@@ -0,0 +1,84 @@
+# encoding: utf-8
+"""
+Startup import budget for all console scripts.
+
+Each script is run with `--version` under `python -X importtime`.  Imports
+done by the interpreter itself are left out, and the rest must not include
+passlib, and must stay within the budget.
+
+The budget is relative to the time the interpreter spends on its own startup
+imports, so that it holds on slower or loaded hosts.  Set
+PASSLIB_CLI_IMPORT_BUDGET to change it.
+"""
+import configparser
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import SRC_DIR
+
+ROOT_DIR = os.path.dirname(SRC_DIR)
+
+# max total import time, as a multiple of the interpreter startup imports
+IMPORT_BUDGET = float(os.environ.get('PASSLIB_CLI_IMPORT_BUDGET', 15))
+
+# runs per measurement - the best run is used, as the least affected by load
+REPEAT = 3
+
+
+def get_console_scripts():
+    config = configparser.ConfigParser()
+    config.read(os.path.join(ROOT_DIR, 'setup.cfg'))
+    scripts = config['options.entry_points']['console_scripts']
+    for line in scripts.strip().splitlines():
+        name, _, entry_point = line.partition('=')
+        yield name.strip(), entry_point.strip().partition(':')[0]
+
+
+def get_imports(code):
+    """ Run code with -X importtime, and get (module, self time) tuples. """
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        env=env, universal_newlines=True, check=True)
+    imports = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or '[us]' in line:
+            continue
+        self_time, _, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(self_time)))
+    return imports
+
+
+def get_best_imports(code):
+    """ Get the imports of the run with the lowest total import time. """
+    return min((get_imports(code) for _ in range(REPEAT)),
+               key=lambda imports: sum(us for _, us in imports))
+
+
+@pytest.fixture(scope='module')
+def interpreter_imports():
+    """ Get the names and total time of the interpreter startup imports. """
+    imports = get_best_imports('pass')
+    return set(name for name, _ in imports), sum(us for _, us in imports)
+
+
+@pytest.mark.parametrize('script, module', list(get_console_scripts()))
+def test_version_import_budget(script, module, interpreter_imports):
+    code = (
+        "import sys; sys.argv = [{0!r}, '--version']\n"
+        "from {1} import main\n"
+        "try:\n    main()\nexcept SystemExit:\n    pass"
+    ).format(script, module)
+    startup_names, startup_time = interpreter_imports
+    imports = [(name, us) for name, us in get_best_imports(code)
+               if name not in startup_names]
+    names = [name for name, _ in imports]
+    assert module in names
+    assert not [n for n in names if n.split('.')[0] == 'passlib'], names
+    total = sum(us for _, us in imports)
+    assert total < IMPORT_BUDGET * startup_time, (
+        total, startup_time, sorted(imports, key=lambda i: -i[1])[:10])
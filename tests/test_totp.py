@@ -0,0 +1,74 @@
+# encoding: utf-8
+"""
+TOTP provisioning and verification.
+"""
+import io
+import sys
+
+import pytest
+
+from passlib_cli import totp
+from passlib_cli import totp_state
+
+
+def run(*args):
+    with pytest.raises(SystemExit) as exc_info:
+        totp.main(['-q'] + list(args))
+    return exc_info.value.code
+
+
+def test_provision(tmp_path):
+    labels = tmp_path / 'labels.txt'
+    labels.write_text('alice@example.com\n\nbob@example.com\n')
+    output = tmp_path / 'secrets.txt'
+    assert run('--new', '--labels', str(labels), '--issuer', 'Acme',
+               '-o', str(output)) is None
+    records = [line.split('\t') for line in output.read_text().splitlines()]
+    assert [label for label, _ in records] == ['alice@example.com',
+                                               'bob@example.com']
+    for label, secret in records:
+        obj = totp.get_totp(secret)
+        assert obj.label == label
+        assert obj.issuer == 'Acme'
+
+
+def test_provision_missing_secrets(tmp_path):
+    labels = tmp_path / 'labels.txt'
+    labels.write_text('alice@example.com\n')
+    output = tmp_path / 'secrets.txt'
+    output.write_text('keep\n')
+    code = run('--new', '--labels', str(labels),
+               '--secrets', str(tmp_path / 'missing'), '-o', str(output))
+    assert 'unable to read' in code
+    # the output is left as is
+    assert output.read_text() == 'keep\n'
+
+
+def test_provision_missing_labels(tmp_path):
+    code = run('--new', '--labels', str(tmp_path / 'missing'))
+    assert 'unable to read' in code
+
+
+def test_verify_batch(tmp_path):
+    obj = totp.get_totp_factory()(new=True)
+    secret = obj.base32_key
+    token = totp.get_token(obj).token
+    lines = ['{0} {1}\n'.format(secret, token),
+             '{0} {1}\n'.format(secret, token),
+             'invalid\n']
+    store = totp_state.TotpStateStore(str(tmp_path / 'state.db'))
+    try:
+        results = list(totp.verify_batch(lines, store=store))
+    finally:
+        store.close()
+    assert results == [totp.VERIFY_OK, totp.VERIFY_REPLAYED,
+                       totp.VERIFY_INVALID]
+
+
+def test_verify_token(monkeypatch, capsys):
+    obj = totp.get_totp_factory()(new=True)
+    monkeypatch.setattr(sys, 'stdin', io.StringIO(obj.base32_key + '\n'))
+    token = totp.get_token(obj).token
+    wrong = '{0:06d}'.format((int(token) + 1) % 1000000)
+    assert run('--verify', wrong) == 1
+    assert capsys.readouterr().out.strip() == totp.VERIFY_INVALID
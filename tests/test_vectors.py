@@ -0,0 +1,45 @@
+# encoding: utf-8
+"""
+Known-answer test vectors.
+
+Vectors made with --make-vectors must check out with --check-vectors.
+"""
+import io
+import json
+import sys
+
+import pytest
+
+from passlib_cli import mkpasswd
+from passlib_cli import vectors
+
+
+def run(monkeypatch, stdin, *args):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO(stdin))
+    with pytest.raises(SystemExit) as exc_info:
+        mkpasswd.main(['-q', '-j', '1'] + list(args))
+    return exc_info.value.code
+
+
+def test_make_and_check(monkeypatch, capsys, tmp_path):
+    # empty lines are skipped
+    assert run(monkeypatch, 'hunter2\n\n', '--make-vectors') is None
+    made = capsys.readouterr().out
+    assert made
+    assert all(json.loads(line)['password'] == 'hunter2'
+               for line in made.splitlines())
+
+    path = tmp_path / 'vectors.jsonl'
+    path.write_text(made)
+    assert run(monkeypatch, '', '--check-vectors', str(path)) is None
+    assert capsys.readouterr().out == ''
+
+
+def test_unidentified_hash():
+    # an empty ldap_plaintext hash is not identified as ldap_plaintext
+    output = io.StringIO()
+    vectors.make_vectors([''], {}, output)
+    made = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert 'ldap_plaintext' not in [v['method'] for v in made]
+    # only reported as a method without vectors
+    assert vectors.check_vectors(made, io.StringIO()) == 1